@@ -10,10 +10,21 @@ from multi_agent_orchestrator.agents import (BedrockLLMAgent,
  AgentCallbacks)
 from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
 from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
+from runner import AsyncRunner, get_client
+from model_router import ModelRouter, ModelRouterOptions, ModelTarget
+from classifier_cache import CachingClassifier, CachingClassifierOptions
+from pre_classifier import PreClassifier, PreClassifierOptions
+from session_storage import SessionChatStorage, SessionChatStorageOptions
 
 
 MODELID= 'us.amazon.nova-pro-v1:0'
 
+# one pooled client shared by the classifier and all agents
+bedrock_client = get_client('bedrock-runtime', region_name='us-east-1')
+
+# classifier calls slower than the recent p90 are duplicated in us-west-2 (at most 10% extra calls)
+classifier_client = ModelRouter([ModelTarget('us-east-1', MODELID, bedrock_client), ModelTarget('us-west-2', MODELID)],
+                                ModelRouterOptions(hedge=True, hedge_percentile=90, hedge_budget=0.1))
 
 #The default classifier is Claude, here I create a custom classifier 
 custom_bedrock_classifier = BedrockClassifier(BedrockClassifierOptions(
@@ -23,13 +34,38 @@ custom_bedrock_classifier = BedrockClassifier(BedrockClassifierOptions(
         'maxTokens': 500,
         'temperature': 0.7,
         'topP': 0.9
-    }
+    },
+    client=classifier_client
 ))
 
 
+# cache routing decisions so repeated / near-identical questions skip the classifier call
+cached_classifier = CachingClassifier(CachingClassifierOptions(
+    classifier=custom_bedrock_classifier,
+    mode='semantic',  # lexical n-grams: only near-duplicate inputs share a decision
+    ttl=3600,
+    max_entries=1000,
+))
+
+# answer obvious routing locally, only unsure inputs reach the cache / LLM classifier
+pre_classifier = PreClassifier(PreClassifierOptions(
+    classifier=cached_classifier,
+    threshold=0.5,
+    routing_log='routing_log.jsonl',
+))
+
+# bounded per-session history: ring buffers, idle eviction, old turns folded into a summary
+session_storage = SessionChatStorage(SessionChatStorageOptions(
+    max_messages=20,
+    idle_ttl=1800,
+    summarize_after=12,
+    keep_recent=6,
+))
+
 #Create an Orchestrator:
 orchestrator = MultiAgentOrchestrator(
-    classifier=custom_bedrock_classifier,
+    classifier=pre_classifier,
+    storage=session_storage,
                                       
     options=OrchestratorConfig(
         LOG_AGENT_CHAT=True,
@@ -53,6 +89,7 @@ tech_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
   name="Tech Agent",
   streaming=True,
   model_id=MODELID,
+  client=bedrock_client,
   description="Specializes in technology areas including software development, hardware, AI, \
   cybersecurity, blockchain, cloud computing, emerging tech innovations, and pricing/costs \
   related to technology products and services.",
@@ -64,6 +101,7 @@ health_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
   name="Health Agent",
   streaming=True,
   model_id=MODELID,
+  client=bedrock_client,
   description="Focuses on health and medical topics such as general wellness, nutrition, diseases, treatments, mental health, fitness, healthcare systems, and medical terminology or concepts.",
   callbacks=BedrockLLMAgentCallbacks()
 ))
@@ -76,6 +114,10 @@ async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str
     # Print metadata
     print("\nMetadata:")
     print(f"Selected Agent: {response.metadata.agent_name}")
+    print(f"Pre-classifier: {pre_classifier.stats()}")
+    print(f"Classifier cache: {cached_classifier.stats()}")
+    print(f"Classifier hedging: {classifier_client.hedge_stats()}")
+    print(f"Chat storage: {session_storage.stats()}")
     if response.metadata.agent_name == 'No Agent':
         print('Response:', response)
     elif response.streaming:
@@ -86,12 +128,14 @@ async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str
 if __name__ == "__main__":
     USER_ID = "user123"
     SESSION_ID = str(uuid.uuid4())
+    runner = AsyncRunner()
     print("Welcome to the interactive Multi-Agent system. Type 'quit' to exit.")
     while True:
         # Get user input
         user_input = input("\nYou: ").strip()
         if user_input.lower() == 'quit':
             print("Exiting the program. Goodbye!")
+            runner.close()
             sys.exit()
         # Run the async function
-        asyncio.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
+        runner.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
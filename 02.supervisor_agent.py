@@ -12,6 +12,7 @@ from multi_agent_orchestrator.agents import (BedrockLLMAgent,SupervisorAgent,Ama
  AgentCallbacks)
 from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
 from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
+from runner import AsyncRunner, get_client
 import boto3
 import dotenv
 import os
@@ -19,7 +20,7 @@ dotenv.load_dotenv()
 
 MODELID= 'us.amazon.nova-pro-v1:0'
 # MODELID= "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-custom_client = boto3.client('bedrock-runtime',
+custom_client = get_client('bedrock-runtime',
                              aws_access_key_id=os.environ['ACCESS_KEY_ID'],
                              aws_secret_access_key=os.environ['SECRET_ACCESS_KEY'],
                              config = boto3.session.Config(
@@ -148,15 +149,17 @@ async def simple_handle_request(agent, _user_input: str, _user_id: str, _session
 if __name__ == "__main__":
     USER_ID = "user123"
     SESSION_ID = str(uuid.uuid4())
+    runner = AsyncRunner()
     print("Welcome to the interactive Multi-Agent system. Type 'quit' to exit.")
     while True:
         # Get user input
         user_input = input("\nYou: ").strip()
         if user_input.lower() == 'quit':
             print("Exiting the program. Goodbye!")
+            runner.close()
             sys.exit()
         # Run the async function
-        asyncio.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
-        # asyncio.run(simple_handle_request(bedrock_agent, user_input, USER_ID, SESSION_ID))
+        runner.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
+        # runner.run(simple_handle_request(bedrock_agent, user_input, USER_ID, SESSION_ID))
 
 
@@ -12,13 +12,15 @@ from multi_agent_orchestrator.agents import (
  SupervisorAgentOptions,
  AmazonBedrockAgentOptions,
  AgentResponse,
- ChainAgent, 
- ChainAgentOptions,
  ComprehendFilterAgent,
  ComprehendFilterAgentOptions,
  AgentCallbacks)
 from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
 from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
+from batch_runner import BatchOptions, BatchRunner, read_documents
+from governor import GovernorOptions, RequestGovernor
+from graph_agent import GraphAgent, GraphAgentOptions, GraphNode
+from runner import AsyncRunner, get_client
 import boto3
 import dotenv
 import os
@@ -26,7 +28,7 @@ dotenv.load_dotenv()
 
 MODELID= 'us.amazon.nova-lite-v1:0'
 # MODELID= "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-custom_client = boto3.client('bedrock-runtime',
+custom_client = get_client('bedrock-runtime',
                              aws_access_key_id=os.environ['ACCESS_KEY_ID'],
                              aws_secret_access_key=os.environ['SECRET_ACCESS_KEY'],
                              config = boto3.session.Config(
@@ -45,6 +47,7 @@ llm_config= dict(
         'temperature': 0.7,
         'topP': 0.9
     },
+    client=get_client('bedrock-runtime', region_name='us-east-1'),
     # client=custom_client
 )
 
@@ -52,6 +55,7 @@ llm_config= dict(
 translate_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
     name='Translation  Agent',
     description='Translation Agent',
+    streaming=True,
     **llm_config
 ))
 
@@ -65,6 +69,7 @@ Do not provide any explanations or text apart from the translation.
 review_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
     name='Review Agent',
     description='Review Agent reviews the translations',
+    streaming=True,
     **llm_config
 ))
 
@@ -91,6 +96,7 @@ Output only the suggestions and nothing else.
 translate_agent_2 = BedrockLLMAgent(BedrockLLMAgentOptions(
     name='Chief Translation Agent',
     description='Chief Translation Agent for final translation',
+    streaming=True,
     **llm_config
 ))
 
@@ -98,9 +104,7 @@ translate_agent_2.set_system_prompt(
 template = """
 You are an expert linguist, specializing in translation from {{source_lang}}to {{target_lang}}.
 Your task is to carefully read, then edit, a translation from {{source_lang}} to {{target_lang}}, taking into account a list of expert suggestions and constructive criticisms.
-You will be provided with the source text, the initial translation, and the expert linguist suggestions,
-## The source text as follows:
-{{user_input}}
+You will be provided with the source text, the initial translation, and the expert linguist suggestions.
 
 Please take into account the expert suggestions when editing the translation. Edit the translation by ensuring:
 (i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),
@@ -117,10 +121,22 @@ Output only the new translation and nothing else.
 # ))
 
 
-chain_agent = ChainAgent(ChainAgentOptions(
+# each node declares its inputs: 'input' is the source text, the rest are earlier nodes
+chain_agent = GraphAgent(GraphAgentOptions(
     name='TranslationChainAgent',
     description='A simple translation chain of multiple agents',
-    agents=[translate_agent, review_agent,translate_agent_2]
+    nodes=[
+        GraphNode(name='translation', agent=translate_agent, inputs=['input']),
+        GraphNode(name='review', agent=review_agent, inputs=['input', 'translation'],
+                  template="## Source text\n{{input}}\n\n## Translation\n{{translation}}"),
+        GraphNode(name='final', agent=translate_agent_2, inputs=['input', 'translation', 'review'],
+                  template="## Source text\n{{input}}\n\n## Initial translation\n{{translation}}"
+                           "\n\n## Expert suggestions\n{{review}}"),
+    ],
+    streaming=True,
+    callbacks=BedrockLLMAgentCallbacks(),
+    # `python 03.sequential_agent.py --incremental` pipes sentence chunks through the stages
+    incremental='--incremental' in sys.argv,
 ))
 
 orchestrator = MultiAgentOrchestrator(
@@ -140,13 +156,21 @@ orchestrator = MultiAgentOrchestrator(
 
 orchestrator.add_agent(chain_agent)
 
+# one AIMD concurrency limit + retry budget per (region, model) for the classifier and every agent
+governor = RequestGovernor(GovernorOptions(initial_concurrency=8, max_retries=4))
+governor.govern(orchestrator)
+
 async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str, _user_id: str, _session_id: str):
-    response: AgentResponse = await _orchestrator.route_request(_user_input, _user_id, _session_id)
+    response: AgentResponse = await _orchestrator.route_request(_user_input, _user_id, _session_id, {})
     # Print metadata
     print("\nMetadata:")
     print(f"Selected Agent: {response.metadata.agent_name}")
+    print(f"Node timings: {response.metadata.additional_params.get('node_timings')}")
+    print(f"Request governor: {governor.stats()}")
     if response.metadata.agent_name == 'No Agent':
         print('Response:', response)
+    elif response.streaming:
+        print(f"First token: {response.metadata.additional_params.get('first_token_ms')}ms")
     else:
         print('Response:', response.output.content[0]['text'])
 
@@ -162,16 +186,36 @@ if __name__ == "__main__":
     review_agent.set_system_prompt(variables = {"source_lang":"English",
                                                  "target_lang":"Chinese",
                                                    "country":"China" })
+    translate_agent_2.set_system_prompt(variables = {"source_lang":"English", "target_lang":"Chinese"})
     USER_ID = "user123"
     SESSION_ID = str(uuid.uuid4())
+    runner = AsyncRunner()
+    if '--batch' in sys.argv:
+        # python 03.sequential_agent.py --batch corpus.txt --output translations.jsonl --in-flight 8
+        import argparse
+        parser = argparse.ArgumentParser(description='Translate a corpus with the translation chain.')
+        parser.add_argument('--batch', required=True, help='source file: blank-line separated paragraphs or .jsonl')
+        parser.add_argument('--output', default='translations.jsonl', help='results JSONL, also the resume checkpoint')
+        parser.add_argument('--in-flight', type=int, default=8)
+        parser.add_argument('--incremental', action='store_true', help='pipe sentence chunks through the stages')
+        args = parser.parse_args()
+        chain_agent.streaming = False
+        chain_agent.incremental = args.incremental
+        chain_agent.raise_errors = True  # let throttling reach the batch runner's backoff
+        stats = runner.run(BatchRunner(chain_agent, BatchOptions(output_path=args.output,
+                                                                 max_in_flight=args.in_flight))
+                           .run(read_documents(args.batch)))
+        print(f"Batch finished: {stats}")
+        runner.close()
+        sys.exit()
     print("Welcome to the interactive Multi-Agent system. Type 'quit' to exit.")
     while True:
         # Get user input
         user_input = input("\nYou: ").strip()
         if user_input.lower() == 'quit':
             print("Exiting the program. Goodbye!")
+            runner.close()
             sys.exit()
         # Run the async function
-        # asyncio.run(simple_handle_request(chain_agent, user_input, USER_ID, SESSION_ID))
-        translate_agent_2.set_system_prompt(variables = {"source_lang":"English", "target_lang":"Chinese", "user_input":user_input })
-        asyncio.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
+        # runner.run(simple_handle_request(chain_agent, user_input, USER_ID, SESSION_ID))
+        runner.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
@@ -2,6 +2,7 @@ import asyncio
 import uuid
 import sys
 from multi_agent_orchestrator.agents import BedrockInlineAgent, BedrockInlineAgentOptions
+from inline_agent import WarmInlineAgent, WarmInlineAgentOptions
 import boto3
 import dotenv
 import os
@@ -41,7 +42,10 @@ knowledge_bases = [
     }
 ]
 
-bedrock_inline_agent = BedrockInlineAgent(BedrockInlineAgentOptions(
+# both knowledge bases are queried in parallel while the model plans the inline agent;
+# only the fused (RRF) and deduplicated top 5 passages are passed on to it.
+# follow-up turns reuse the planned configuration and its warm inline agent session
+bedrock_inline_agent = WarmInlineAgent(WarmInlineAgentOptions(
     name="Inline Agent Creator for Agents for Amazon Bedrock",
     description="Specalized in creating Agent to solve customer request dynamically. You are provided with a list of Action groups and Knowledge bases which can help you in answering customer request",
     action_groups_list=action_groups_list,
@@ -51,6 +55,9 @@ bedrock_inline_agent = BedrockInlineAgent(BedrockInlineAgentOptions(
                     region_name='us-east-1'
                 ),
     knowledge_bases=knowledge_bases,
+    results_per_kb=5,
+    top_k=5,
+    idle_session_ttl=1800,
 ))
 
 async def run_inline_agent(user_input, user_id, session_id):
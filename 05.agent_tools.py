@@ -11,10 +11,17 @@ from multi_agent_orchestrator.agents import (BedrockLLMAgent,
 from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
 from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
 from multi_agent_orchestrator.utils import AgentTool,AgentTools
+from runner import AsyncRunner, get_client
+from pre_classifier import PreClassifier, PreClassifierOptions
+from sqlite_chat_storage import SqliteChatStorage, SqliteChatStorageOptions
+from tool_utils import AsyncAgentTools, MemoizedAgentTool, ToolLimits, record_tool_metrics
 
 
 MODELID= 'us.amazon.nova-pro-v1:0'
 
+# one pooled client shared by the classifier and all agents
+bedrock_client = get_client('bedrock-runtime', region_name='us-east-1')
+
 
 #The default classifier is Claude, here I create a custom classifier 
 custom_bedrock_classifier = BedrockClassifier(BedrockClassifierOptions(
@@ -24,13 +31,25 @@ custom_bedrock_classifier = BedrockClassifier(BedrockClassifierOptions(
         'maxTokens': 500,
         'temperature': 0.7,
         'topP': 0.9
-    }
+    },
+    client=bedrock_client
+))
+
+# answer obvious routing locally, only unsure inputs reach the LLM classifier
+pre_classifier = PreClassifier(PreClassifierOptions(
+    classifier=custom_bedrock_classifier,
+    threshold=0.5,
+    routing_log='routing_log.jsonl',
 ))
 
 
 #Create an Orchestrator:
+# durable history in a local SQLite file (WAL mode, batched writes off the event loop)
+chat_storage = SqliteChatStorage(SqliteChatStorageOptions(path='chat_history.db'))
+
 orchestrator = MultiAgentOrchestrator(
-    classifier=custom_bedrock_classifier,
+    classifier=pre_classifier,
+    storage=chat_storage,
                                       
     options=OrchestratorConfig(
         LOG_AGENT_CHAT=True,
@@ -59,21 +78,23 @@ def get_weather(location: str, units: str = "celsius") -> str:
     """
     return f'It is sunny in {location} with 30 {units}!'
 
-weather_tool = AgentTool(
+# repeated lookups for the same city are answered from a 10 minute cache
+weather_tool = MemoizedAgentTool(AgentTool(
     name="weather_tool",
     func=get_weather,
     enum_values={"units": ["celsius", "fahrenheit"]}
-)
+), ttl=600, case_insensitive=['location', 'units'])
 
 
 weather_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
   name="Weather Agent",
   streaming=True,
   model_id=MODELID,
+  client=bedrock_client,
   description="Provide weather report",
   callbacks=BedrockLLMAgentCallbacks(),
    tool_config={
-        'tool': AgentTools([weather_tool]),
+        'tool': AsyncAgentTools([weather_tool], limits={'weather_tool': ToolLimits(timeout=10)}),
         'toolMaxRecursions': 5,
     },
 ))
@@ -84,6 +105,7 @@ health_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
   name="Health Agent",
   streaming=True,
   model_id=MODELID,
+  client=bedrock_client,
   description="Focuses on health and medical topics such as general wellness, nutrition, diseases, treatments, mental health, fitness, healthcare systems, and medical terminology or concepts.",
   callbacks=BedrockLLMAgentCallbacks()
 ))
@@ -92,10 +114,14 @@ orchestrator.add_agent(health_agent)
 
 
 async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str, _user_id: str, _session_id: str):
-    response: AgentResponse = await _orchestrator.route_request(_user_input, _user_id, _session_id)
+    params = {}
+    with record_tool_metrics(params):
+        response: AgentResponse = await _orchestrator.route_request(_user_input, _user_id, _session_id, params)
     # Print metadata
     print("\nMetadata:")
     print(f"Selected Agent: {response.metadata.agent_name}")
+    print(f"Pre-classifier: {pre_classifier.stats()}")
+    print(f"Tool metrics: {response.metadata.additional_params.get('tool_metrics')}")
     if response.metadata.agent_name == 'No Agent':
         print('Response:', response)
     elif response.streaming:
@@ -106,12 +132,15 @@ async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str
 if __name__ == "__main__":
     USER_ID = "user123"
     SESSION_ID = str(uuid.uuid4())
+    runner = AsyncRunner()
     print("Welcome to the interactive Multi-Agent system. Type 'quit' to exit.")
     while True:
         # Get user input
         user_input = input("\nYou: ").strip()
         if user_input.lower() == 'quit':
             print("Exiting the program. Goodbye!")
+            runner.close()
+            chat_storage.close()
             sys.exit()
         # Run the async function
-        asyncio.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
+        runner.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
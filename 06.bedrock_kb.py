@@ -12,10 +12,16 @@ from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
 from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
 from multi_agent_orchestrator.utils import AgentTool,AgentTools
 from multi_agent_orchestrator.retrievers import AmazonKnowledgeBasesRetriever, AmazonKnowledgeBasesRetrieverOptions
+from runner import AsyncRunner, get_client
+from kb_cache import CachingRetriever, CachingRetrieverOptions
+from prefetch import PrefetchingOrchestrator, PrefetchingRetriever
 
 
 MODELID= 'us.amazon.nova-pro-v1:0'
 
+# one pooled client shared by the classifier and all agents
+bedrock_client = get_client('bedrock-runtime', region_name='us-east-1')
+
 
 #The default classifier is Claude, here I create a custom classifier 
 custom_bedrock_classifier = BedrockClassifier(BedrockClassifierOptions(
@@ -25,12 +31,14 @@ custom_bedrock_classifier = BedrockClassifier(BedrockClassifierOptions(
         'maxTokens': 500,
         'temperature': 0.7,
         'topP': 0.9
-    }
+    },
+    client=bedrock_client
 ))
 
 
 #Create an Orchestrator:
-orchestrator = MultiAgentOrchestrator(
+# starts the knowledge base lookup while the classifier is still running
+orchestrator = PrefetchingOrchestrator(
     classifier=custom_bedrock_classifier,
                                       
     options=OrchestratorConfig(
@@ -71,6 +79,7 @@ weather_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
   name="Weather Agent",
   streaming=True,
   model_id=MODELID,
+  client=bedrock_client,
   description="Provide weather report",
   callbacks=BedrockLLMAgentCallbacks(),
    tool_config={
@@ -92,12 +101,18 @@ retriever=AmazonKnowledgeBasesRetriever(AmazonKnowledgeBasesRetrieverOptions(
             },
         ))
 
+# repeated / near-identical questions are answered from the cache; the lookup starts
+# concurrently with classification and is dropped when another agent is selected
+kb_retriever = PrefetchingRetriever(CachingRetriever(CachingRetrieverOptions(retriever=retriever, cache_ttl=900)))
+
 knowledge_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
   name="Knowledage Agent",
   streaming=True,
   model_id=MODELID,
+  client=bedrock_client,
   description="Knowledge of Amazon Generative AI services and products, such as Bedrock, SageMaker etc.",
-  callbacks=BedrockLLMAgentCallbacks()
+  callbacks=BedrockLLMAgentCallbacks(),
+  retriever=kb_retriever
 ))
 orchestrator.add_agent(knowledge_agent)
 
@@ -106,6 +121,7 @@ health_agent = BedrockLLMAgent(BedrockLLMAgentOptions(
   name="Health Agent",
   streaming=True,
   model_id=MODELID,
+  client=bedrock_client,
   description="Focuses on health and medical topics such as general wellness, nutrition, diseases, treatments, mental health, fitness, healthcare systems, and medical terminology or concepts.",
   callbacks=BedrockLLMAgentCallbacks()
 ))
@@ -124,16 +140,21 @@ async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str
         print('Response:', response.output.content[0]['text'])
     else:
         print('Response:', response.output.content[0]['text'])
+    if response.metadata.agent_name == knowledge_agent.name:
+        print(f"KB prefetch: {kb_retriever.stats()}, cache: {kb_retriever.retriever.stats()}")
 
 if __name__ == "__main__":
     USER_ID = "user123"
     SESSION_ID = str(uuid.uuid4())
+    runner = AsyncRunner()
     print("Welcome to the interactive Multi-Agent system. Type 'quit' to exit.")
     while True:
         # Get user input
         user_input = input("\nYou: ").strip()
         if user_input.lower() == 'quit':
             print("Exiting the program. Goodbye!")
+            kb_retriever.shutdown()
+            runner.close()
             sys.exit()
         # Run the async function
-        asyncio.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
+        runner.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
\ No newline at end of file
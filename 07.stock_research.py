@@ -13,6 +13,13 @@ from multi_agent_orchestrator.agents import (BedrockLLMAgent,SupervisorAgent,Ama
 from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
 from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
 from multi_agent_orchestrator.utils import AgentTool,AgentTools
+from parallel_supervisor import ParallelSupervisorAgent, ParallelSupervisorAgentOptions
+from tool_utils import AsyncAgentTools, MemoizedAgentTool, ToolLimits, record_tool_metrics
+from governor import GovernorOptions, RequestGovernor
+from model_router import ModelRouter, ModelRouterOptions, ModelTarget
+from streaming import StreamMultiplexer
+from runner import run_in_thread
+from tracing import JsonlExporter, OtlpHttpExporter, Tracer
 import boto3
 import dotenv
 import os
@@ -29,10 +36,12 @@ custom_client = boto3.client('bedrock-runtime',
                                  connect_timeout=120
                              ))
 
-class BedrockLLMAgentCallbacks(AgentCallbacks):
-    def on_llm_new_token(self, token: str) -> None:
-        # handle response streaming here
-        print(token, end='', flush=True)
+# every session gets its own token stream, labelled with the agent that produced it
+stream_mux = StreamMultiplexer()
+
+# calls go to the healthiest region (us-west-2 first), failing over on throttling and hedging slow calls
+model_router = ModelRouter([ModelTarget(region, MODELID) for region in ('us-west-2', 'us-east-1', 'us-east-2')],
+                           ModelRouterOptions(hedge=True))
 
 llm_config= dict(
     model_id=MODELID,
@@ -41,6 +50,7 @@ llm_config= dict(
         'maxTokens': 3000,
         'temperature': 0.2,
     },
+    client=model_router,
     # client=custom_client
 )
 
@@ -75,15 +85,16 @@ def get_news(query: str) -> List[Dict[str, str]]:
     ]
     return json.dumps(ret)
 
-get_stock_data_tool = AgentTool(
+# the analysts often ask for the same symbol / query several times within one task
+get_stock_data_tool = MemoizedAgentTool(AgentTool(
     name="get_stock_data",
     func=get_stock_data,
-)
+), ttl=300, case_insensitive=['symbol'])
 
-get_news_tool = AgentTool(
+get_news_tool = MemoizedAgentTool(AgentTool(
     name="get_news",
     func=get_news,
-)
+), ttl=900, case_insensitive=['query'])
 
 
 
@@ -106,7 +117,7 @@ orchestrator = MultiAgentOrchestrator(
 
 
 # Create and configure SupervisorAgent as sub agent for another SupervisorAgent
-planner = SupervisorAgent(SupervisorAgentOptions(
+planner = ParallelSupervisorAgent(ParallelSupervisorAgentOptions(
     name =  "SupervisorAgent",
     description =  "You are a supervisor agent that manages the team of agents for deep research",
     lead_agent=BedrockLLMAgent(BedrockLLMAgentOptions(
@@ -119,12 +130,13 @@ planner = SupervisorAgent(SupervisorAgentOptions(
     - News Analyst: For news gathering and analysis
     - Writer: For compiling final report
     Always send your plan first, then handoff to appropriate agent.
-    Always handoff to a single agent at a time.
+    Financial Analyst and News Analyst are independent: send both of their tasks in the same send_messages call.
+    Handoff to the Writer only after both analyses are back.
     Use TERMINATE when research is complete."""
                                   },
         **llm_config,
         streaming= True,
-        callbacks=BedrockLLMAgentCallbacks(),
+        callbacks=stream_mux.callbacks('planner-manager'),
     )),
     team=[
         BedrockLLMAgent(BedrockLLMAgentOptions(
@@ -138,9 +150,9 @@ planner = SupervisorAgent(SupervisorAgentOptions(
                                   },
              **llm_config,
             streaming= True,
-            callbacks=BedrockLLMAgentCallbacks(),
+            callbacks=stream_mux.callbacks('financial_analyst'),
             tool_config={
-                'tool': AgentTools([get_stock_data_tool]),
+                'tool': AsyncAgentTools([get_stock_data_tool], limits={'get_stock_data': ToolLimits(timeout=30)}),
                 'toolMaxRecursions': 5,
             },
         )),
@@ -155,9 +167,9 @@ planner = SupervisorAgent(SupervisorAgentOptions(
                                   },
              **llm_config,
              streaming= True,
-             callbacks=BedrockLLMAgentCallbacks(),
+             callbacks=stream_mux.callbacks('news_analyst'),
             tool_config={
-                'tool': AgentTools([get_news_tool]),
+                'tool': AsyncAgentTools([get_news_tool], limits={'get_news': ToolLimits(timeout=30)}),
                 'toolMaxRecursions': 5,
             },
         )),
@@ -171,17 +183,54 @@ planner = SupervisorAgent(SupervisorAgentOptions(
                                   },
              **llm_config,
             streaming= True,
-            callbacks=BedrockLLMAgentCallbacks(),
+            callbacks=stream_mux.callbacks('writer'),
         ))
-    ]
+    ],
+    max_concurrency=3,
 ))
 
 
 orchestrator.add_agent(planner)
 
+# one AIMD concurrency limit + retry budget per (region, model) for the classifier and every agent
+governor = RequestGovernor(GovernorOptions(initial_concurrency=8, max_retries=4))
+governor.govern(orchestrator)
+
+# spans of the classifier, every agent / team member, tool and model call; `python tracing.py traces.jsonl` to read
+tracer = Tracer([JsonlExporter('traces.jsonl')] + (
+    [OtlpHttpExporter(os.environ['OTEL_EXPORTER_OTLP_TRACES_ENDPOINT'])]
+    if os.environ.get('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT') else []))
+tracer.instrument(orchestrator)
+
+
+async def print_stream(stream):
+    """Print a session's streamed tokens line by line, labelled with its user and agent."""
+    pending = {}
+    async for chunk in stream:
+        agent_name = chunk.context.agent_name
+        *lines, pending[agent_name] = (pending.get(agent_name, '') + chunk.text).split('\n')
+        for line in lines:
+            print(f"USER_ID: {stream.user_id} [{agent_name}] {line}")
+    for agent_name, line in pending.items():
+        if line:
+            print(f"USER_ID: {stream.user_id} [{agent_name}] {line}")
+
+async def run_streaming(coro, _user_id: str, _session_id: str):
+    # the agent runs on a worker thread so this loop can print its tokens (and other sessions') meanwhile
+    stream = stream_mux.open(_user_id, _session_id)
+    printer = asyncio.ensure_future(print_stream(stream))
+    try:
+        with stream_mux.session(_user_id, _session_id, stream.request_id):
+            return await run_in_thread(coro)
+    finally:
+        stream_mux.close(_user_id, _session_id, stream.request_id)
+        await printer
 
 async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str, _user_id: str, _session_id: str):
-    response: AgentResponse = await _orchestrator.route_request(_user_input, _user_id, _session_id)
+    params = {}
+    with record_tool_metrics(params):
+        response: AgentResponse = await run_streaming(
+            _orchestrator.route_request(_user_input, _user_id, _session_id, params), _user_id, _session_id)
     # Print metadata
     print("\nMetadata:")
     print(f"Selected Agent: {response.metadata.agent_name}")
@@ -195,12 +244,17 @@ async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str
         print(response.metadata)
 
 async def simple_handle_request(agent, _user_input: str, _user_id: str, _session_id: str):
-    t1 = time.time()
-    response: ConversationMessage = await agent.process_request(_user_input, _user_id, _session_id,[])
+    params = {}
+    with record_tool_metrics(params), tracer.span('request', user_id=_user_id, session_id=_session_id) as span:
+        response: ConversationMessage = await run_streaming(
+            agent.process_request(_user_input, _user_id, _session_id,[], params), _user_id, _session_id)
     # Print metadata
     print(f"\nUSER_ID: {_user_id} Metadata:")
     print(f"USER_ID: {_user_id} Selected Agent: {response.content}")
-    print(f"USER_ID: {_user_id} Duration:{time.time()-t1}")
+    print(f"USER_ID: {_user_id} Tool metrics: {params.get('tool_metrics')}")
+    print(f"USER_ID: {_user_id} Request governor: {governor.stats()}")
+    print(f"USER_ID: {_user_id} Model router: {model_router.stats()}")
+    print(f"USER_ID: {_user_id} Duration:{span.duration_ms / 1000}")
 
 
 if __name__ == "__main__":
@@ -216,6 +270,7 @@ if __name__ == "__main__":
     )
     # 关闭事件循环
     loop.close()        
+    tracer.shutdown()
         
 
 
@@ -13,6 +13,12 @@ from multi_agent_orchestrator.agents import (BedrockLLMAgent,SupervisorAgent,Ama
 from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
 from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
 from multi_agent_orchestrator.utils import AgentTool,AgentTools
+from tool_utils import AsyncAgentTools, ToolLimits, record_tool_metrics
+from tool_output import ToolOutputStore
+from web_search import WebSearch, WebSearchOptions, exa_search_fn
+from model_router import ModelRouter, ModelRouterOptions, ModelTarget
+from runner import get_client
+from streaming import BufferedTokenStream, stdout_consumer
 import boto3
 import dotenv
 import os
@@ -26,18 +32,17 @@ exa_client = Exa(api_key =os.environ["EXA_API_KEY"])
 
 MODELID= 'us.amazon.nova-pro-v1:0'
 # MODELID= "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-custom_client = boto3.client('bedrock-runtime',
-                             aws_access_key_id=os.environ['ACCESS_KEY_ID'],
-                             aws_secret_access_key=os.environ['SECRET_ACCESS_KEY'],
-                             config = boto3.session.Config(
-                                 read_timeout=120,
-                                 connect_timeout=120
-                             ))
-
-class BedrockLLMAgentCallbacks(AgentCallbacks):
-    def on_llm_new_token(self, token: str) -> None:
-        # handle response streaming here
-        print(token, end='', flush=True)
+# calls go to the healthiest region (us-west-2 first), failing over on throttling and hedging slow calls
+model_router = ModelRouter([ModelTarget(region, MODELID, get_client('bedrock-runtime', region_name=region,
+                                                                    aws_access_key_id=os.environ['ACCESS_KEY_ID'],
+                                                                    aws_secret_access_key=os.environ['SECRET_ACCESS_KEY'],
+                                                                    config=boto3.session.Config(read_timeout=120,
+                                                                                                connect_timeout=120)))
+                            for region in ('us-west-2', 'us-east-1', 'us-east-2')],
+                           ModelRouterOptions(hedge=True))
+
+# tokens of all agents are written in ~20ms chunks instead of one flushed print per token
+token_stream = BufferedTokenStream([stdout_consumer()])
 
 llm_config= dict(
     model_id=MODELID,
@@ -46,26 +51,31 @@ llm_config= dict(
         'maxTokens': 3000,
         'temperature': 0.2,
     },
-    client=custom_client
+    client=model_router
 )
 
 
-def web_search(query: str):
-    """One API to search and crawl the web, turning it into structured data 
-    :params query
-    """
-    result = exa_client.search_and_contents(
-        query,
-        text = { "max_characters": 10000 }
-    )
-    return str(result)
+# full page text stays out of the conversation; the analysts page it in by handle with read_tool_output
+tool_outputs = ToolOutputStore(ttl=3600, top_k=3)
 
+# disk cache by normalized query, pages deduplicated per analyst within one request (see handle_request),
+# compact snippets instead of the raw repr with 10,000 characters per hit
+web_searcher = WebSearch(exa_search_fn(exa_client, max_characters=10000),
+                         WebSearchOptions(cache_dir='.search_cache', ttl=24 * 3600, output_store=tool_outputs))
 
 
-web_search_tool = AgentTool(
-    name="web_search",
-    func=web_search,
-)
+def web_search_tools(reader: str) -> AsyncAgentTools:
+    """The search tools of one analyst; pages it has already read come back as references."""
+    def web_search(query: str):
+        """One API to search and crawl the web, turning it into structured data 
+        :params query
+        """
+        return web_searcher.search(query, reader=reader)
+
+    # exa's search_and_contents is a blocking HTTP call: run it on a thread pool, at most 4 searches
+    # per analyst at a time, so it no longer stalls the event loop for every other session
+    return AsyncAgentTools([AgentTool(name="web_search", func=web_search), tool_outputs.tool()], max_workers=8,
+                           limits={'web_search': ToolLimits(max_concurrency=4, timeout=60)})
 
 
 # Planner (Research Planning Coordinator) Improved Prompt
@@ -127,7 +137,8 @@ Always conclude with:
 2. Confidence level in data
 3. Handoff to planner with clear status report
 
-Use web_search_tool efficiently and maintain search depth of quality over quantity."""
+Use web_search_tool efficiently and maintain search depth of quality over quantity.
+Search results only contain snippets; when a page needs a closer read, use read_tool_output with its full_text handle and a focused query."""
 
 # Critic Analyst Improved Prompt
 critic_prompt = """You are an expert Critic Analyst specializing in research validation and quality assurance.
@@ -199,7 +210,7 @@ planner = SupervisorAgent(SupervisorAgentOptions(
       },
         **llm_config,
         streaming= True,
-        callbacks=BedrockLLMAgentCallbacks(),
+        callbacks=token_stream,
     )),
     team=[
         BedrockLLMAgent(BedrockLLMAgentOptions(
@@ -209,9 +220,9 @@ planner = SupervisorAgent(SupervisorAgentOptions(
                },
              **llm_config,
             streaming= True,
-            callbacks=BedrockLLMAgentCallbacks(),
+            callbacks=token_stream,
             tool_config={
-                'tool': AgentTools([web_search_tool]),
+                'tool': web_search_tools('information_analyst'),
                 'toolMaxRecursions': 5,
             },
         )),
@@ -222,9 +233,9 @@ planner = SupervisorAgent(SupervisorAgentOptions(
             },
              **llm_config,
              streaming= True,
-             callbacks=BedrockLLMAgentCallbacks(),
+             callbacks=token_stream,
             tool_config={
-                'tool': AgentTools([web_search_tool]),
+                'tool': web_search_tools('critic_analyst'),
                 'toolMaxRecursions': 5,
             },
         )),
@@ -236,7 +247,9 @@ orchestrator.add_agent(planner)
 
 
 async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str, _user_id: str, _session_id: str):
-    response: AgentResponse = await _orchestrator.route_request(_user_input, _user_id, _session_id)
+    params = {}
+    with record_tool_metrics(params), web_searcher.session(), tool_outputs.session(_user_id, _session_id):
+        response: AgentResponse = await _orchestrator.route_request(_user_input, _user_id, _session_id, params)
     # Print metadata
     print("\nMetadata:")
     print(f"Selected Agent: {response.metadata.agent_name}")
@@ -251,10 +264,16 @@ async def handle_request(_orchestrator: MultiAgentOrchestrator, _user_input: str
 
 async def simple_handle_request(agent, _user_input: str, _user_id: str, _session_id: str):
     t1 = time.time()
-    response: ConversationMessage = await agent.process_request(_user_input, _user_id, _session_id,[])
+    params = {}
+    with record_tool_metrics(params), web_searcher.session(), tool_outputs.session(_user_id, _session_id):
+        response: ConversationMessage = await agent.process_request(_user_input, _user_id, _session_id,[], params)
+    token_stream.flush()
     # Print metadata
     print("\nMetadata:")
     print(f"Selected Agent: {response.content}")
+    print(f"Tool metrics: {params.get('tool_metrics')}")
+    print(f"Web search: {web_searcher.stats()}")
+    print(f"Model router: {model_router.stats()}")
     print(f"Duration:{time.time()-t1}")
 
 
@@ -264,6 +283,7 @@ if __name__ == "__main__":
     task = "use search tool and sequential thinking to make comparison report between different agents frameworks such as autogen, langgraph, aws multi agents ochestrator"
     # asyncio.run(handle_request(orchestrator, task, USER_ID, SESSION_ID))
     asyncio.run(simple_handle_request(planner, task, USER_ID, SESSION_ID))
+    token_stream.close()
 
 
 
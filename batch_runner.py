@@ -0,0 +1,256 @@
+"""
+Batch mode for the translation chain (or any other agent).
+
+BatchRunner pushes many source texts through one agent concurrently. The number
+of documents in flight adapts to Bedrock throttling: it is halved on every
+ThrottlingException (the document is retried after a jittered exponential
+backoff), at most once per window of calls already in flight, and grows again by one after a run of clean completions. Every result
+is appended to a JSONL file as soon as it completes, and that file doubles as the
+checkpoint: documents already in it are skipped when the run is restarted.
+
+    runner = BatchRunner(chain_agent, BatchOptions(output_path='translations.jsonl', max_in_flight=8))
+    stats = await runner.run(read_documents('corpus.txt'))
+
+From the 03 script:
+
+    python 03.sequential_agent.py --batch corpus.txt --output translations.jsonl --in-flight 8
+
+Run `python batch_runner.py` for an interrupted-and-resumed run against the stub
+model with a concurrency cap.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from multi_agent_orchestrator.agents import Agent
+from multi_agent_orchestrator.utils import Logger
+
+from runner import run_in_thread
+
+THROTTLING_ERROR_CODES = frozenset({
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+})
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    response = getattr(error, 'response', None)
+    code = response.get('Error', {}).get('Code') if isinstance(response, dict) else None
+    return code in THROTTLING_ERROR_CODES
+
+
+def read_documents(path: str) -> Iterator[Tuple[str, str]]:
+    """Yield (doc_id, text) lazily from a file.
+
+    .jsonl files hold one {"id": ..., "text": ...} object per line (id defaults
+    to the line number); any other file is split into blank-line separated
+    paragraphs, numbered from 0.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for number, line in enumerate(f):
+                if line.strip():
+                    record = json.loads(line)
+                    yield str(record.get('id', number)), record['text']
+            return
+        paragraph: list[str] = []
+        index = 0
+        for line in f:
+            if line.strip():
+                paragraph.append(line.rstrip('\n'))
+            elif paragraph:
+                yield str(index), '\n'.join(paragraph)
+                paragraph, index = [], index + 1
+        if paragraph:
+            yield str(index), '\n'.join(paragraph)
+
+
+class AdaptiveLimit:
+    """In-flight cap: halves on throttling, grows by one after `increase_after` clean completions.
+
+    Calls that were already in flight when the limit was halved throttle for
+    the same reason, so only a throttled call started after the last decrease
+    halves it again.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: Optional[int] = None, increase_after: int = 4):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.increase_after = increase_after
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self._successes += 1
+        if self._successes >= self.increase_after and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+
+    def on_throttle(self, started: float) -> None:
+        """`started` is the time.perf_counter() at which the throttled call was issued."""
+        self._successes = 0
+        if started <= self._last_decrease:
+            return
+        self.limit = max(self.minimum, self.limit // 2)
+        self._last_decrease = time.perf_counter()
+
+
+@dataclass
+class BatchOptions:
+    output_path: str  # JSONL results, also read back as the checkpoint on restart
+    max_in_flight: int = 8  # documents processed at the same time at most
+    min_in_flight: int = 1
+    max_retries: int = 6  # throttled attempts per document before it is recorded as failed
+    base_backoff: float = 1.0  # seconds, doubled on every throttled attempt
+    max_backoff: float = 30.0
+    user_id: str = 'batch'
+
+
+class BatchRunner:
+    def __init__(self, agent: Agent, options: BatchOptions):
+        self.agent = agent
+        self.options = options
+        self.stats: Dict[str, float] = {}
+
+    def completed_ids(self) -> Set[str]:
+        """Ids that already have a result in the output file."""
+        if not os.path.exists(self.options.output_path):
+            return set()
+        done = set()
+        with open(self.options.output_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial line from an interrupted write
+                if 'output' in record:
+                    done.add(record['id'])
+        return done
+
+    async def run(self, documents: Iterable[Tuple[str, str]]) -> Dict[str, float]:
+        start = time.perf_counter()
+        done = self.completed_ids()
+        limit = AdaptiveLimit(self.options.max_in_flight, self.options.min_in_flight)
+        self.stats = {'completed': 0, 'skipped': 0, 'failed': 0, 'throttled': 0}
+        tasks: Set[asyncio.Task] = set()
+
+        with ThreadPoolExecutor(max_workers=self.options.max_in_flight, thread_name_prefix='batch') as executor, \
+                open(self.options.output_path, 'a', encoding='utf-8') as output:
+            for doc_id, text in documents:
+                if doc_id in done:
+                    self.stats['skipped'] += 1
+                    continue
+                await limit.acquire()
+                task = asyncio.create_task(self._process(doc_id, text, limit, executor, output))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        self.stats['elapsed_s'] = round(time.perf_counter() - start, 2)
+        self.stats['final_in_flight'] = limit.limit
+        return self.stats
+
+    async def _process(self, doc_id: str, text: str, limit: AdaptiveLimit,
+                       executor: ThreadPoolExecutor, output) -> None:
+        attempt = 0
+        held = True  # the caller acquired our slot
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    params: dict = {}
+                    response = await run_in_thread(
+                        self.agent.process_request(text, self.options.user_id, f'batch-{doc_id}', [], params),
+                        executor)
+                except Exception as error:
+                    if not is_throttling_error(error) or attempt >= self.options.max_retries:
+                        self._write(output, {'id': doc_id, 'error': str(error)})
+                        self.stats['failed'] += 1
+                        return
+                    self.stats['throttled'] += 1
+                    limit.on_throttle(started)
+                    backoff = min(self.options.max_backoff, self.options.base_backoff * 2 ** attempt)
+                    attempt += 1
+                    # give the slot back while waiting so the lower limit takes effect
+                    await limit.release()
+                    held = False
+                    await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+                    await limit.acquire()
+                    held = True
+                    continue
+
+                limit.on_success()
+                self._write(output, {
+                    'id': doc_id,
+                    'output': response.content[0].get('text', '') if response.content else '',
+                    'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+                    'attempts': attempt + 1,
+                })
+                self.stats['completed'] += 1
+                Logger.info(f"[batch] {doc_id} done ({self.stats['completed']} completed, "
+                            f"in flight {limit.in_flight}/{limit.limit})")
+                return
+        finally:
+            # not held if cancelled while backing off or waiting for a slot again
+            if held:
+                await limit.release()
+
+    @staticmethod
+    def _write(output, record: dict) -> None:
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        output.flush()
+
+
+if __name__ == "__main__":
+    import itertools
+    import tempfile
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from graph_agent import GraphAgent, GraphAgentOptions, GraphNode
+    from stub_bedrock import StubBedrockServer
+
+    MODELID = 'us.amazon.nova-lite-v1:0'
+    DOCUMENTS = [(str(i), f"Paragraph {i}: the quick brown fox jumps over the lazy dog.") for i in range(60)]
+
+    def build_chain(client):
+        def agent(name):
+            return BedrockLLMAgent(BedrockLLMAgentOptions(name=name, description=name, model_id=MODELID,
+                                                          client=client, streaming=False))
+        return GraphAgent(GraphAgentOptions(
+            name='TranslationChainAgent', description='translate, review, edit', raise_errors=True,
+            nodes=[GraphNode(name='translation', agent=agent('translate')),
+                   GraphNode(name='review', agent=agent('review'), inputs=['input', 'translation']),
+                   GraphNode(name='final', agent=agent('edit'), inputs=['input', 'translation', 'review'])]))
+
+    output_path = os.path.join(tempfile.mkdtemp(), 'translations.jsonl')
+    with StubBedrockServer(latency=0.1, max_concurrency=6) as server:
+        chain = build_chain(server.client())
+        options = BatchOptions(output_path=output_path, max_in_flight=16, base_backoff=0.2)
+        print(f"{len(DOCUMENTS)} documents x 3 stages, stub: 100ms per call, 6 concurrent calls max")
+
+        first = asyncio.run(BatchRunner(chain, options).run(itertools.islice(DOCUMENTS, 25)))
+        print(f"run 1 (stopped after 25 documents): {first}")
+        second = asyncio.run(BatchRunner(chain, options).run(iter(DOCUMENTS)))
+        print(f"run 2 (resumed):                    {second}")
+        print(f"model calls={server.request_count} throttled calls={server.throttled_count} "
+              f"results in {output_path}: {len(BatchRunner(chain, options).completed_ids())}")
@@ -0,0 +1,189 @@
+"""
+Routing-decision cache in front of an LLM classifier.
+
+CachingClassifier wraps any Classifier (usually BedrockClassifier) and keeps the
+agent it picked for a given input, so repeated or near-identical questions are
+routed without another model round-trip. Entries are keyed on the normalized
+input, a fingerprint of the registered agents (adding/changing an agent
+invalidates everything) and the previously selected agent (so short follow-ups
+like "yes" stay with whichever agent asked).
+
+Semantic mode compares hashed character n-grams by default: that is lexical
+similarity, not meaning ("symptoms of a computer virus" and "symptoms of a flu
+virus" score 0.82). The default threshold of 0.95 therefore only matches
+near-duplicates (typos, punctuation, a dropped word); pass a real sentence
+embedding as `embed_fn` before lowering it.
+
+    classifier = CachingClassifier(CachingClassifierOptions(
+        classifier=BedrockClassifier(BedrockClassifierOptions(model_id=MODELID)),
+        mode='semantic',
+    ))
+"""
+import contextvars
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from multi_agent_orchestrator.agents import Agent
+from multi_agent_orchestrator.classifiers import Classifier, ClassifierResult
+from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
+
+from text_utils import SparseVector, cosine, hashed_ngram_vector, normalize_text
+
+_AGENT_PREFIX_RE = re.compile(r'^\[([^\]]+)\]')
+
+# set by CachingClassifier.classify in its caller's context: True when the decision came from the cache
+served_from_cache: contextvars.ContextVar = contextvars.ContextVar('classifier_served_from_cache', default=False)
+
+
+@dataclass
+class CachingClassifierOptions:
+    classifier: Classifier
+    mode: str = 'exact'  # 'exact' or 'semantic'
+    similarity_threshold: float = 0.95  # min cosine similarity for a semantic hit
+    ttl: Optional[float] = 3600  # seconds, None keeps entries until evicted
+    max_entries: int = 1000
+    embed_fn: Optional[Callable[[str], SparseVector]] = None  # defaults to hashed n-grams (lexical)
+
+
+@dataclass
+class _CacheEntry:
+    agent_id: str
+    confidence: float
+    created_at: float
+    embedding: Optional[SparseVector] = None
+
+
+class CachingClassifier(Classifier):
+    def __init__(self, options: CachingClassifierOptions):
+        super().__init__()
+        if options.mode not in ('exact', 'semantic'):
+            raise ValueError("mode must be 'exact' or 'semantic'")
+        self.classifier = options.classifier
+        self.mode = options.mode
+        self.similarity_threshold = options.similarity_threshold
+        self.ttl = options.ttl
+        self.max_entries = options.max_entries
+        self.embed_fn = options.embed_fn or hashed_ngram_vector
+        self.agents_fingerprint = ''
+        self._entries: 'OrderedDict[Tuple[str, str, str], _CacheEntry]' = OrderedDict()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_agents(self, agents: Dict[str, Agent]) -> None:
+        super().set_agents(agents)
+        self.classifier.set_agents(agents)
+        fingerprint = hashlib.sha1(
+            '\n'.join(f"{agent_id}:{agent.description}" for agent_id, agent in sorted(agents.items())).encode()
+        ).hexdigest()
+        if fingerprint != self.agents_fingerprint:
+            self.agents_fingerprint = fingerprint
+            self.clear()
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @staticmethod
+    def previous_agent_id(chat_history: List[ConversationMessage]) -> str:
+        """Agent id of the last assistant turn, as tagged by ChatStorage.fetch_all_chats."""
+        for message in reversed(chat_history or []):
+            if message.role == ParticipantRole.ASSISTANT.value and message.content:
+                match = _AGENT_PREFIX_RE.match(message.content[0].get('text', ''))
+                if match:
+                    return match.group(1)
+        return ''
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
+
+    def _is_expired(self, entry: _CacheEntry, now: float) -> bool:
+        return self.ttl is not None and now - entry.created_at > self.ttl
+
+    def _lookup(self, key: Tuple[str, str, str], now: float) -> Optional[_CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry, now):
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _semantic_lookup(self, key: Tuple[str, str, str], embedding: SparseVector,
+                         now: float) -> Optional[_CacheEntry]:
+        best_key, best_score = None, self.similarity_threshold
+        for other_key, entry in list(self._entries.items()):
+            if other_key[:2] != key[:2] or entry.embedding is None:
+                continue
+            if self._is_expired(entry, now):
+                del self._entries[other_key]
+                self.evictions += 1
+                continue
+            score = cosine(embedding, entry.embedding)
+            if score >= best_score:
+                best_key, best_score = other_key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key]
+
+    def _store(self, key: Tuple[str, str, str], result: ClassifierResult,
+               embedding: Optional[SparseVector], now: float) -> None:
+        self._entries[key] = _CacheEntry(result.selected_agent.id, result.confidence, now, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def classify(self,
+                       input_text: str,
+                       chat_history: List[ConversationMessage]) -> ClassifierResult:
+        now = time.monotonic()
+        key = (self.agents_fingerprint, self.previous_agent_id(chat_history), normalize_text(input_text))
+
+        served_from_cache.set(False)
+        entry = self._lookup(key, now)
+        if entry is not None:
+            self.hits += 1
+        else:
+            embedding = self.embed_fn(key[2]) if self.mode == 'semantic' else None
+            if embedding is not None:
+                entry = self._semantic_lookup(key, embedding, now)
+            if entry is not None:
+                self.semantic_hits += 1
+            else:
+                self.misses += 1
+                result = await self.classifier.classify(input_text, chat_history)
+                served_from_cache.set(False)
+                if result.selected_agent:
+                    self._store(key, result, embedding, now)
+                return result
+
+        agent = self.agents.get(entry.agent_id)
+        if agent is None:
+            # agent was removed without going through set_agents, fall back to the LLM
+            self._entries.pop(key, None)
+            result = await self.classifier.classify(input_text, chat_history)
+            served_from_cache.set(False)
+            return result
+        served_from_cache.set(True)
+        return ClassifierResult(selected_agent=agent, confidence=entry.confidence)
+
+    async def process_request(self,
+                              input_text: str,
+                              chat_history: List[ConversationMessage]) -> ClassifierResult:
+        return await self.classify(input_text, chat_history)
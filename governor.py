@@ -0,0 +1,473 @@
+"""
+Shared request governor for Bedrock calls: adaptive concurrency, rate limits, throttling-aware retries.
+
+The scripts' only defence against throttling used to be botocore's own retries
+on each client (plus the orchestrator's MAX_RETRIES): every agent retries on
+its own schedule, so under load a burst of ThrottlingExceptions turns into a
+retry storm that keeps the quota exhausted. RequestGovernor puts every call of
+the governed clients through one limiter per (region, model):
+
+- an AIMD concurrency limit: calls in flight grow by about one per window of
+  clean completions and the limit is multiplied by `decrease_factor` when a
+  call is throttled (once per window, not once per throttled call);
+- token buckets on requests and on tokens per minute, matching Bedrock's
+  RPM / TPM quotas; like Bedrock, a call reserves its input tokens plus
+  maxTokens up front and the difference is settled from the usage it reports;
+- throttled calls (ThrottlingException, ServiceUnavailable, ...) are retried
+  by the governor with full-jitter exponential backoff, outside the limit;
+  so are the errors botocore would retry (connection errors, read timeouts,
+  500 InternalServerException), without lowering the limit;
+- callers wait in a bounded queue; past `max_queue` waiters or `queue_timeout`
+  seconds the call is rejected with a ThrottlingException ClientError, so
+  callers that already back off on throttling (BatchRunner) keep working.
+
+Streamed responses (ConverseStream, InvokeAgent, InvokeInlineAgent) hold
+their slot until the stream has been read. The governor wraps a copy of each
+client with botocore's retries turned off, so an attempt is never multiplied
+by two retry layers, and the original (e.g. a pooled get_client() client that
+ungoverned code shares) keeps its own retries.
+
+The limiter waits by blocking the calling thread. That is what the agents'
+synchronous boto3 calls do anyway, but on an event loop shared by several
+requests it would stall all of them. So on such a loop (see runner.may_block:
+anything but a plain thread, a run_in_thread worker or the REPL's AsyncRunner,
+e.g. the stock SupervisorAgent's team calls) the governor neither queues nor
+backs off: the call runs at once on the original client, whose botocore
+retries handle throttling as they did before, and it still counts against the
+limit (in flight, and a decrease when it ends throttled). Such calls show up
+as 'unqueued' in stats().
+
+For a ModelRouter, govern() wraps each target's client. Those calls are not
+retried on errors the router fails over on, and queue rejections carry a
+marker (model_router.is_local_rejection) so the router does not put a healthy
+region into cooldown for them.
+
+    governor = RequestGovernor(GovernorOptions(initial_concurrency=8, tokens_per_minute=400_000))
+    governor.govern(orchestrator)  # classifier and every agent (team members, retrievers) included
+    ...
+    governor.stats()  # per region/model: limit, in flight, queue depth, throttled, retries, rejected
+
+Run `python governor.py` for a burst of concurrent calls against a stub endpoint
+that throttles above a concurrency quota, with and without the governor.
+"""
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, ReadTimeoutError
+from multi_agent_orchestrator.agents import Agent
+from multi_agent_orchestrator.classifiers import Classifier
+from multi_agent_orchestrator.orchestrator import MultiAgentOrchestrator
+from multi_agent_orchestrator.utils import Logger
+
+from batch_runner import is_throttling_error
+from model_router import LOCAL_REJECTION, ModelRouter, is_failover_error
+from runner import may_block
+from tracing import _child_agents
+
+# governed operation -> parameter naming the model (or agent / knowledge base) it is limited under
+GOVERNED_OPERATIONS = {
+    'converse': 'modelId',
+    'converse_stream': 'modelId',
+    'invoke_model': 'modelId',
+    'invoke_model_with_response_stream': 'modelId',
+    'invoke_agent': 'agentId',
+    'invoke_inline_agent': 'foundationModel',
+    'retrieve': 'knowledgeBaseId',
+}
+# streamed operations -> response key of the event stream that holds the slot until it is read
+STREAM_KEYS = {
+    'converse_stream': 'stream',
+    'invoke_model_with_response_stream': 'body',
+    'invoke_agent': 'completion',
+    'invoke_inline_agent': 'completion',
+}
+
+
+@dataclass
+class GovernorOptions:
+    initial_concurrency: int = 8  # calls in flight per (region, model) before the limit adapts
+    min_concurrency: int = 1
+    max_concurrency: int = 64
+    decrease_factor: float = 0.5  # limit multiplier when a call is throttled
+    requests_per_minute: Optional[float] = None  # token bucket on calls, None = unlimited
+    tokens_per_minute: Optional[float] = None  # token bucket on input + output tokens, None = unlimited
+    default_max_tokens: int = 1000  # output tokens reserved when a call sets no maxTokens
+    max_retries: int = 4  # retries of a throttled call before the error is raised
+    base_backoff: float = 0.5  # seconds, doubled on every throttled attempt (full jitter)
+    max_backoff: float = 20.0
+    max_queue: int = 256  # callers waiting per (region, model) above this are rejected
+    queue_timeout: float = 60.0  # seconds a caller waits for a slot before it is rejected
+
+
+def estimate_tokens(params: Dict[str, Any], default_max_tokens: int) -> int:
+    """Input tokens (about 4 characters each) plus the output tokens the call may generate."""
+    text = json.dumps([params.get('messages', []), params.get('system', [])], ensure_ascii=False)
+    input_tokens = (len(text) + len(params.get('inputText', '')) + len(params.get('body', b'') or b'')) // 4
+    max_tokens = (params.get('inferenceConfig') or {}).get('maxTokens') or default_max_tokens
+    return input_tokens + max_tokens
+
+
+def _reported_tokens(usage: Dict[str, Any]) -> Optional[int]:
+    if not usage or 'inputTokens' not in usage:
+        return None
+    return usage.get('inputTokens', 0) + usage.get('outputTokens', 0)
+
+
+# errors botocore retries besides throttling (its "transient" errors)
+TRANSIENT_ERROR_CODES = frozenset({'InternalServerException', 'InternalFailure', 'InternalServerError',
+                                   'RequestTimeout', 'RequestTimeoutException', 'PriorRequestNotComplete'})
+
+
+def is_transient_error(error: BaseException) -> bool:
+    if isinstance(error, (BotocoreConnectionError, ReadTimeoutError)):
+        return True
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return (response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES
+            or response.get('ResponseMetadata', {}).get('HTTPStatusCode') in (500, 502, 503, 504))
+
+
+def rejection_error(operation: str, reason: str) -> ClientError:
+    """A ThrottlingException for callers that back off on throttling; ModelRouter sees it is local (no cooldown)."""
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': f'Rejected by request governor: {reason}',
+                                  LOCAL_REJECTION: True}}, operation)
+
+
+class _TokenBucket:
+    """`per_minute` units, refilled continuously; debts (negative levels) are paid back before new takes."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+
+class _ModelLimiter:
+    def __init__(self, key: Tuple[str, str], options: GovernorOptions):
+        self.key = key
+        self.options = options
+        self.limit = float(options.initial_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.last_decrease = 0.0
+        self.requests = _TokenBucket(options.requests_per_minute) if options.requests_per_minute else None
+        self.tokens = _TokenBucket(options.tokens_per_minute) if options.tokens_per_minute else None
+        self._condition = threading.Condition()
+        self.counts = {'calls': 0, 'succeeded': 0, 'failed': 0, 'throttled': 0, 'retries': 0, 'rejected': 0,
+                       'unqueued': 0, 'peak_queue_depth': 0, 'tokens': 0}
+        self._queue_wait = 0.0
+
+    def acquire(self, operation: str, tokens: int) -> float:
+        """Block until a slot and the rate budgets allow the call; return the time it was admitted."""
+        enqueued = time.monotonic()
+        deadline = enqueued + self.options.queue_timeout
+        with self._condition:
+            if self.waiting >= self.options.max_queue:
+                self.counts['rejected'] += 1
+                raise rejection_error(operation, f'{self.waiting} calls already queued for {"/".join(self.key)}')
+            self.waiting += 1
+            self.counts['peak_queue_depth'] = max(self.counts['peak_queue_depth'], self.waiting)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self.in_flight < max(1, int(self.limit)):
+                        wait = max(self.requests.wait_time(1, now) if self.requests else 0.0,
+                                   self.tokens.wait_time(tokens, now) if self.tokens else 0.0)
+                        if wait <= 0:
+                            if self.requests:
+                                self.requests.take(1)
+                            if self.tokens:
+                                self.tokens.take(tokens)
+                            self.in_flight += 1
+                            self.counts['calls'] += 1
+                            self._queue_wait += now - enqueued
+                            return now
+                    if now >= deadline:
+                        self.counts['rejected'] += 1
+                        raise rejection_error(operation, f'no slot for {"/".join(self.key)} within '
+                                                         f'{deadline - enqueued:g}s')
+                    self._condition.wait(deadline - now if wait is None else min(wait, deadline - now))
+            finally:
+                self.waiting -= 1
+
+    def admit(self, tokens: int) -> float:
+        """Admit a call that cannot wait right away, over the limit and the rate budgets if need be."""
+        with self._condition:
+            now = time.monotonic()
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            self.counts['calls'] += 1
+            self.counts['unqueued'] += 1
+            return now
+
+    def release(self, started: float, outcome: str, reserved: int = 0, used: Optional[int] = None) -> None:
+        """outcome: 'ok', 'throttled' or 'failed'; `used` settles the token reservation when known."""
+        with self._condition:
+            self.in_flight -= 1
+            if self.tokens and used is not None:
+                self.tokens.take(used - reserved)
+            self.counts['tokens'] += reserved if used is None else used
+            if outcome == 'ok':
+                self.counts['succeeded'] += 1
+                self.limit = min(self.options.max_concurrency, self.limit + 1.0 / self.limit)
+            elif outcome == 'throttled':
+                self.counts['throttled'] += 1
+                # calls admitted before the last decrease saw the old limit; one decrease per window
+                if started > self.last_decrease:
+                    self.limit = max(self.options.min_concurrency, self.limit * self.options.decrease_factor)
+                    self.last_decrease = time.monotonic()
+            else:
+                self.counts['failed'] += 1
+            self._condition.notify_all()
+
+    def backoff(self, attempt: int) -> float:
+        with self._condition:
+            self.counts['retries'] += 1
+        return random.uniform(0, min(self.options.max_backoff, self.options.base_backoff * 2 ** attempt))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            calls = self.counts['calls']
+            return {**self.counts, 'limit': round(self.limit, 1), 'in_flight': self.in_flight,
+                    'queue_depth': self.waiting,
+                    'avg_queue_wait_ms': round(self._queue_wait / calls * 1000, 1) if calls else 0.0}
+
+
+class _GovernedStream:
+    """Event stream that keeps its call's slot until it is read to the end (or dropped)."""
+
+    def __init__(self, events: Any, finish):
+        self._events = events
+        self._finish = finish
+        self._usage: Dict[str, Any] = {}
+        self._done = False
+
+    def __iter__(self) -> Iterator[Any]:
+        outcome = 'failed'
+        try:
+            for event in self._events:
+                if isinstance(event, dict) and 'metadata' in event:
+                    self._usage = event['metadata'].get('usage') or {}
+                yield event
+            outcome = 'ok'
+        except Exception as error:
+            outcome = 'throttled' if is_throttling_error(error) else 'failed'
+            raise
+        finally:
+            self._end(outcome)
+
+    def _end(self, outcome: str) -> None:
+        if not self._done:
+            self._done = True
+            self._finish(outcome, _reported_tokens(self._usage))
+
+    def close(self) -> None:
+        self._end('ok')
+
+    def __del__(self):
+        self._end('ok')
+
+
+def copy_client(client: Any) -> Any:
+    """A new boto3 client like `client` (service, region, endpoint, config, credentials), without botocore retries."""
+    session = botocore.session.get_session()
+    # the same credentials object, so refreshable (role / SSO) credentials keep refreshing for the copy
+    session._credentials = client._get_credentials()
+    return boto3.Session(botocore_session=session).client(
+        client.meta.service_model.service_name,
+        region_name=client.meta.region_name,
+        endpoint_url=client.meta.endpoint_url,
+        config=client.meta.config.merge(Config(retries={'total_max_attempts': 1})))
+
+
+class GovernedClient:
+    """A boto3 client whose model calls go through a RequestGovernor; everything else is passed through.
+
+    Calls go to `client` (a copy without botocore retries), or to `original`
+    where the governor cannot wait (see RequestGovernor.call). A routed client
+    (a ModelRouter target) does not retry the errors the router fails over on
+    (throttling, connection errors): another region answers sooner.
+    """
+
+    def __init__(self, client: Any, governor: 'RequestGovernor', routed: bool = False, original: Any = None):
+        self._client = client
+        self._governor = governor
+        self._routed = routed
+        self._original = original if original is not None else client
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        if name not in GOVERNED_OPERATIONS:
+            return attribute
+
+        def governed(**params: Any) -> Any:
+            return self._governor.call(self._client, name, attribute, params, self._routed,
+                                       getattr(self._original, name))
+        return governed
+
+
+class RequestGovernor:
+    def __init__(self, options: Optional[GovernorOptions] = None):
+        self.options = options or GovernorOptions()
+        self._limiters: Dict[Tuple[str, str], _ModelLimiter] = {}
+        # (id(original), routed) -> (original, governed copy)
+        self._clients: Dict[Tuple[int, bool], Tuple[Any, GovernedClient]] = {}
+        self._governed: set = set()
+        self._lock = threading.Lock()
+
+    def limiter(self, region: str, model: str) -> _ModelLimiter:
+        with self._lock:
+            limiter = self._limiters.get((region, model))
+            if limiter is None:
+                limiter = self._limiters[(region, model)] = _ModelLimiter((region, model), self.options)
+            return limiter
+
+    def client(self, client: Any, routed: bool = False) -> GovernedClient:
+        """The governed wrapper of a boto3 client (one per client, shared by everything using it).
+
+        The wrapper calls a copy of the client without botocore retries; `client`
+        itself is left unchanged. `routed` is for ModelRouter targets, see GovernedClient.
+        """
+        if isinstance(client, GovernedClient):
+            return client
+        with self._lock:
+            entry = self._clients.get((id(client), routed))
+            if entry is None:
+                entry = self._clients[(id(client), routed)] = \
+                    (client, GovernedClient(copy_client(client), self, routed, client))
+            return entry[1]
+
+    def call(self, client: Any, operation: str, method: Any, params: Dict[str, Any], routed: bool = False,
+             unqueued_method: Any = None) -> Any:
+        """Run `method` (an operation of `client`) under the limiter of its region and model.
+
+        On an event loop shared by other requests neither queueing nor backing off
+        is possible (both block the thread), so `unqueued_method`, the operation of
+        the original client with its botocore retries, runs at once instead.
+        """
+        limiter = self.limiter(client.meta.region_name or '', str(params.get(GOVERNED_OPERATIONS[operation], '')))
+        reserved = estimate_tokens(params, self.options.default_max_tokens) if operation != 'retrieve' else 0
+        blocking = may_block()
+        if not blocking:
+            method = unqueued_method or method
+        attempt = 0
+        while True:
+            started = limiter.acquire(operation, reserved) if blocking else limiter.admit(reserved)
+            try:
+                response = method(**params)
+            except Exception as error:
+                throttled = is_throttling_error(error)
+                if throttled:
+                    limiter.release(started, 'throttled', reserved, 0)
+                else:
+                    limiter.release(started, 'failed', reserved)
+                if not (throttled or is_transient_error(error)) or attempt >= self.options.max_retries \
+                        or not blocking or (routed and is_failover_error(error)):
+                    raise
+                delay = limiter.backoff(attempt)
+                Logger.debug(f"{operation} {'throttled' if throttled else 'failed'} for {'/'.join(limiter.key)}, "
+                             f"retry {attempt + 1} in {delay:.2f}s: {error}")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            stream_key = STREAM_KEYS.get(operation)
+            if stream_key and stream_key in response:
+                response[stream_key] = _GovernedStream(
+                    response[stream_key],
+                    lambda outcome, used: limiter.release(started, outcome, reserved, used))
+            else:
+                limiter.release(started, 'ok', reserved, _reported_tokens(response.get('usage') or {}))
+            return response
+
+    def govern(self, target: Any) -> Any:
+        """Route the model calls of an orchestrator, classifier or agent (and all they contain) through the governor."""
+        if target is None or id(target) in self._governed:
+            return target
+        self._governed.add(id(target))
+        if isinstance(target, MultiAgentOrchestrator):
+            self.govern(target.classifier)
+            for agent in target.agents.values():
+                self.govern(agent)
+        elif isinstance(target, (Classifier, Agent)):
+            for name in ('client', 'bedrock_agent_client'):
+                client = getattr(target, name, None)
+                if isinstance(client, ModelRouter):
+                    for model_target in client.targets:
+                        model_target.client = self.client(model_target.client, routed=True)
+                elif hasattr(getattr(client, 'meta', None), 'region_name'):
+                    setattr(target, name, self.client(client))
+            retriever = getattr(target, 'retriever', None)
+            while retriever is not None:
+                client = getattr(retriever, 'client', None)
+                if hasattr(getattr(client, 'meta', None), 'region_name'):
+                    retriever.client = self.client(client)
+                retriever = getattr(retriever, 'retriever', None)
+            if isinstance(target, Agent):
+                for child in _child_agents(target):
+                    self.govern(child)
+        return target
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {'/'.join(limiter.key): limiter.stats() for limiter in limiters}
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+    from stub_bedrock import StubBedrockServer
+
+    CALLS = 200
+    CALLERS = 48
+    MODELID = 'us.amazon.nova-lite-v1:0'
+
+    def burst(client):
+        def one(i):
+            try:
+                client.converse(modelId=MODELID, messages=[{'role': 'user', 'content': [{'text': f'question {i}'}]}],
+                                inferenceConfig={'maxTokens': 256})
+                return True
+            except ClientError:
+                return False
+        t1 = time.perf_counter()
+        with ThreadPoolExecutor(CALLERS) as pool:
+            ok = sum(pool.map(one, range(CALLS)))
+        return ok, time.perf_counter() - t1
+
+    print(f"{CALLS} Converse calls from {CALLERS} threads; stub quota 8 concurrent calls, 100ms latency")
+    for name, retries, governed in [('botocore retries (legacy, 4)', {'mode': 'legacy'}, False),
+                                    ('botocore retries (standard, 3)', {'mode': 'standard'}, False),
+                                    ('RequestGovernor', {'mode': 'legacy'}, True)]:
+        with StubBedrockServer(latency=0.1, max_concurrency=8) as server:
+            client = server.client(config=Config(retries=retries, max_pool_connections=CALLERS))
+            governor = RequestGovernor(GovernorOptions(initial_concurrency=16, max_retries=6, base_backoff=0.1))
+            ok, elapsed = burst(governor.client(client) if governed else client)
+            print(f"{name:<32} succeeded {ok:3}/{CALLS}  {elapsed:5.2f}s  "
+                  f"stub calls={server.request_count:4}  throttled={server.throttled_count}")
+            if governed:
+                print(f"{'':<32} {governor.stats()}")
@@ -0,0 +1,282 @@
+"""
+DAG pipeline agent, a generalisation of ChainAgent.
+
+Each GraphNode names the inputs it needs: 'input' (the user's text) and/or the
+names of earlier nodes. A node starts as soon as all of its inputs are ready, so
+independent nodes run concurrently, and every node gets the source text and
+earlier outputs in its own message instead of having them pushed into a shared
+system prompt with set_system_prompt on every turn.
+
+With incremental=True the input is split into sentence chunks that flow through
+the graph one after another: a node works on chunk i while the nodes before it
+already work on chunk i+1, and the output node's tokens are streamed to the
+graph's callbacks as soon as the first chunk reaches it. Streaming node agents
+are allowed anywhere in the graph, not only in the last position.
+
+Per-node timings are written to additional_params['node_timings'] (which the
+orchestrator returns as response.metadata.additional_params) when the caller
+passes a dict.
+
+Run `python graph_agent.py` to compare time-to-first-token of the 03 translation
+graph with and without incremental mode against the stub model.
+"""
+import asyncio
+import contextvars
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Callable, Dict, List, Optional, Union
+
+from multi_agent_orchestrator.agents import Agent, AgentCallbacks, AgentOptions
+from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
+from multi_agent_orchestrator.utils import Logger
+
+from runner import run_in_thread
+from text_utils import split_sentences
+
+SOURCE = 'input'
+
+
+@dataclass
+class GraphNode:
+    name: str
+    agent: Agent
+    inputs: List[str] = field(default_factory=lambda: [SOURCE])  # 'input' and/or earlier node names
+    template: Optional[str] = None  # message for the agent, {{name}} is replaced by that input's text
+
+
+@dataclass
+class GraphAgentOptions(AgentOptions):
+    nodes: List[GraphNode] = field(default_factory=list)
+    output: Optional[str] = None  # node whose response is returned, defaults to the last node
+    default_output: Optional[str] = None
+    streaming: bool = False  # stream the output node's tokens to callbacks.on_llm_new_token
+    incremental: bool = False  # pipeline sentence chunks of the input through the graph
+    min_chunk_chars: int = 200  # chunk size in incremental mode
+    raise_errors: bool = False  # re-raise node errors (e.g. throttling) instead of returning default_output
+
+
+# forwarder of the graph run the current node call belongs to (set on the node's worker thread)
+_current_forwarder: contextvars.ContextVar = contextvars.ContextVar('graph_token_forwarder', default=None)
+
+
+class _TokenForwarder(AgentCallbacks):
+    """Hands tokens produced on a worker thread back to the graph's event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_token: Callable[[str], None]):
+        self.loop = loop
+        self.on_token = on_token
+
+    def on_llm_new_token(self, token: str) -> None:
+        self.loop.call_soon_threadsafe(self.on_token, token)
+
+
+class _ForwardingCallbacks(AgentCallbacks):
+    """Installed once on an output node's agent: tokens go to the calling graph run's forwarder.
+
+    Swapping agent.callbacks per call is not safe when several sessions run the
+    same graph at once; the forwarder is looked up per call through a contextvar.
+    """
+
+    def __init__(self, callbacks: AgentCallbacks):
+        self.callbacks = callbacks
+
+    def on_llm_new_token(self, token: str) -> None:
+        (_current_forwarder.get() or self.callbacks).on_llm_new_token(token)
+
+
+class GraphAgent(Agent):
+    def __init__(self, options: GraphAgentOptions):
+        super().__init__(options)
+        if not options.nodes:
+            raise ValueError("GraphAgent requires at least one node.")
+        self.nodes: Dict[str, GraphNode] = {}
+        for node in options.nodes:
+            if node.name == SOURCE or node.name in self.nodes:
+                raise ValueError(f"Invalid or duplicate node name '{node.name}'")
+            self.nodes[node.name] = node
+        for node in options.nodes:
+            unknown = [name for name in node.inputs if name != SOURCE and name not in self.nodes]
+            if unknown:
+                raise ValueError(f"Node '{node.name}' depends on unknown node(s): {', '.join(unknown)}")
+        self.levels = self._topological_levels()
+        self.output = options.output or options.nodes[-1].name
+        if self.output not in self.nodes:
+            raise ValueError(f"Output node '{self.output}' is not in the graph")
+        self.default_output = options.default_output or "No output generated from the graph."
+        self.streaming = options.streaming
+        self.incremental = options.incremental
+        self.min_chunk_chars = options.min_chunk_chars
+        self.raise_errors = options.raise_errors
+
+    def is_streaming_enabled(self) -> bool:
+        return self.streaming is True
+
+    def _topological_levels(self) -> List[List[str]]:
+        """Group nodes into levels whose members only depend on earlier levels."""
+        remaining = {name: {dep for dep in node.inputs if dep != SOURCE} for name, node in self.nodes.items()}
+        levels: List[List[str]] = []
+        done: set = set()
+        while remaining:
+            ready = [name for name, deps in remaining.items() if deps <= done]
+            if not ready:
+                raise ValueError(f"GraphAgent has a cycle between: {', '.join(remaining)}")
+            levels.append(ready)
+            done.update(ready)
+            for name in ready:
+                del remaining[name]
+        return levels
+
+    @staticmethod
+    def render_message(node: GraphNode, values: Dict[str, str]) -> str:
+        if node.template:
+            return re.sub(r'{{(\w+)}}', lambda m: values.get(m.group(1), m.group(0)), node.template)
+        if len(node.inputs) == 1:
+            return values[node.inputs[0]]
+        return '\n\n'.join(f"## {name}\n{values[name]}" for name in node.inputs)
+
+    @staticmethod
+    async def _call_agent(agent: Agent, message: str, user_id: str, session_id: str,
+                          chat_history: List[ConversationMessage],
+                          additional_params: Optional[Dict[str, str]],
+                          forwarder: Optional[_TokenForwarder]) -> Any:
+        """Runs on the worker thread's loop; streamed responses are drained here, before that loop closes."""
+        if forwarder is not None and not isinstance(agent.callbacks, _ForwardingCallbacks):
+            agent.callbacks = _ForwardingCallbacks(agent.callbacks)
+        context_token = _current_forwarder.set(forwarder)
+        try:
+            response = await agent.process_request(message, user_id, session_id, chat_history, additional_params)
+            if hasattr(response, '__aiter__'):
+                parts = []
+                async for chunk in response:
+                    text = chunk.content[0].get('text', '') if isinstance(chunk, ConversationMessage) \
+                        else chunk if isinstance(chunk, str) else ''
+                    if text and forwarder is not None:
+                        forwarder.on_llm_new_token(text)
+                    parts.append(text)
+                response = ConversationMessage(role=ParticipantRole.ASSISTANT.value,
+                                               content=[{'text': ''.join(parts)}])
+            return response
+        finally:
+            _current_forwarder.reset(context_token)
+
+    async def process_request(
+        self,
+        input_text: str,
+        user_id: str,
+        session_id: str,
+        chat_history: List[ConversationMessage],
+        additional_params: Optional[Dict[str, str]] = None
+    ) -> Union[ConversationMessage, AsyncIterable[Any]]:
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        chunks = split_sentences(input_text, self.min_chunk_chars) if self.incremental else [input_text]
+        chunks = chunks or [input_text]
+        # outputs[node][i] resolves to the node's text for input chunk i
+        outputs: Dict[str, List[asyncio.Future]] = {
+            name: [loop.create_future() for _ in chunks] for name in self.nodes}
+        timings: Dict[str, Dict[str, float]] = {}
+        first_token_ms: Optional[float] = None
+
+        def emit(token: str) -> None:
+            nonlocal first_token_ms
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.callbacks.on_llm_new_token(token)
+
+        async def run_node(node: GraphNode) -> None:
+            forwarder = _TokenForwarder(loop, emit) if self.streaming and node.name == self.output else None
+            for i, chunk in enumerate(chunks):
+                values = {SOURCE: chunk}
+                for name in node.inputs:
+                    if name != SOURCE:
+                        values[name] = await outputs[name][i]
+                node_start = time.perf_counter()
+                response = await run_in_thread(self._call_agent(
+                    node.agent, self.render_message(node, values), user_id, session_id, chat_history,
+                    additional_params, forwarder))
+                timing = timings.setdefault(node.name, {'start_ms': round((node_start - start) * 1000, 1),
+                                                        'duration_ms': 0.0, 'chunks': 0})
+                timing['duration_ms'] = round(timing['duration_ms'] + (time.perf_counter() - node_start) * 1000, 1)
+                timing['chunks'] += 1
+                if not isinstance(response, ConversationMessage) or not response.content \
+                        or 'text' not in response.content[0]:
+                    raise ValueError(f"Node {node.name} ({node.agent.name}) returned no text content.")
+                text = response.content[0]['text']
+                if forwarder is not None and i < len(chunks) - 1:
+                    emit(self._separator(chunk))
+                outputs[node.name][i].set_result(text)
+
+        tasks = [asyncio.create_task(run_node(node)) for node in self.nodes.values()]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as error:
+            for task in tasks:
+                task.cancel()
+            Logger.error(f"Error processing graph {self.name}: {str(error)}")
+            if self.raise_errors:
+                raise
+            return ConversationMessage(role=ParticipantRole.ASSISTANT.value,
+                                       content=[{'text': self.default_output}])
+        finally:
+            if additional_params is not None:
+                additional_params['node_timings'] = timings
+                additional_params['graph_duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+                if first_token_ms is not None:
+                    additional_params['first_token_ms'] = first_token_ms
+
+        texts = [future.result() for future in outputs[self.output]]
+        text = ''.join(part + self._separator(chunk) for part, chunk in zip(texts[:-1], chunks)) + texts[-1]
+        return ConversationMessage(role=ParticipantRole.ASSISTANT.value, content=[{'text': text}])
+
+    @staticmethod
+    def _separator(chunk: str) -> str:
+        """Whitespace that followed a source chunk, reused between the output chunks."""
+        trailing = chunk[len(chunk.rstrip()):]
+        return '\n\n' if trailing.count('\n') > 1 else '\n' if '\n' in trailing else ' '
+
+
+if __name__ == "__main__":
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from stub_bedrock import StubBedrockServer, _last_user_text
+
+    MODELID = 'us.amazon.nova-lite-v1:0'
+    DOCUMENT = ' '.join(f"Sentence number {i} of a long document describes one more detail of the product."
+                        for i in range(1, 25))
+
+    def echo_source(model_id, body):
+        """Stub 'translation' as long as the source text, so output length scales with the input."""
+        text = _last_user_text(body)
+        if text.startswith('## Source text'):
+            text = text.split('\n\n## ')[0].split('\n', 1)[1]
+        return [{'text': text}]
+
+    def build_graph(client, **options):
+        def agent(name, streaming):
+            return BedrockLLMAgent(BedrockLLMAgentOptions(name=name, description=name, model_id=MODELID,
+                                                          client=client, streaming=streaming))
+        return GraphAgent(GraphAgentOptions(
+            name='TranslationGraph', description='translate, review, edit',
+            nodes=[
+                GraphNode(name='translation', agent=agent('translate', True)),
+                GraphNode(name='review', agent=agent('review', True), inputs=['input', 'translation'],
+                          template="## Source text\n{{input}}\n\n## Translation\n{{translation}}"),
+                GraphNode(name='final', agent=agent('edit', True), inputs=['input', 'translation', 'review'],
+                          template="## Source text\n{{input}}\n\n## Initial translation\n{{translation}}"
+                                   "\n\n## Expert suggestions\n{{review}}"),
+            ],
+            streaming=True, **options))
+
+    scenarios = [("whole document per stage", {}),
+                 ("incremental, 200-char chunks", {'incremental': True}),
+                 ("incremental, 500-char chunks", {'incremental': True, 'min_chunk_chars': 500})]
+    print(f"{len(DOCUMENT)}-char document, 3 stages, stub latency 200ms + 5ms/token")
+    for name, options in scenarios:
+        with StubBedrockServer(latency=0.2, token_delay=0.005, responder=echo_source) as server:
+            graph = build_graph(server.client(), **options)
+            params = {}
+            t1 = time.perf_counter()
+            response = asyncio.run(graph.process_request(DOCUMENT, 'user1', 'session1', [], params))
+            elapsed = time.perf_counter() - t1
+            print(f"{name:<30} first token {params.get('first_token_ms', 0) / 1000:6.2f}s  "
+                  f"total {elapsed:6.2f}s  model calls={server.request_count}")
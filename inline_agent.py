@@ -0,0 +1,256 @@
+"""
+Inline agent with a fingerprinted configuration and warm session reuse.
+
+Every turn of BedrockInlineAgent makes two calls: a Converse call in which the
+model reads the whole action group / knowledge base catalogue again and picks
+what the inline agent needs, then InvokeInlineAgent with the chosen definitions.
+WarmInlineAgent (built on FusedKnowledgeInlineAgent from kb_fusion.py) cuts that
+down:
+
+- the configuration the model picked (foundation model, instruction, action
+  groups, knowledge bases) is fingerprinted, and each (user, session,
+  fingerprint) keeps its own inline-agent session id, so the inline agent's
+  server-side conversation state stays warm across turns and is never mixed
+  between two different configurations; idleSessionTTLInSeconds keeps it alive;
+- opt-in (`reuse_plan_turns`, default 0): follow-up turns of a session reuse
+  the current configuration for up to that many turns and go straight to
+  InvokeInlineAgent, skipping the planning call. The new input is not checked
+  against the plan, so only enable it where a session sticks to one task;
+- opt-in (`prompt_caching`, default False, not every model accepts it): the
+  catalogue in the planning call's system prompt is marked with a Converse
+  cachePoint, so the unchanged definitions are read from Bedrock's prompt cache
+  instead of being processed again.
+
+InvokeInlineAgent itself has no way to refer to definitions sent earlier, so the
+chosen action groups are still sent with every call; they are only the ones the
+model picked, not the whole catalogue.
+
+    bedrock_inline_agent = WarmInlineAgent(WarmInlineAgentOptions(..., idle_session_ttl=1800))
+
+Run `python inline_agent.py` for a 200-turn latency comparison against the stub
+bedrock-runtime / bedrock-agent-runtime endpoints.
+"""
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from multi_agent_orchestrator.agents import BedrockInlineAgent
+from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
+from multi_agent_orchestrator.utils import Logger, conversation_to_dict
+
+from kb_fusion import FusedKnowledgeInlineAgent, FusedKnowledgeInlineAgentOptions
+
+# user id of the request being processed; the tool handler only gets the session id
+_request_user: contextvars.ContextVar = contextvars.ContextVar('inline_agent_user', default='')
+
+
+def config_fingerprint(foundation_model: str, plan: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps([foundation_model, plan['instruction'], plan['action_groups'],
+                                    plan['knowledge_base_ids']], sort_keys=True).encode()).hexdigest()
+
+
+@dataclass
+class WarmInlineAgentOptions(FusedKnowledgeInlineAgentOptions):
+    reuse_plan_turns: int = 0  # follow-up turns served with the session's last plan, 0 plans every turn
+    prompt_caching: bool = False  # cachePoint after the catalogue in the planning call's system prompt
+    idle_session_ttl: int = 1800  # idleSessionTTLInSeconds of the inline agent sessions
+    max_sessions: int = 1000  # warm (user, session, fingerprint) entries kept
+
+
+@dataclass
+class _WarmSession:
+    inline_session_id: str
+    plan: Dict[str, Any]
+    turns: int = 0
+    turns_since_plan: int = 0
+
+
+class WarmInlineAgent(FusedKnowledgeInlineAgent):
+    def __init__(self, options: WarmInlineAgentOptions):
+        super().__init__(options)
+        self.reuse_plan_turns = options.reuse_plan_turns
+        self.prompt_caching = options.prompt_caching
+        self.idle_session_ttl = options.idle_session_ttl
+        self.max_sessions = options.max_sessions
+        self._sessions: 'OrderedDict[Tuple[str, str, str], _WarmSession]' = OrderedDict()
+        self._current: Dict[Tuple[str, str], str] = {}  # (user, session) -> fingerprint of its latest plan
+        self._lock = threading.Lock()
+        self.counts = {'planned': 0, 'plan_reused': 0, 'new_sessions': 0, 'warm_sessions': 0,
+                       'cache_read_tokens': 0, 'cache_write_tokens': 0}
+
+    def _warm_session(self, user_id: str, session_id: str) -> Optional[_WarmSession]:
+        """Call with self._lock held."""
+        fingerprint = self._current.get((user_id, session_id))
+        return self._sessions.get((user_id, session_id, fingerprint)) if fingerprint else None
+
+    def _reusable_plan(self, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """The session's last plan if it may serve this turn; claims one of its reuse turns."""
+        with self._lock:
+            warm = self._warm_session(user_id, session_id)
+            if warm is None or warm.turns_since_plan >= self.reuse_plan_turns:
+                return None
+            warm.turns_since_plan += 1
+            self.counts['plan_reused'] += 1
+            return warm.plan
+
+    async def process_request(
+        self,
+        input_text: str,
+        user_id: str,
+        session_id: str,
+        chat_history: List[ConversationMessage],
+        additional_params: Optional[Dict[str, str]] = None
+    ) -> ConversationMessage:
+        token = _request_user.set(user_id)
+        try:
+            plan = self._reusable_plan(user_id, session_id)
+            if plan is not None:
+                with self.prefetch_retrievals(input_text, plan['knowledge_base_ids']):
+                    return await self.run_plan(plan, input_text, session_id)
+            with self.prefetch_retrievals(input_text):
+                response = await self._plan_and_run(input_text, session_id, chat_history)
+            with self._lock:
+                warm = self._warm_session(user_id, session_id)
+                if warm is not None:
+                    warm.turns_since_plan = 0
+            return response
+        except Exception as error:
+            Logger.error(f"Error processing request with Bedrock: {str(error)}")
+            raise error
+        finally:
+            _request_user.reset(token)
+
+    async def _plan_and_run(self, input_text: str, session_id: str,
+                            chat_history: List[ConversationMessage]) -> ConversationMessage:
+        """BedrockInlineAgent's planning call, with the catalogue behind a prompt cache point."""
+        conversation = [*chat_history, ConversationMessage(role=ParticipantRole.USER.value,
+                                                           content=[{'text': input_text}])]
+        self.update_system_prompt()
+        system = [{'text': self.system_prompt}]
+        if self.prompt_caching:
+            system.append({'cachePoint': {'type': 'default'}})
+        response = self.client.converse(
+            modelId=self.model_id,
+            messages=conversation_to_dict(conversation),
+            system=system,
+            inferenceConfig={
+                'maxTokens': self.inference_config.get('maxTokens'),
+                'temperature': self.inference_config.get('temperature'),
+                'topP': self.inference_config.get('topP'),
+                'stopSequences': self.inference_config.get('stopSequences'),
+            },
+            toolConfig={'tools': self.inline_agent_tool,
+                        'toolChoice': {'tool': {'name': BedrockInlineAgent.TOOL_NAME}}},
+        )
+        if 'output' not in response:
+            raise ValueError("No output received from Bedrock model")
+        usage = response.get('usage', {})
+        with self._lock:
+            self.counts['planned'] += 1
+            self.counts['cache_read_tokens'] += usage.get('cacheReadInputTokens', 0)
+            self.counts['cache_write_tokens'] += usage.get('cacheWriteInputTokens', 0)
+
+        message = ConversationMessage(role=response['output']['message']['role'],
+                                      content=response['output']['message']['content'])
+        for block in message.content:
+            tool_use = block.get('toolUse') if isinstance(block, dict) else None
+            if tool_use and tool_use.get('name') == BedrockInlineAgent.TOOL_NAME:
+                tool_input = tool_use.get('input', {})
+                return await self.run_plan(self.plan_from_tool_input(tool_input),
+                                           tool_input.get('user_request', '') or input_text, session_id)
+        return message
+
+    def invoke_inline_agent(self, plan: Dict[str, Any], input_text: str, session_id: str) -> Dict[str, Any]:
+        user_id = _request_user.get()
+        fingerprint = config_fingerprint(self.foundation_model, plan)
+        key = (user_id, session_id, fingerprint)
+        with self._lock:
+            warm = self._sessions.get(key)
+            if warm is None:
+                warm = self._sessions[key] = _WarmSession(f'{session_id}-{fingerprint[:12]}', plan)
+                self.counts['new_sessions'] += 1
+                while len(self._sessions) > self.max_sessions:
+                    evicted, _ = self._sessions.popitem(last=False)
+                    if self._current.get(evicted[:2]) == evicted[2]:
+                        del self._current[evicted[:2]]
+            else:
+                self.counts['warm_sessions'] += 1
+            self._sessions.move_to_end(key)
+            self._current[(user_id, session_id)] = fingerprint
+            warm.turns += 1
+        return self.bedrock_agent_client.invoke_inline_agent(
+            actionGroups=plan['action_groups'],
+            enableTrace=self.enableTrace,
+            endSession=False,
+            foundationModel=self.foundation_model,
+            inputText=input_text,
+            instruction=plan['instruction'],
+            sessionId=warm.inline_session_id,
+            idleSessionTTLInSeconds=self.idle_session_ttl,
+        )
+
+    def end_session(self, user_id: str, session_id: str) -> None:
+        """Forget the warm inline sessions of a conversation (the next turn plans again)."""
+        with self._lock:
+            self._current.pop((user_id, session_id), None)
+            for key in [key for key in self._sessions if key[:2] == (user_id, session_id)]:
+                del self._sessions[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counts, 'sessions': len(self._sessions)}
+
+
+if __name__ == "__main__":
+    import asyncio
+    from multi_agent_orchestrator.agents import BedrockInlineAgentOptions
+    from stub_bedrock import StubBedrockServer, _last_user_text
+
+    TURNS = 200
+    ACTION_GROUPS = [{'actionGroupName': 'CodeInterpreterAction', 'parentActionGroupSignature': 'AMAZON.CodeInterpreter',
+                      'description': 'Use this to write and execute python code to answer questions and other tasks.'}] + [
+        {'actionGroupName': f'ReportingAction{i}', 'description': f'Reporting API number {i}: ' + 'lookup ' * 40,
+         'actionGroupExecutor': {'customControl': 'RETURN_CONTROL'},
+         'functionSchema': {'functions': [{'name': f'report_{i}', 'description': 'Fetch a report.'}]}}
+        for i in range(8)]
+
+    def planner(model_id, body):
+        """Stub planning call: always picks the code interpreter."""
+        return [{'toolUse': {'toolUseId': 'tooluse_stub_plan', 'name': BedrockInlineAgent.TOOL_NAME, 'input': {
+            'action_group_names': ['CodeInterpreterAction'], 'knowledge_bases': [],
+            'description': 'Write and run python code to answer the customer request step by step.',
+            'user_request': _last_user_text(body)}}}]
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    async def run(agent):
+        latencies = []
+        for turn in range(TURNS):
+            t1 = time.perf_counter()
+            await agent.process_request(f"turn {turn}: compute the next fibonacci number", 'user1', 'session1', [])
+            latencies.append((time.perf_counter() - t1) * 1000)
+        return latencies
+
+    print(f"{TURNS} consecutive turns, stub latency 50ms per call")
+    for name, options_class, agent_class, extra in [
+            ('BedrockInlineAgent', BedrockInlineAgentOptions, BedrockInlineAgent, {}),
+            ('WarmInlineAgent, plan every turn', WarmInlineAgentOptions, WarmInlineAgent, {'prompt_caching': True}),
+            ('WarmInlineAgent, reuse plan 10 turns', WarmInlineAgentOptions, WarmInlineAgent, {'prompt_caching': True, 'reuse_plan_turns': 10})]:
+        with StubBedrockServer(latency=0.05, responder=planner) as server:
+            agent = agent_class(options_class(
+                name='Inline Agent Creator', description='Creates inline agents for customer requests',
+                action_groups_list=[dict(group) for group in ACTION_GROUPS], client=server.client(),
+                bedrock_agent_client=server.client('bedrock-agent-runtime'), **extra))
+            latencies = asyncio.run(run(agent))
+            print(f"{name:<38} p50 {percentile(latencies, 50):6.1f}ms  p95 {percentile(latencies, 95):6.1f}ms  "
+                  f"total {sum(latencies) / 1000:5.1f}s  calls={server.request_count}  "
+                  f"sent={server.request_bytes / 1024:.0f}KiB  inline sessions={len(server.agent_sessions)}")
+            if isinstance(agent, WarmInlineAgent):
+                print(f"{'':<38} {agent.stats()}")
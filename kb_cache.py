@@ -0,0 +1,394 @@
+"""
+Retrieval cache and local vector index in front of AmazonKnowledgeBasesRetriever.
+
+Every Retrieve call is a remote round-trip (HYBRID search in 06 takes a few
+hundred milliseconds) even when the same question was asked a minute ago.
+CachingRetriever wraps any Retriever and answers from, in this order:
+
+1. a LocalVectorIndex, when one is configured and is younger than
+   `index_max_age`: a mirror of the knowledge base built from an export
+   (one JSON passage per line), stored as a memory-mapped float32 matrix and
+   searched on the CPU either exhaustively ('flat') or through an inverted file
+   of k-means clusters ('ivf', only `nprobe` clusters are scanned);
+2. a cache of earlier retrievals keyed by query embedding: a query whose
+   embedding is at least `similarity_threshold` similar to a cached one gets
+   that entry's results, until the entry is older than `cache_ttl`;
+3. the wrapped retriever, whose results are then cached.
+
+    index = LocalVectorIndex.build('kb_index', read_export('kb_export.jsonl'), nlist=64)
+    retriever = CachingRetriever(CachingRetrieverOptions(
+        retriever=AmazonKnowledgeBasesRetriever(...), index=index, index_max_age=24 * 3600))
+
+Query and passage embeddings default to dense hashed n-gram vectors (no model
+call); pass `embed_fn=bedrock_embed_fn(client)` to use the same Titan embedding
+model as the knowledge base instead. Passages in the export may carry their own
+'embedding' vectors, which are then used as is.
+
+Run `python kb_cache.py` for a latency comparison against a stub knowledge base.
+"""
+import hashlib
+import json
+import math
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from multi_agent_orchestrator.retrievers import Retriever
+from multi_agent_orchestrator.utils import Logger
+
+from runner import run_in_thread
+from text_utils import hashed_counts, normalize_text
+
+EmbedFn = Callable[[str], np.ndarray]
+
+DEFAULT_DENSE_DIM = 512
+
+
+def hashed_dense_vector(text: str, dim: int = DEFAULT_DENSE_DIM) -> np.ndarray:
+    """L2-normalized float32 vector of hashed n-gram counts (sublinear tf)."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for index, count in hashed_counts(text, dim).items():
+        vector[index] = 1.0 + math.log(count)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def bedrock_embed_fn(client, model_id: str = 'amazon.titan-embed-text-v2:0', dimensions: int = 512) -> EmbedFn:
+    """Embed with a Bedrock embedding model through invoke_model."""
+    def embed(text: str) -> np.ndarray:
+        response = client.invoke_model(modelId=model_id, body=json.dumps(
+            {'inputText': text, 'dimensions': dimensions, 'normalize': True}))
+        return np.asarray(json.loads(response['body'].read())['embedding'], dtype=np.float32)
+    return embed
+
+
+def read_export(path: str) -> Iterator[Dict[str, Any]]:
+    """Passages of a knowledge base export: one {"text", "location"?, "metadata"?, "embedding"?} per line."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, iterations: int = 12, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: centroids of L2-normalized vectors, compared by dot product."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(nlist):
+            members = vectors[assignment == cluster]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids
+
+
+class LocalVectorIndex:
+    """Passages and their vectors on disk, searched through a read-only memory map.
+
+    Files in `path`: vectors.f32 (count x dim float32), records.jsonl (one result
+    per line, in vector order), offsets.npy (line offsets), manifest.json and, for
+    an IVF index, ivf.npz (centroids and the first row of every cluster).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.count = self.manifest['count']
+        self.dim = self.manifest['dim']
+        self.knowledge_base_id = self.manifest.get('knowledge_base_id')
+        self.vectors = np.memmap(os.path.join(path, 'vectors.f32'), dtype=np.float32, mode='r',
+                                 shape=(self.count, self.dim))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self._records_file = open(os.path.join(path, 'records.jsonl'), 'rb')
+        self._records = mmap.mmap(self._records_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.centroids: Optional[np.ndarray] = None
+        self.list_starts: Optional[np.ndarray] = None
+        if self.manifest.get('nlist'):
+            ivf = np.load(os.path.join(path, 'ivf.npz'))
+            self.centroids, self.list_starts = ivf['centroids'], ivf['list_starts']
+
+    @classmethod
+    def build(cls, path: str, passages: Iterable[Dict[str, Any]], embed_fn: Optional[EmbedFn] = None,
+              nlist: int = 0, knowledge_base_id: Optional[str] = None) -> 'LocalVectorIndex':
+        """Embed passages and write the index; nlist > 0 clusters them into an IVF index."""
+        embed_fn = embed_fn or hashed_dense_vector
+        records, vectors = [], []
+        for passage in passages:
+            vector = passage.get('embedding')
+            vectors.append(np.asarray(vector, dtype=np.float32) if vector is not None else embed_fn(passage['text']))
+            records.append({'content': {'text': passage['text'], 'type': 'TEXT'},
+                            'location': passage.get('location'), 'metadata': passage.get('metadata', {})})
+        if not records:
+            raise ValueError("Cannot build an index without passages.")
+        matrix = np.vstack(vectors).astype(np.float32)
+        nlist = min(nlist, len(records))
+        list_starts = centroids = None
+        if nlist:
+            centroids = _kmeans(matrix, nlist)
+            assignment = np.argmax(matrix @ centroids.T, axis=1)
+            # rows of one cluster are stored next to each other, so a probe reads one contiguous slice
+            order = np.argsort(assignment, kind='stable')
+            matrix, records = matrix[order], [records[i] for i in order]
+            list_starts = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+
+        os.makedirs(path, exist_ok=True)
+        matrix.tofile(os.path.join(path, 'vectors.f32'))
+        offsets = [0]
+        with open(os.path.join(path, 'records.jsonl'), 'wb') as f:
+            for record in records:
+                offsets.append(offsets[-1] + f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'))
+        np.save(os.path.join(path, 'offsets.npy'), np.asarray(offsets, dtype=np.int64))
+        if nlist:
+            np.savez(os.path.join(path, 'ivf.npz'), centroids=centroids, list_starts=list_starts)
+        with open(os.path.join(path, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump({'count': len(records), 'dim': matrix.shape[1], 'nlist': nlist,
+                       'built_at': time.time(), 'knowledge_base_id': knowledge_base_id}, f)
+        return cls(path)
+
+    @property
+    def age(self) -> float:
+        """Seconds since the index was built."""
+        return time.time() - self.manifest['built_at']
+
+    def search(self, query_vector: np.ndarray, top_k: int = 5, nprobe: int = 8) -> List[Tuple[int, float]]:
+        """(row, score) of the top_k rows by dot product, best first."""
+        if self.centroids is None:
+            rows, scores = np.arange(self.count), self.vectors @ query_vector
+        else:
+            probes = np.argsort(self.centroids @ query_vector)[::-1][:nprobe]
+            rows = np.concatenate([np.arange(self.list_starts[c], self.list_starts[c + 1]) for c in probes])
+            scores = np.concatenate([self.vectors[self.list_starts[c]:self.list_starts[c + 1]] @ query_vector
+                                     for c in probes])
+        if len(scores) > top_k:
+            best = np.argpartition(scores, -top_k)[-top_k:]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(scores[best])[::-1]]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def record(self, row: int, score: Optional[float] = None) -> Dict[str, Any]:
+        """The row as a Retrieve result."""
+        record = json.loads(self._records[self.offsets[row]:self.offsets[row + 1]])
+        if score is not None:
+            record['score'] = round(score, 4)
+        return record
+
+    def close(self) -> None:
+        self._records.close()
+        self._records_file.close()
+
+
+@dataclass
+class CachingRetrieverOptions:
+    retriever: Retriever  # usually AmazonKnowledgeBasesRetriever, called on a miss
+    similarity_threshold: float = 0.92  # min cosine similarity between query embeddings for a cache hit
+    cache_ttl: Optional[float] = 900  # seconds a cached retrieval is served, None keeps it until evicted
+    max_entries: int = 1024
+    embed_fn: Optional[EmbedFn] = None  # defaults to hashed_dense_vector; must match the index's vectors
+    index: Optional[LocalVectorIndex] = None  # local mirror of the knowledge base
+    index_max_age: Optional[float] = 24 * 3600  # older indexes are bypassed, None never expires them
+    top_k: int = 5  # results returned from the local index
+    nprobe: int = 8  # IVF clusters scanned per query
+
+
+@dataclass
+class _CacheEntry:
+    embedding: np.ndarray
+    results: List[Dict[str, Any]]
+    created_at: float
+
+
+class CachingRetriever(Retriever):
+    def __init__(self, options: CachingRetrieverOptions):
+        super().__init__(options)
+        self.options = options
+        self.retriever = options.retriever
+        self.embed_fn = options.embed_fn or hashed_dense_vector
+        self._entries: 'OrderedDict[Tuple[str, str], _CacheEntry]' = OrderedDict()
+        self._stale_index_logged = False
+        # lookups can run on several threads at once (prefetch.PrefetchingRetriever)
+        self._lock = threading.Lock()
+        self.counts = {'index': 0, 'hits': 0, 'semantic_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def index_is_fresh(self) -> bool:
+        index = self.options.index
+        if index is None:
+            return False
+        if self.options.index_max_age is not None and index.age > self.options.index_max_age:
+            if not self._stale_index_logged:
+                Logger.warn(f"[kb_cache] local index {index.path} is {index.age / 3600:.1f}h old, "
+                            f"using the knowledge base until it is rebuilt")
+                self._stale_index_logged = True
+            return False
+        return True
+
+    @staticmethod
+    def _scope(knowledge_base_id: Optional[str], retrieval_configuration: Optional[Dict]) -> str:
+        """Cache entries only match queries against the same knowledge base and configuration."""
+        return hashlib.sha1(json.dumps([knowledge_base_id, retrieval_configuration],
+                                       sort_keys=True, default=str).encode()).hexdigest()
+
+    def _lookup(self, scope: str, key: str, embedding: Optional[np.ndarray], now: float) -> Optional[_CacheEntry]:
+        entry = self._entries.get((scope, key))
+        if entry is not None and not self._expired(entry, now):
+            self._entries.move_to_end((scope, key))
+            self.counts['hits'] += 1
+            return entry
+        if embedding is None:
+            return None
+        best_key, best_score = None, self.options.similarity_threshold
+        for other_key, other in list(self._entries.items()):
+            if self._expired(other, now):
+                del self._entries[other_key]
+                self.counts['evictions'] += 1
+            elif other_key[0] == scope:
+                score = float(other.embedding @ embedding)
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        self.counts['semantic_hits'] += 1
+        return self._entries[best_key]
+
+    def _expired(self, entry: _CacheEntry, now: float) -> bool:
+        return self.options.cache_ttl is not None and now - entry.created_at > self.options.cache_ttl
+
+    def _store(self, scope: str, key: str, embedding: np.ndarray, results: List[Dict[str, Any]], now: float) -> None:
+        self._entries[(scope, key)] = _CacheEntry(embedding, results, now)
+        self._entries.move_to_end((scope, key))
+        while len(self._entries) > self.options.max_entries:
+            self._entries.popitem(last=False)
+            self.counts['evictions'] += 1
+
+    async def retrieve(self, text: str, knowledge_base_id: Optional[str] = None,
+                       retrieval_configuration: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        if not text:
+            raise ValueError("Input text is required for retrieve")
+        index = self.options.index
+        embedding = self.embed_fn(text)
+        if self.index_is_fresh() and knowledge_base_id in (None, index.knowledge_base_id):
+            self.counts['index'] += 1
+            return [index.record(row, score) for row, score in
+                    index.search(embedding, self.options.top_k, self.options.nprobe)]
+
+        now = time.monotonic()
+        scope, key = self._scope(knowledge_base_id, retrieval_configuration), normalize_text(text)
+        with self._lock:
+            entry = self._lookup(scope, key, embedding, now)
+            if entry is None:
+                self.counts['misses'] += 1
+        if entry is not None:
+            return entry.results
+
+        kwargs = {name: value for name, value in (('knowledge_base_id', knowledge_base_id),
+                                                  ('retrieval_configuration', retrieval_configuration)) if value}
+        # AmazonKnowledgeBasesRetriever calls boto3 synchronously inside its coroutine
+        results = await run_in_thread(self.retriever.retrieve(text, **kwargs))
+        with self._lock:
+            self._store(scope, key, embedding, results, now)
+        return results
+
+    async def retrieve_and_combine_results(self, text: str, knowledge_base_id: Optional[str] = None,
+                                           retrieval_configuration: Optional[Dict] = None) -> str:
+        results = await self.retrieve(text, knowledge_base_id, retrieval_configuration)
+        return "\n".join(result['content']['text'] for result in results
+                         if result and result.get('content') and isinstance(result['content'].get('text'), str))
+
+    async def retrieve_and_generate(self, text: str, *args: Any, **kwargs: Any) -> Any:
+        return await self.retriever.retrieve_and_generate(text, *args, **kwargs)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = sum(self.counts[name] for name in ('index', 'hits', 'semantic_hits', 'misses'))
+        return {
+            'entries': len(self._entries),
+            **self.counts,
+            'remote_rate': self.counts['misses'] / lookups if lookups else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    import asyncio
+    import random
+    import shutil
+    import tempfile
+    from multi_agent_orchestrator.retrievers import AmazonKnowledgeBasesRetriever, AmazonKnowledgeBasesRetrieverOptions
+    from stub_bedrock import StubBedrockServer
+
+    KB_ID = 'KBSTUB0001'
+    random.seed(5)
+    SERVICES = ['Bedrock', 'SageMaker', 'Lambda', 'S3', 'DynamoDB', 'Kendra', 'Q Business', 'Comprehend']
+    ASPECTS = ['pricing', 'quotas', 'regions', 'security', 'fine-tuning', 'monitoring', 'latency', 'batch jobs']
+    FILLER = 'customers can configure the feature through the console the API or infrastructure as code'.split()
+    PASSAGES = [{'text': f"{service} {aspect} note {n}: " + ' '.join(random.choices(FILLER, k=25)) + '.',
+                 'location': {'type': 'S3', 's3Location': {'uri': f's3://kb-export/{service}/{aspect}/{n}.txt'}}}
+                for service in SERVICES for aspect in ASPECTS for n in range(60)]
+    QUESTIONS = [f"What are the {aspect} of {service}?" for service in SERVICES for aspect in ASPECTS]
+    # 150 queries over 64 distinct questions, most of them with small wording differences
+    QUERIES = [random.choice([q, q.lower().rstrip('?'), q.replace('What are the', 'What are')])
+               for q in random.choices(QUESTIONS, k=150)]
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    async def measure(retriever):
+        latencies = []
+        for query in QUERIES:
+            t1 = time.perf_counter()
+            await retriever.retrieve(query)
+            latencies.append((time.perf_counter() - t1) * 1000)
+        return latencies
+
+    index_dir = tempfile.mkdtemp()
+    try:
+        t1 = time.perf_counter()
+        flat_index = LocalVectorIndex.build(os.path.join(index_dir, 'flat'), PASSAGES, knowledge_base_id=KB_ID)
+        ivf_index = LocalVectorIndex.build(os.path.join(index_dir, 'ivf'), PASSAGES, nlist=64, knowledge_base_id=KB_ID)
+        print(f"{len(PASSAGES)} passages, built flat + IVF(64) indexes in {time.perf_counter() - t1:.1f}s; "
+              f"stub Retrieve latency 150ms")
+
+        with StubBedrockServer(latency=0.15, knowledge_bases={KB_ID: PASSAGES}) as server:
+            remote = AmazonKnowledgeBasesRetriever(AmazonKnowledgeBasesRetrieverOptions(
+                knowledge_base_id=KB_ID, region='us-east-1',
+                retrievalConfiguration={'vectorSearchConfiguration': {'numberOfResults': 5}}))
+            remote.client = server.client('bedrock-agent-runtime')
+            scenarios = [
+                ('remote only', remote),
+                ('semantic cache', CachingRetriever(CachingRetrieverOptions(retriever=remote))),
+                ('local flat index', CachingRetriever(CachingRetrieverOptions(retriever=remote, index=flat_index))),
+                ('local IVF index', CachingRetriever(CachingRetrieverOptions(retriever=remote, index=ivf_index))),
+            ]
+            for name, retriever in scenarios:
+                server.request_count = 0
+                latencies = asyncio.run(measure(retriever))
+                print(f"{name:<18} p50 {percentile(latencies, 50):7.2f}ms  p95 {percentile(latencies, 95):7.2f}ms  "
+                      f"Retrieve calls={server.request_count}")
+
+        def precision(index):
+            """Share of the top 5 passages that are about the service and aspect the question asks for."""
+            relevant = 0
+            for question in QUESTIONS:
+                prefix = ' '.join(question[len('What are the '):-1].split(' of ')[::-1])
+                relevant += sum(index.record(row)['content']['text'].startswith(prefix)
+                                for row, _ in index.search(hashed_dense_vector(question), 5))
+            return relevant / (5 * len(QUESTIONS))
+
+        print(f"precision@5: flat {precision(flat_index):.2f}, IVF nprobe=8 {precision(ivf_index):.2f}")
+        flat_index.close()
+        ivf_index.close()
+    finally:
+        shutil.rmtree(index_dir)
@@ -0,0 +1,340 @@
+"""
+Parallel multi-knowledge-base retrieval with reciprocal-rank fusion.
+
+BedrockInlineAgent passes the knowledge bases the model picked to
+InvokeInlineAgent and the inline agent then queries them itself, one after the
+other, and puts every passage it got into its prompt. FusedKnowledgeInlineAgent
+instead queries all attached knowledge bases concurrently as soon as the request
+arrives (while the model is still choosing action groups and knowledge bases),
+merges the ranked lists with reciprocal-rank fusion (RRF), folds near-identical
+passages into one, and sends only the fused top_k passages to the inline agent
+as part of its input. The inline agent gets no knowledgeBases, so it makes no
+retrieval round-trips of its own.
+
+    bedrock_inline_agent = FusedKnowledgeInlineAgent(FusedKnowledgeInlineAgentOptions(
+        ..., knowledge_bases=knowledge_bases, top_k=5))
+
+MultiKnowledgeBaseRetriever can also be used on its own, e.g. as the retriever
+of a BedrockLLMAgent that should draw on several knowledge bases.
+
+Run `python kb_fusion.py` to compare sequential and parallel retrieval from two
+stub knowledge bases and the size of the injected context.
+"""
+import asyncio
+import contextvars
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional
+
+from multi_agent_orchestrator.agents import BedrockInlineAgent, BedrockInlineAgentOptions
+from multi_agent_orchestrator.retrievers import Retriever
+from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole
+from multi_agent_orchestrator.utils import Logger
+
+from text_utils import cosine, hashed_ngram_vector, normalize_text
+
+RetrievalResult = Dict[str, Any]
+
+
+def result_text(result: RetrievalResult) -> str:
+    return (result.get('content') or {}).get('text') or ''
+
+
+def reciprocal_rank_fusion(ranked_lists: Dict[str, List[RetrievalResult]], k: int = 60) -> List[RetrievalResult]:
+    """Merge ranked lists: every result scores sum(1 / (k + rank)) over the lists it appears in.
+
+    Results are identified by their normalized text; each returned result is a copy
+    carrying 'rrfScore' and the 'knowledgeBaseIds' it came from.
+    """
+    fused: Dict[str, RetrievalResult] = {}
+    for knowledge_base_id, results in ranked_lists.items():
+        for rank, result in enumerate(results, start=1):
+            key = hashlib.sha1(normalize_text(result_text(result)).encode('utf-8')).hexdigest()
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**result, 'rrfScore': 0.0, 'knowledgeBaseIds': []}
+            entry['rrfScore'] += 1.0 / (k + rank)
+            if knowledge_base_id not in entry['knowledgeBaseIds']:
+                entry['knowledgeBaseIds'].append(knowledge_base_id)
+    return sorted(fused.values(), key=lambda entry: -entry['rrfScore'])
+
+
+def fold_near_duplicates(results: List[RetrievalResult], threshold: float = 0.9) -> List[RetrievalResult]:
+    """Drop results whose text is at least `threshold` similar to a better-ranked one.
+
+    The dropped result's RRF score is added to the one it duplicates, so a passage
+    found in several knowledge bases (with small differences) moves up.
+    """
+    kept: List[RetrievalResult] = []
+    vectors = []
+    for result in results:
+        vector = hashed_ngram_vector(result_text(result))
+        duplicate_of = next((i for i, other in enumerate(vectors) if cosine(vector, other) >= threshold), None)
+        if duplicate_of is None:
+            kept.append(result)
+            vectors.append(vector)
+            continue
+        original = kept[duplicate_of]
+        original['rrfScore'] = original.get('rrfScore', 0.0) + result.get('rrfScore', 0.0)
+        original.setdefault('knowledgeBaseIds', [])
+        original['knowledgeBaseIds'] += [kb for kb in result.get('knowledgeBaseIds', [])
+                                         if kb not in original['knowledgeBaseIds']]
+    return sorted(kept, key=lambda entry: -entry.get('rrfScore', 0.0))
+
+
+def render_passages(results: List[RetrievalResult], max_chars: Optional[int] = None) -> str:
+    """Numbered passages with their knowledge base ids, for the model's prompt."""
+    parts = []
+    for number, result in enumerate(results, start=1):
+        text = result_text(result)
+        if max_chars and len(text) > max_chars:
+            text = text[:max_chars].rstrip() + '…'
+        sources = ', '.join(result.get('knowledgeBaseIds', []))
+        parts.append(f"<passage id=\"{number}\" knowledge_base=\"{sources}\">\n{text}\n</passage>")
+    return '\n'.join(parts)
+
+
+@dataclass
+class MultiKnowledgeBaseRetrieverOptions:
+    knowledge_bases: List[Dict[str, Any]]  # [{'knowledgeBaseId': ..., 'description': ...}], as for BedrockInlineAgent
+    client: Any  # bedrock-agent-runtime client
+    results_per_kb: int = 5  # numberOfResults of every Retrieve call
+    search_type: Optional[str] = None  # overrideSearchType, e.g. 'HYBRID'
+    top_k: int = 5  # fused results returned
+    rrf_k: int = 60
+    dedup_threshold: float = 0.9  # cosine similarity above which two passages count as the same
+    max_passage_chars: Optional[int] = 1500  # passages are cut to this length when rendered
+    model_arn: Optional[str] = None  # generation model of retrieve_and_generate (primary knowledge base only)
+
+
+class MultiKnowledgeBaseRetriever(Retriever):
+    def __init__(self, options: MultiKnowledgeBaseRetrieverOptions):
+        super().__init__(options)
+        self.options = options
+        self.knowledge_base_ids = [kb['knowledgeBaseId'] for kb in options.knowledge_bases]
+        # one Retrieve per knowledge base in flight per request; boto3 blocks, so they run on threads
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.knowledge_base_ids)),
+                                            thread_name_prefix='kb-fusion')
+
+    def _search_configuration(self) -> Dict[str, Any]:
+        search: Dict[str, Any] = {'numberOfResults': self.options.results_per_kb}
+        if self.options.search_type:
+            search['overrideSearchType'] = self.options.search_type
+        return search
+
+    def _retrieve_one(self, text: str, knowledge_base_id: str) -> List[RetrievalResult]:
+        response = self.options.client.retrieve(knowledgeBaseId=knowledge_base_id,
+                                                retrievalQuery={'text': text},
+                                                retrievalConfiguration={
+                                                    'vectorSearchConfiguration': self._search_configuration()})
+        return response.get('retrievalResults', [])
+
+    def submit(self, text: str, knowledge_base_ids: Optional[List[str]] = None) -> Dict[str, Future]:
+        """Start one Retrieve per knowledge base right away, without waiting for the event loop."""
+        return {kb_id: self._executor.submit(contextvars.copy_context().run, self._retrieve_one, text, kb_id)
+                for kb_id in (knowledge_base_ids or self.knowledge_base_ids)}
+
+    async def fuse(self, futures: Dict[str, Future]) -> List[RetrievalResult]:
+        """Wait for submitted Retrieve calls and fuse their results; a failing knowledge base is skipped."""
+        outcomes = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures.values()),
+                                        return_exceptions=True)
+        ranked_lists = {}
+        for kb_id, outcome in zip(futures, outcomes):
+            if isinstance(outcome, BaseException):
+                Logger.error(f"[kb_fusion] retrieve from {kb_id} failed: {outcome}")
+            else:
+                ranked_lists[kb_id] = outcome
+        if futures and not ranked_lists:
+            Logger.error(f"[kb_fusion] every knowledge base retrieval failed ({', '.join(futures)}); "
+                         f"continuing without knowledge base context")
+        fused = reciprocal_rank_fusion(ranked_lists, self.options.rrf_k)
+        return fold_near_duplicates(fused, self.options.dedup_threshold)[:self.options.top_k]
+
+    async def retrieve(self, text: str, knowledge_base_ids: Optional[List[str]] = None) -> List[RetrievalResult]:
+        return await self.fuse(self.submit(text, knowledge_base_ids))
+
+    async def retrieve_and_combine_results(self, text: str, knowledge_base_ids: Optional[List[str]] = None) -> str:
+        return render_passages(await self.retrieve(text, knowledge_base_ids), self.options.max_passage_chars)
+
+    async def retrieve_and_generate(self, text: str,
+                                    retrieve_and_generate_configuration: Optional[Dict[str, Any]] = None) -> Any:
+        """RetrieveAndGenerate against the primary (first) knowledge base; there is no fusion here.
+
+        Without a configuration one is built from the primary knowledge base and options.model_arn.
+        """
+        configuration = retrieve_and_generate_configuration
+        if configuration is None:
+            if not self.options.model_arn:
+                raise ValueError("retrieve_and_generate needs options.model_arn or a configuration")
+            configuration = {
+                'type': 'KNOWLEDGE_BASE',
+                'knowledgeBaseConfiguration': {
+                    'knowledgeBaseId': self.knowledge_base_ids[0],
+                    'modelArn': self.options.model_arn,
+                    'retrievalConfiguration': {'vectorSearchConfiguration': self._search_configuration()},
+                },
+            }
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(
+            self.options.client.retrieve_and_generate, input={'text': text},
+            retrieveAndGenerateConfiguration=configuration))
+
+
+@dataclass
+class FusedKnowledgeInlineAgentOptions(BedrockInlineAgentOptions):
+    results_per_kb: int = 5
+    search_type: Optional[str] = None
+    top_k: int = 5  # fused passages sent to the inline agent
+    dedup_threshold: float = 0.9
+    max_passage_chars: Optional[int] = 1500
+    retriever: Optional[MultiKnowledgeBaseRetriever] = field(default=None, repr=False)  # built from the above if None
+
+
+# Retrieve calls started for the request being processed, read by the tool handler
+_request_retrievals: contextvars.ContextVar = contextvars.ContextVar('request_retrievals', default=None)
+
+
+class FusedKnowledgeInlineAgent(BedrockInlineAgent):
+    def __init__(self, options: FusedKnowledgeInlineAgentOptions):
+        super().__init__(options)
+        self.retriever = options.retriever or MultiKnowledgeBaseRetriever(MultiKnowledgeBaseRetrieverOptions(
+            knowledge_bases=self.knowledge_bases,
+            client=self.bedrock_agent_client,
+            results_per_kb=options.results_per_kb,
+            search_type=options.search_type,
+            top_k=options.top_k,
+            dedup_threshold=options.dedup_threshold,
+            max_passage_chars=options.max_passage_chars,
+        ))
+
+    async def process_request(
+        self,
+        input_text: str,
+        user_id: str,
+        session_id: str,
+        chat_history: List[ConversationMessage],
+        additional_params: Optional[Dict[str, str]] = None
+    ) -> ConversationMessage:
+        # the knowledge bases are queried while the model decides which of them it needs
+        with self.prefetch_retrievals(input_text):
+            return await super().process_request(input_text, user_id, session_id, chat_history, additional_params)
+
+    @contextmanager
+    def prefetch_retrievals(self, text: str, knowledge_base_ids: Optional[List[str]] = None) -> Iterator[None]:
+        """Start the Retrieve calls for text; run_plan picks them up, unused ones are cancelled on exit."""
+        ids = self.retriever.knowledge_base_ids if knowledge_base_ids is None else knowledge_base_ids
+        futures = self.retriever.submit(text, ids) if ids else {}
+        token = _request_retrievals.set(futures)
+        try:
+            yield
+        finally:
+            _request_retrievals.reset(token)
+            for future in futures.values():
+                future.cancel()
+
+    def plan_from_tool_input(self, tool_input: Dict[str, Any]) -> Dict[str, Any]:
+        """Action groups, knowledge bases and instruction the model chose for the inline agent."""
+        action_group_names = tool_input.get('action_group_names', [])
+        action_groups = [dict(item) for item in self.action_groups_list
+                         if item.get('actionGroupName') in action_group_names]
+        for entry in action_groups:
+            # remove description for AMAZON.CodeInterpreter
+            if entry.get('parentActionGroupSignature') == 'AMAZON.CodeInterpreter':
+                entry.pop('description', None)
+        kb_names = tool_input.get('knowledge_bases') or []
+        return {
+            'action_groups': action_groups,
+            'knowledge_base_ids': [kb_id for kb_id in self.retriever.knowledge_base_ids if kb_id in kb_names],
+            'instruction': tool_input.get('description', ''),
+        }
+
+    async def run_plan(self, plan: Dict[str, Any], user_request: str, session_id: str) -> ConversationMessage:
+        """Fuse the passages of the planned knowledge bases into the request and invoke the inline agent."""
+        input_text = user_request
+        futures = _request_retrievals.get() or {}
+        selected = {kb_id: future for kb_id, future in futures.items() if kb_id in plan['knowledge_base_ids']}
+        for kb_id, future in futures.items():
+            if kb_id not in selected:
+                future.cancel()
+        if plan['knowledge_base_ids'] and not futures:
+            selected = self.retriever.submit(user_request, plan['knowledge_base_ids'])
+        if selected:
+            passages = await self.retriever.fuse(selected)
+            self.log_debug("FusedKnowledgeInlineAgent", 'Fused passages', passages)
+            if passages:
+                input_text = (f"{user_request}\n\nSearch results from the knowledge bases:\n"
+                              f"{render_passages(passages, self.retriever.options.max_passage_chars)}")
+
+        inline_response = self.invoke_inline_agent(plan, input_text, session_id)
+        tool_results = []
+        for event in inline_response.get('completion'):
+            Logger.info(event) if self.enableTrace else None
+            if 'bytes' in event.get('chunk', {}):
+                tool_results.append(event['chunk']['bytes'].decode('utf-8'))
+        return ConversationMessage(role=ParticipantRole.ASSISTANT.value,
+                                   content=[{'text': ''.join(tool_results)}])
+
+    def invoke_inline_agent(self, plan: Dict[str, Any], input_text: str, session_id: str) -> Dict[str, Any]:
+        return self.bedrock_agent_client.invoke_inline_agent(
+            actionGroups=plan['action_groups'],
+            enableTrace=self.enableTrace,
+            endSession=False,
+            foundationModel=self.foundation_model,
+            inputText=input_text,
+            instruction=plan['instruction'],
+            sessionId=session_id
+        )
+
+    async def inline_agent_tool_handler(self, session_id, response, conversation):
+        """Invoke the inline agent with the fused passages in its input instead of the knowledge bases."""
+        for content_block in response.content or []:
+            tool_use = content_block.get('toolUse') if isinstance(content_block, dict) else None
+            if tool_use and tool_use.get('name') == BedrockInlineAgent.TOOL_NAME:
+                tool_input = tool_use.get('input', {})
+                return await self.run_plan(self.plan_from_tool_input(tool_input),
+                                           tool_input.get('user_request', ''), session_id)
+
+        raise ValueError("Tool use block not handled")
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from stub_bedrock import StubBedrockServer
+
+    random.seed(11)
+    WORDS = ('revenue wealth management clients advisors assets memory context window paging agent '
+             'hierarchy archival recall storage quarterly growth').split() \
+        + [''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=6)) for _ in range(400)]
+    shared = [' '.join(random.choices(WORDS, k=60)) + '.' for _ in range(20)]
+    # the second knowledge base holds lightly edited copies of some of the first one's passages
+    KNOWLEDGE_BASES = {
+        'PQ30QPZFEF': [{'text': text} for text in shared],
+        '7L73BZIBHC': [{'text': text.replace('.', ' (updated).')} for text in shared[:10]]
+                      + [{'text': ' '.join(random.choices(WORDS, k=60)) + '.'} for _ in range(20)],
+    }
+    QUERY = 'wealth management advisors memory paging'
+
+    with StubBedrockServer(latency=0.2, knowledge_bases=KNOWLEDGE_BASES) as server:
+        client = server.client('bedrock-agent-runtime')
+        retriever = MultiKnowledgeBaseRetriever(MultiKnowledgeBaseRetrieverOptions(
+            knowledge_bases=[{'knowledgeBaseId': kb_id} for kb_id in KNOWLEDGE_BASES], client=client))
+
+        retriever._retrieve_one(QUERY, 'PQ30QPZFEF')  # open the connection
+        t1 = time.perf_counter()
+        sequential = [result for kb_id in KNOWLEDGE_BASES for result in retriever._retrieve_one(QUERY, kb_id)]
+        sequential_ms = (time.perf_counter() - t1) * 1000
+        everything = '\n'.join(result_text(result) for result in sequential)
+
+        t1 = time.perf_counter()
+        fused = asyncio.run(retriever.retrieve(QUERY))
+        parallel_ms = (time.perf_counter() - t1) * 1000
+        context = render_passages(fused, retriever.options.max_passage_chars)
+
+    print(f"2 knowledge bases x 5 results, stub Retrieve latency 200ms")
+    print(f"sequential: {sequential_ms:6.1f}ms, {len(sequential)} passages, {len(everything)} chars of context")
+    print(f"parallel + RRF + dedup: {parallel_ms:6.1f}ms, {len(fused)} passages, {len(context)} chars of context")
+    print(f"sources of the fused passages: {[result['knowledgeBaseIds'] for result in fused]}")
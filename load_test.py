@@ -0,0 +1,288 @@
+"""
+Load generator replaying the 01-08 scripts against the local Bedrock stub.
+
+Each scenario imports one of the numbered scripts unchanged: boto3's
+AWS_ENDPOINT_URL_BEDROCK_RUNTIME / AWS_ENDPOINT_URL_BEDROCK_AGENT_RUNTIME
+variables point every client the script builds at a StubBedrockServer, and a
+scripted responder plays the model side of each flow (classifier picks,
+supervisor hand-offs to the whole team, one tool call per tool-using agent,
+inline agent plans, final answers). N sessions then run K turns each
+concurrently, every turn on its own worker thread like the scripts'
+run_in_thread callers, and the run reports throughput and p50/p95/p99 turn
+latency per scenario.
+
+The stub is seeded per call: a request draws the same latency and
+throttle_rate decision in every run with the same arguments, however the
+concurrent calls interleave. Timing-dependent behaviour (max_concurrency
+throttling, retries, hedges) still varies a little from run to run, so
+compare reports before and after a change over a few runs.
+
+    python load_test.py --sessions 20 --turns 5 --latency lognormal:0.3:0.5 --tps 80
+    python load_test.py --scenarios 01,05,07 --throttle-rate 0.02
+
+The scripts write their side files (routing_log.jsonl, chat_history.db,
+traces.jsonl) into a temporary directory, not the working tree. Scenarios whose
+script cannot be imported (08 needs exa_py) are reported as skipped.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from multi_agent_orchestrator.agents import BedrockInlineAgent
+
+from runner import run_in_thread
+from stub_bedrock import (Latency, ScriptRule, StubBedrockServer, call_first_tool, delegate_to_team,
+                          lognormal_latency, scripted_responder, tool_use, uniform_latency, _last_user_text)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# run(module, text, user_id, session_id) -> awaitable of one turn
+TurnRunner = Callable[[Any, str, str, str], Awaitable[Any]]
+
+
+@dataclass
+class Scenario:
+    script: str
+    prompts: List[str]
+    run: TurnRunner
+    setup: Optional[Callable[[Any], None]] = None  # what the script's __main__ does before its first turn
+
+
+async def _route(module, text, user_id, session_id):
+    response = await module.orchestrator.route_request(text, user_id, session_id)
+    if isinstance(response.output, str):  # route_request turns exceptions into an error message
+        raise RuntimeError(response.output)
+    return response
+
+
+def _setup_03(module):
+    module.translate_agent.set_system_prompt(variables={"source_lang": "English", "target_lang": "Chinese"})
+    module.review_agent.set_system_prompt(variables={"source_lang": "English", "target_lang": "Chinese",
+                                                     "country": "China"})
+    module.translate_agent_2.set_system_prompt(variables={"source_lang": "English", "target_lang": "Chinese"})
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    '01': Scenario('01.basic_test_classifier.py',
+                   ["What is the best GPU for training AI models?",
+                    "How much sleep does an adult need for good health?"], _route),
+    '02': Scenario('02.supervisor_agent.py',
+                   ["我想预订下周五的酒店房间，并且投诉上次入住的噪音问题"], _route),
+    '03': Scenario('03.sequential_agent.py',
+                   ["The quick brown fox jumps over the lazy dog. It was a sunny spring day."], _route, _setup_03),
+    '04': Scenario('04.bedrock_inline_agent.py',
+                   ["What is the revenue of Morgan Stanley wealth management?",
+                    "Compute the 20th fibonacci number"],
+                   lambda module, text, u, s: module.bedrock_inline_agent.process_request(text, u, s, [], None)),
+    '05': Scenario('05.agent_tools.py',
+                   ["What is the weather in Seattle?", "How can I improve my sleep quality?"], _route),
+    '06': Scenario('06.bedrock_kb.py',
+                   ["What is Amazon Bedrock Knowledge Bases?", "What is the weather in Beijing?"], _route),
+    '07': Scenario('07.stock_research.py',
+                   ["Conduct market research for TSLA stock"],
+                   lambda module, text, u, s: module.planner.process_request(text, u, s, [], {})),
+    '08': Scenario('08.deep_research.py',
+                   ["Research the market for humanoid robots in 2025"],
+                   lambda module, text, u, s: module.planner.process_request(text, u, s, [], {})),
+}
+
+# the model side of every scripted flow; anything else falls through to default_responder
+RESPONSES = [
+    ScriptRule(lambda model_id, body: [tool_use(BedrockInlineAgent.TOOL_NAME, {
+        'action_group_names': ['CodeInterpreterAction'],
+        'knowledge_bases': ['PQ30QPZFEF', '7L73BZIBHC'],
+        'description': 'Answer the customer request with the knowledge bases and python code.',
+        'user_request': _last_user_text(body)})], tool=BedrockInlineAgent.TOOL_NAME),
+    ScriptRule(delegate_to_team, tool='send_messages', step=0),
+    ScriptRule([{'text': 'The team has finished, here is the combined answer. TERMINATE'}], tool='send_messages'),
+    ScriptRule(call_first_tool, tool='*', step=0),
+]
+
+KNOWLEDGE_BASES = {
+    'PQ30QPZFEF': [{'text': f'Morgan Stanley wealth management report {i}: net revenues of {6 + i % 3} billion '
+                            f'in quarter {i % 4 + 1}, driven by fee-based flows and asset management.',
+                    'uri': f's3://stub/morgan-stanley/{i}.pdf'} for i in range(40)] +
+                  [{'text': f'Amazon Bedrock Knowledge Bases note {i}: managed retrieval augmented generation '
+                            f'over documents in S3 with hybrid search.', 'uri': f's3://stub/bedrock/{i}.md'}
+                   for i in range(20)],
+    '7L73BZIBHC': [{'text': f'MemGPT section {i}: virtual context management pages memory between the main '
+                            f'context and external storage like an operating system.',
+                    'uri': f's3://stub/memgpt/{i}.pdf'} for i in range(40)],
+}
+
+
+def parse_latency(value: str) -> Latency:
+    """'0.2', 'uniform:0.1:0.5' or 'lognormal:median[:sigma]' (seconds)."""
+    kind, _, rest = value.partition(':')
+    if not rest:
+        return float(value)
+    args = [float(part) for part in rest.split(':')]
+    if kind == 'uniform':
+        return uniform_latency(*args)
+    if kind == 'lognormal':
+        return lognormal_latency(*args)
+    raise argparse.ArgumentTypeError(f'unknown latency distribution: {value}')
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+
+def load_script(name: str):
+    """Import a numbered script as a module (its __main__ block does not run)."""
+    spec = importlib.util.spec_from_file_location(f'scenario_{name[:2]}', os.path.join(HERE, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class _ErrorLog(logging.Handler):
+    """Keeps the errors the agents log and swallow (default outputs) out of the console, counted per scenario."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.first = ''
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.count += 1
+        self.first = self.first or record.getMessage()
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    wall_time: float = 0.0
+    stub_calls: int = 0
+    throttled: int = 0
+    skipped: str = ''
+    first_error: str = ''
+    logged_errors: int = 0
+
+    def report(self) -> str:
+        if self.skipped:
+            return f"{self.name:<4} skipped: {self.skipped}"
+        turns = len(self.latencies) + self.errors
+        line = (f"{self.name:<4} turns={turns:<5} errors={self.errors:<4} "
+                f"throughput={turns / self.wall_time if self.wall_time else 0:7.2f}/s  "
+                f"p50={percentile(self.latencies, 50) * 1000:8.1f}ms  "
+                f"p95={percentile(self.latencies, 95) * 1000:8.1f}ms  "
+                f"p99={percentile(self.latencies, 99) * 1000:8.1f}ms  "
+                f"stub calls={self.stub_calls} throttled={self.throttled} logged errors={self.logged_errors}")
+        return line + (f"\n     first error: {self.first_error}" if self.first_error else '')
+
+
+async def run_scenario(name: str, module, sessions: int, turns: int, executor) -> ScenarioResult:
+    scenario = SCENARIOS[name]
+    result = ScenarioResult(name)
+    lock = threading.Lock()
+
+    async def session(index: int):
+        user_id, session_id = f'user{index}', f'{name}-session{index}'
+        for turn in range(turns):
+            text = scenario.prompts[(index + turn) % len(scenario.prompts)]
+            t1 = time.perf_counter()
+            try:
+                await run_in_thread(scenario.run(module, text, user_id, session_id), executor)
+            except Exception as error:
+                with lock:
+                    result.errors += 1
+                    result.first_error = result.first_error or f'{type(error).__name__}: {error}'
+            else:
+                with lock:
+                    result.latencies.append(time.perf_counter() - t1)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[session(index) for index in range(sessions)])
+    result.wall_time = time.perf_counter() - t0
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> List[ScenarioResult]:
+    parser = argparse.ArgumentParser(description='Replay the 01-08 scripts against the local Bedrock stub.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, e.g. 01,05,07')
+    parser.add_argument('--sessions', type=int, default=10, help='concurrent sessions per scenario')
+    parser.add_argument('--turns', type=int, default=5, help='turns per session')
+    parser.add_argument('--latency', default='lognormal:0.2:0.5',
+                        help="seconds before each stub reply: 0.2, uniform:0.1:0.5 or lognormal:median:sigma")
+    parser.add_argument('--tps', type=float, default=200.0, help='generated tokens per second, 0 for instant')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of calls throttled at random')
+    parser.add_argument('--max-concurrency', type=int, default=None, help='stub calls in flight before throttling')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = StubBedrockServer(latency=parse_latency(args.latency), tokens_per_second=args.tps or None,
+                               throttle_rate=args.throttle_rate, max_concurrency=args.max_concurrency,
+                               responder=scripted_responder(RESPONSES), knowledge_bases=KNOWLEDGE_BASES,
+                               seed=args.seed).start()
+    os.environ.update({
+        'AWS_ENDPOINT_URL_BEDROCK_RUNTIME': server.endpoint_url,
+        'AWS_ENDPOINT_URL_BEDROCK_AGENT_RUNTIME': server.endpoint_url,
+        'AWS_DEFAULT_REGION': 'us-east-1',
+    })
+    for variable in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'ACCESS_KEY_ID', 'SECRET_ACCESS_KEY', 'EXA_API_KEY'):
+        os.environ[variable] = 'stub'
+    sys.path.insert(0, HERE)
+    logging.disable(logging.INFO)  # the scripts log every classification and execution time
+    library_logger = logging.getLogger('multi_agent_orchestrator.utils.logger')
+    library_logger.propagate = False
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    print(f"{args.sessions} sessions x {args.turns} turns per scenario, latency={args.latency}, "
+          f"tokens/s={args.tps or 'instant'}, throttle_rate={args.throttle_rate}, seed={args.seed}")
+    results = []
+    executor = ThreadPoolExecutor(max_workers=args.sessions * 2)
+    try:
+        for name in args.scenarios.split(','):
+            name = name.strip()
+            calls, throttled = server.request_count, server.throttled_count
+            quiet = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(quiet), contextlib.redirect_stderr(quiet):
+                    module = load_script(SCENARIOS[name].script)
+                    if SCENARIOS[name].setup:
+                        SCENARIOS[name].setup(module)
+            except Exception as error:
+                result = ScenarioResult(name, skipped=f'{type(error).__name__}: {error}')
+            else:
+                error_log = _ErrorLog()
+                library_logger.addHandler(error_log)
+                with contextlib.redirect_stdout(quiet), contextlib.redirect_stderr(quiet):
+                    result = asyncio.run(run_scenario(name, module, args.sessions, args.turns, executor))
+                    shutdown = getattr(getattr(module, 'tracer', None), 'shutdown', None)
+                    if shutdown:
+                        shutdown()
+                result.stub_calls = server.request_count - calls
+                result.throttled = server.throttled_count - throttled
+                library_logger.removeHandler(error_log)
+                result.logged_errors = error_log.count
+                result.first_error = result.first_error or error_log.first
+            print(result.report())
+            results.append(result)
+    finally:
+        executor.shutdown()
+        server.stop()
+        os.chdir(cwd)
+        logging.disable(logging.NOTSET)
+        library_logger.propagate = True
+    return results
+
+
+if __name__ == "__main__":
+    main()
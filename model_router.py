@@ -0,0 +1,453 @@
+"""
+Multi-region / multi-model failover routing for the bedrock-runtime client.
+
+The scripts are pinned to one region and one inference profile, so a throttled
+or degraded region fails every call of the classifier and the agents. ModelRouter
+stands in for the bedrock-runtime client (pass it as `client=`; BedrockLLMAgent
+and BedrockClassifier only call converse / converse_stream on it) and spreads
+the calls over an ordered list of (region, model_id) targets:
+
+- every target keeps its recent latencies (time to the first event for
+  streams) and outcomes; each call goes to the target with the best
+  latency x (1 + error_penalty x error rate) score, the list order breaking
+  ties, so the first target is used as long as it is as healthy as the others;
+  a small share of calls (`explore_rate`) goes to another target to keep its
+  numbers fresh;
+- a throttled (or unreachable) target is skipped for `throttle_cooldown`
+  seconds, doubled while it keeps throttling, and the call fails over to the
+  next best target right away; once every target is cooling down the call
+  backs off (full jitter, up to `max_retries` times) and retries the target
+  that recovers first, where blocking the thread is safe (runner.may_block);
+- with `hedge` (opt-in), a call that has not answered (first event for
+  streams) within the `hedge_percentile` of the target's recent latency is
+  duplicated on the next best target, i.e. another region or just another
+  client; the first answer wins. The loser is cancelled: not started yet, it
+  never runs; a stream is closed as soon as it answers, which stops the
+  generation; a plain Converse result is dropped. Duplicates are paid for out
+  of a budget: every routed call earns `hedge_budget` of a hedge (0.05 = at
+  most 5% extra calls), up to `hedge_burst` saved, so a slow region cannot
+  double the spend.
+
+The modelId the agent passes is replaced by the target's model_id, so targets
+may use different models as well as regions.
+
+    model_router = ModelRouter([ModelTarget('us-west-2', MODELID), ModelTarget('us-east-1', MODELID)])
+    llm_config = dict(model_id=MODELID, client=model_router, ...)
+    ...
+    model_router.stats()  # per target: calls, error rate, p50/p95, cooldown, hedges, failovers
+    model_router.hedge_stats()  # hedged share of calls, wins, budget denials, cancelled losers
+
+Run `python model_router.py` to compare one pinned region with the router when
+that region has a heavy latency tail and throttles, and the p99 of
+BedrockClassifier calls with and without hedging, against stub endpoints.
+"""
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, ReadTimeoutError
+from multi_agent_orchestrator.utils import Logger
+
+from batch_runner import is_throttling_error
+from runner import get_client, may_block
+
+ROUTED_OPERATIONS = ('converse', 'converse_stream')
+
+
+@dataclass(eq=False)
+class ModelTarget:
+    region: str
+    model_id: str
+    client: Any = None  # bedrock-runtime client of the region, get_client() when None
+
+    @property
+    def name(self) -> str:
+        return f'{self.region}/{self.model_id}'
+
+
+@dataclass
+class ModelRouterOptions:
+    window: int = 100  # recent calls per target kept for latency percentiles and the error rate
+    min_samples: int = 10  # calls a target needs before its percentile is used as hedge deadline
+    error_penalty: float = 4.0  # score = latency x (1 + error_penalty x error rate)
+    throttle_cooldown: float = 10.0  # seconds a throttled target is skipped, doubled while it keeps throttling
+    max_cooldown: float = 120.0
+    explore_rate: float = 0.02  # share of calls sent to another available target to refresh its numbers
+    hedge: bool = False  # duplicate calls slower than hedge_percentile on the next best target
+    hedge_percentile: float = 95.0
+    hedge_budget: float = 0.05  # hedges earned per routed call, i.e. the cap on extra calls
+    hedge_burst: float = 5.0  # hedges that can be saved up and spent at once
+    max_workers: int = 32  # threads running hedged calls
+    max_retries: int = 4  # backoff retries once every target is cooling down (or rejected the call locally)
+    base_backoff: float = 0.5  # seconds, doubled per retry with full jitter
+    max_backoff: float = 8.0
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """Errors another region may not have: throttling, unavailable model, connection problems."""
+    return is_throttling_error(error) or isinstance(error, (BotocoreConnectionError, ReadTimeoutError))
+
+
+# key set in the 'Error' of throttling errors raised in this process (RequestGovernor's queue), not by a region
+LOCAL_REJECTION = 'LocalRejection'
+
+
+def is_local_rejection(error: BaseException) -> bool:
+    response = getattr(error, 'response', None)
+    return isinstance(response, dict) and bool(response.get('Error', {}).get(LOCAL_REJECTION))
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+
+@dataclass
+class _TargetHealth:
+    latencies: Dict[str, Deque[float]]  # operation -> recent seconds (to the first event for streams)
+    outcomes: Deque[bool]  # recent calls, True = failed
+    cooldown_until: float = 0.0
+    cooldown: float = 0.0
+    counts: Dict[str, int] = field(default_factory=lambda: {
+        'calls': 0, 'errors': 0, 'throttled': 0, 'rejected': 0, 'failovers': 0, 'retries': 0, 'hedges': 0,
+        'hedge_wins': 0})
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class _PrefetchedStream:
+    """The event stream of a ConverseStream response whose first event was already read."""
+
+    def __init__(self, first: Any, events: Iterator[Any], stream: Any):
+        self._first = first
+        self._events = events
+        self._stream = stream
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._first is not None:
+            yield self._first
+        yield from self._events
+
+    def close(self) -> None:
+        close = getattr(self._stream, 'close', None)
+        if close is not None:
+            close()
+
+
+class ModelRouter:
+    def __init__(self, targets: List[ModelTarget], options: Optional[ModelRouterOptions] = None):
+        if not targets:
+            raise ValueError("ModelRouter requires at least one target.")
+        self.options = options or ModelRouterOptions()
+        self.targets = targets
+        for target in targets:
+            if target.client is None:
+                target.client = get_client('bedrock-runtime', region_name=target.region)
+        self._health = {id(target): _TargetHealth({operation: deque(maxlen=self.options.window)
+                                                   for operation in ROUTED_OPERATIONS},
+                                                  deque(maxlen=self.options.window)) for target in targets}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.options.max_workers, thread_name_prefix='model-router')
+        self._hedge_credits = self.options.hedge_burst
+        self.hedge_counts = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_denied': 0, 'losers_cancelled': 0}
+
+    def converse(self, **params: Any) -> Dict[str, Any]:
+        return self._route('converse', params)
+
+    def converse_stream(self, **params: Any) -> Dict[str, Any]:
+        return self._route('converse_stream', params)
+
+    def _score(self, target: ModelTarget, operation: str) -> Optional[float]:
+        health = self._health[id(target)]
+        latencies = health.latencies[operation]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies) * (1 + self.options.error_penalty * health.error_rate())
+
+    def pick(self, operation: str, exclude: List[ModelTarget]) -> Optional[ModelTarget]:
+        """Healthiest target not in exclude; None when every other target is cooling down."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [target for target in self.targets if target not in exclude
+                          and self._health[id(target)].cooldown_until <= now]
+            if not candidates and not exclude:
+                # everything is cooling down: the one that recovers first is the best bet
+                return min(self.targets, key=lambda target: self._health[id(target)].cooldown_until)
+            if not candidates:
+                return None
+            scores = {id(target): self._score(target, operation) for target in candidates}
+            known = [score for score in scores.values() if score is not None]
+            default = min(known) if known else 0.0
+            ranked = sorted(candidates, key=lambda target: (
+                default if scores[id(target)] is None else scores[id(target)], self.targets.index(target)))
+            if len(ranked) > 1 and random.random() < self.options.explore_rate:
+                return random.choice(ranked[1:])
+            return ranked[0]
+
+    def _record(self, target: ModelTarget, operation: str, seconds: Optional[float],
+                error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            health = self._health[id(target)]
+            if error is not None and is_local_rejection(error):
+                # our own limiter was full: says nothing about the region's health
+                health.counts['rejected'] += 1
+                return
+            health.counts['calls'] += 1
+            health.outcomes.append(error is not None)
+            if error is None:
+                health.latencies[operation].append(seconds)
+                health.cooldown = 0.0
+                return
+            health.counts['errors'] += 1
+            if is_failover_error(error):
+                health.counts['throttled'] += 1
+                health.cooldown = min(self.options.max_cooldown,
+                                      health.cooldown * 2 if health.cooldown else self.options.throttle_cooldown)
+                health.cooldown_until = time.monotonic() + health.cooldown
+
+    def _count(self, target: ModelTarget, name: str) -> None:
+        with self._lock:
+            self._health[id(target)].counts[name] += 1
+
+    def _attempt(self, target: ModelTarget, operation: str, params: Dict[str, Any],
+                 cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """One call to one target; a stream counts as answered once its first event is in."""
+        start = time.perf_counter()
+        try:
+            response = getattr(target.client, operation)(**{**params, 'modelId': target.model_id})
+            if operation == 'converse_stream':
+                stream = response['stream']
+                if cancelled is not None and cancelled.is_set():
+                    # lost the race before the first token: stop generating, and don't
+                    # read the closed stream (that error is ours, not the target's)
+                    stream.close()
+                    response['stream'] = _PrefetchedStream(None, iter(()), stream)
+                    return response
+                events = iter(stream)
+                response['stream'] = _PrefetchedStream(next(events, None), events, stream)
+        except Exception as error:
+            self._record(target, operation, None, error)
+            raise
+        self._record(target, operation, time.perf_counter() - start)
+        return response
+
+    def _hedge_deadline(self, target: ModelTarget, operation: str) -> Optional[float]:
+        with self._lock:
+            latencies = list(self._health[id(target)].latencies[operation])
+        if not self.options.hedge or len(latencies) < self.options.min_samples:
+            return None
+        return percentile(latencies, self.options.hedge_percentile)
+
+    def _spend_hedge(self) -> bool:
+        with self._lock:
+            if self._hedge_credits < 1:
+                self.hedge_counts['budget_denied'] += 1
+                return False
+            self._hedge_credits -= 1
+            self.hedge_counts['hedged'] += 1
+            return True
+
+    def _route(self, operation: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.hedge_counts['calls'] += 1
+            self._hedge_credits = min(self.options.hedge_burst, self._hedge_credits + self.options.hedge_budget)
+        tried: List[ModelTarget] = []
+        last_error: Optional[BaseException] = None
+        retries = 0
+        while True:
+            target = self.pick(operation, tried)
+            if target is None:
+                # every target failed or is cooling down: back off, then start over from the best
+                # target, i.e. the one that recovers first if they are all still cooling down
+                if retries >= self.options.max_retries or not may_block():
+                    raise last_error
+                delay = random.uniform(0, min(self.options.max_backoff, self.options.base_backoff * 2 ** retries))
+                retries += 1
+                Logger.info(f"{operation}: every target is cooling down, retry {retries} in {delay:.2f}s: "
+                            f"{last_error}")
+                time.sleep(delay)
+                tried = []
+                target = self.pick(operation, tried)
+                self._count(target, 'retries')
+            elif tried:
+                self._count(tried[-1], 'failovers')
+                Logger.info(f"{operation} failing over from {tried[-1].name} to {target.name}: {last_error}")
+            tried.append(target)
+            try:
+                deadline = self._hedge_deadline(target, operation)
+                if deadline is None:
+                    return self._attempt(target, operation, params)
+                return self._hedged(target, operation, params, deadline, tried)
+            except Exception as error:
+                if not is_failover_error(error):
+                    raise
+                last_error = error
+
+    def _submit(self, target: ModelTarget, operation: str, params: Dict[str, Any],
+                cancelled: threading.Event) -> Future:
+        return self._executor.submit(contextvars.copy_context().run, self._attempt, target, operation, params,
+                                     cancelled)
+
+    def _hedged(self, primary: ModelTarget, operation: str, params: Dict[str, Any], deadline: float,
+                tried: List[ModelTarget]) -> Dict[str, Any]:
+        """Run on primary; past the deadline also on the next best target and take the first answer."""
+        cancelled = {primary: threading.Event()}
+        futures = {self._submit(primary, operation, params, cancelled[primary]): primary}
+        done, _ = wait(futures, timeout=deadline)
+        if not done:
+            backup = self.pick(operation, tried)
+            if backup is not None and self._spend_hedge():
+                tried.append(backup)
+                self._count(primary, 'hedges')
+                cancelled[backup] = threading.Event()
+                futures[self._submit(backup, operation, params, cancelled[backup])] = backup
+        pending = set(futures)
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                if futures[future] is not primary:
+                    self._count(futures[future], 'hedge_wins')
+                    with self._lock:
+                        self.hedge_counts['hedge_wins'] += 1
+                for loser in pending:
+                    cancelled[futures[loser]].set()
+                    with self._lock:
+                        self.hedge_counts['losers_cancelled'] += 1
+                    if not loser.cancel():
+                        loser.add_done_callback(_close_response)
+                return future.result()
+        raise first_error
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for target in self.targets:
+                health = self._health[id(target)]
+                latencies = [value for values in health.latencies.values() for value in values]
+                result[target.name] = {**health.counts, 'error_rate': round(health.error_rate(), 3),
+                                       'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                                       'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+                                       'cooling_down_s': round(max(0.0, health.cooldown_until - now), 1)}
+            return result
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.hedge_counts['calls']
+            return {**self.hedge_counts, 'hedge_rate': round(self.hedge_counts['hedged'] / calls, 3) if calls else 0.0,
+                    'credits': round(self._hedge_credits, 2)}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def _close_response(future: Future) -> None:
+    """Release the connection of a hedged call that lost the race."""
+    if not future.cancelled() and future.exception() is None:
+        stream = future.result().get('stream')
+        if stream is not None:
+            stream.close()
+
+
+if __name__ == "__main__":
+    from stub_bedrock import StubBedrockServer, lognormal_latency
+
+    CALLS = 400
+    CALLERS = 8
+    MODELID = 'us.amazon.nova-pro-v1:0'
+
+    def run(client):
+        latencies, errors = [], 0
+
+        def one(i):
+            nonlocal errors
+            t1 = time.perf_counter()
+            try:
+                response = client.converse_stream(
+                    modelId=MODELID, messages=[{'role': 'user', 'content': [{'text': f'question {i}'}]}])
+                for _ in response['stream']:
+                    pass
+                latencies.append(time.perf_counter() - t1)
+            except ClientError:
+                errors += 1
+        with ThreadPoolExecutor(CALLERS) as pool:
+            list(pool.map(one, range(CALLS)))
+        return latencies, errors
+
+    print(f"{CALLS} ConverseStream calls from {CALLERS} threads; us-west-2 stub: lognormal latency "
+          f"(median 60ms, sigma 0.9), 2% throttled; us-east-1 stub: lognormal (median 100ms, sigma 0.3)")
+    for name, options in [('pinned to us-west-2', None),
+                          ('router, failover only', ModelRouterOptions(hedge=False, throttle_cooldown=1.0)),
+                          ('router, failover + p95 hedging', ModelRouterOptions(hedge=True, throttle_cooldown=1.0))]:
+        with StubBedrockServer(latency=lognormal_latency(0.06, 0.9), throttle_rate=0.02, seed=1) as west, \
+                StubBedrockServer(latency=lognormal_latency(0.1, 0.3), seed=2) as east:
+            west_client = west.client(region_name='us-west-2')
+            if options is None:
+                latencies, errors = run(west_client)
+                router = None
+            else:
+                router = ModelRouter([ModelTarget('us-west-2', MODELID, west_client),
+                                      ModelTarget('us-east-1', MODELID, east.client(region_name='us-east-1'))],
+                                     options)
+                latencies, errors = run(router)
+                router.close()
+            print(f"{name:<32} p50 {percentile(latencies, 50) * 1000:6.1f}ms  "
+                  f"p95 {percentile(latencies, 95) * 1000:6.1f}ms  p99 {percentile(latencies, 99) * 1000:6.1f}ms  "
+                  f"errors={errors}  calls west={west.request_count} east={east.request_count}")
+            if router is not None:
+                for target, stats in router.stats().items():
+                    print(f"{'':<32} {target}: {stats}")
+
+    # the short-query path: BedrockClassifier calls with a heavy tail, hedged on a second client
+    import asyncio
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
+
+    CLASSIFICATIONS = 300
+    questions = ["What is the best GPU for training AI models?", "How much sleep does an adult need?"]
+
+    async def classify_all(classifier):
+        latencies = []
+        for i in range(CLASSIFICATIONS):
+            t1 = time.perf_counter()
+            await classifier.classify(questions[i % 2], [])
+            latencies.append(time.perf_counter() - t1)
+        return latencies
+
+    print(f"\n{CLASSIFICATIONS} BedrockClassifier calls; both stubs: lognormal latency (median 50ms, sigma 0.8)")
+    baseline_p99 = None
+    for name, options in [('single client', None),
+                          ('hedged at p95, 5% budget', ModelRouterOptions(hedge=True, hedge_percentile=95)),
+                          ('hedged at p90, 10% budget', ModelRouterOptions(hedge=True, hedge_percentile=90,
+                                                                          hedge_budget=0.1))]:
+        with StubBedrockServer(latency=lognormal_latency(0.05, 0.8), seed=3) as first, \
+                StubBedrockServer(latency=lognormal_latency(0.05, 0.8), seed=4) as second:
+            router = None if options is None else ModelRouter(
+                [ModelTarget('us-east-1', MODELID, first.client()),
+                 ModelTarget('us-west-2', MODELID, second.client(region_name='us-west-2'))], options)
+            classifier = BedrockClassifier(BedrockClassifierOptions(model_id=MODELID, client=router or first.client()))
+            classifier.set_agents({agent.id: agent for agent in [
+                BedrockLLMAgent(BedrockLLMAgentOptions(name='Tech Agent', description='Technology, AI, hardware',
+                                                       model_id=MODELID, client=first.client())),
+                BedrockLLMAgent(BedrockLLMAgentOptions(name='Health Agent', description='Health, sleep, nutrition',
+                                                       model_id=MODELID, client=first.client()))]})
+            latencies = asyncio.run(classify_all(classifier))
+            p99 = percentile(latencies, 99)
+            baseline_p99 = baseline_p99 or p99
+            extra = (first.request_count + second.request_count) / CLASSIFICATIONS - 1
+            print(f"{name:<32} p50 {percentile(latencies, 50) * 1000:6.1f}ms  "
+                  f"p95 {percentile(latencies, 95) * 1000:6.1f}ms  p99 {p99 * 1000:6.1f}ms "
+                  f"({(1 - p99 / baseline_p99) * 100:+5.1f}% better)  extra calls {extra * 100:4.1f}%")
+            if router is not None:
+                print(f"{'':<32} {router.hedge_stats()}")
+                router.close()
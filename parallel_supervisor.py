@@ -0,0 +1,197 @@
+"""
+SupervisorAgent with bounded, async-native fan-out to team members.
+
+The stock SupervisorAgent.send_messages runs every team call through
+asyncio.to_thread + asyncio.run, touches the shared chat storage from those
+throwaway loops, and keeps the current user/session on the instance (so two
+concurrent sessions can overwrite each other). ParallelSupervisorAgent keeps the
+storage work on the caller's loop, runs the blocking model calls of independent
+team members concurrently via asyncio.gather, caps them with a semaphore, and
+keeps the request context per task.
+
+Run `python parallel_supervisor.py` for a wall-clock comparison on the TSLA
+research task from 07.stock_research.py against the stub model.
+"""
+import asyncio
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Optional, Union
+
+from multi_agent_orchestrator.agents import Agent, SupervisorAgent, SupervisorAgentOptions
+from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole, TimestampedMessage
+from multi_agent_orchestrator.utils import Logger
+
+from runner import run_in_thread
+
+# (user_id, session_id, additional_params) of the request being processed by this task
+_request_context: contextvars.ContextVar = contextvars.ContextVar('supervisor_request_context', default=None)
+
+
+@dataclass
+class ParallelSupervisorAgentOptions(SupervisorAgentOptions):
+    max_concurrency: int = 4  # max team members running at the same time, 1 = sequential
+
+
+class ParallelSupervisorAgent(SupervisorAgent):
+    def __init__(self, options: ParallelSupervisorAgentOptions):
+        if options.max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        super().__init__(options)
+        self.max_concurrency = options.max_concurrency
+        self._semaphores: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]' = \
+            weakref.WeakKeyDictionary()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix=f"{self.id}-team")
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # one semaphore per event loop, scripts may drive the agent from several loops
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def send_message_async(self, agent: Agent, content: str, user_id: str, session_id: str,
+                                 additional_params: Optional[dict[str, Any]]) -> str:
+        """Send a message to one team member and record the exchange in the team storage."""
+        async with self._get_semaphore():
+            if self.trace:
+                Logger.info(f"\033[32m\n===>>>>> Supervisor sending {agent.name}: {content}\033[0m")
+
+            agent_chat_history = (
+                await self.storage.fetch_chat(user_id, session_id, agent.id)
+                if agent.save_chat else []
+            )
+            user_message = TimestampedMessage(role=ParticipantRole.USER.value, content=[{'text': content}])
+            response = await run_in_thread(
+                agent.process_request(content, user_id, session_id, agent_chat_history, additional_params),
+                self._executor)
+            response_text = response.content[0].get('text', '') if response.content else ''
+            assistant_message = TimestampedMessage(role=ParticipantRole.ASSISTANT.value,
+                                                   content=[{'text': response_text}])
+            if agent.save_chat:
+                await self.storage.save_chat_messages(user_id, session_id, agent.id,
+                                                      [user_message, assistant_message])
+
+            if self.trace:
+                Logger.info(
+                    f"\033[33m\n<<<<<===Supervisor received from {agent.name}:\n{response_text[:500]}...\033[0m"
+                )
+            return f"{agent.name}: {response_text}"
+
+    async def send_messages(self, messages: list[dict[str, str]]) -> str:
+        """Fan the messages out to their recipients concurrently and merge the replies in order."""
+        user_id, session_id, additional_params = _request_context.get() or (
+            self.user_id, self.session_id, self.additional_params)
+        team = {agent.name: agent for agent in self.team}
+        calls = [
+            self.send_message_async(team[message.get('recipient')], message.get('content'),
+                                    user_id, session_id, additional_params)
+            for message in messages
+            if message.get('recipient') in team
+        ]
+        if not calls:
+            return ''
+        try:
+            responses = await asyncio.gather(*calls)
+        except Exception as e:
+            Logger.error(f"Error in send_messages: {e}")
+            raise e
+        return '\n\n'.join(responses)
+
+    async def process_request(
+        self,
+        input_text: str,
+        user_id: str,
+        session_id: str,
+        chat_history: list[ConversationMessage],
+        additional_params: Optional[dict[str, str]] = None
+    ) -> Union[ConversationMessage, AsyncIterable[Any]]:
+        token = _request_context.set((user_id, session_id, additional_params))
+        try:
+            return await super().process_request(input_text, user_id, session_id, chat_history,
+                                                 additional_params)
+        finally:
+            _request_context.reset(token)
+
+
+if __name__ == "__main__":
+    import json
+    import time
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from multi_agent_orchestrator.utils import AgentTool, AgentTools
+    from stub_bedrock import StubBedrockServer
+
+    MODEL_LATENCY = 0.3
+    MODELID = 'us.amazon.nova-pro-v1:0'
+    TASK = "Conduct market research for TSLA stock"
+
+    def count_tool_results(body):
+        return sum(1 for message in body['messages'] for block in message['content'] if 'toolResult' in block)
+
+    def make_responder(plan):
+        """Scripted planner: hand off to each group of analysts in plan, then answer."""
+        def responder(model_id, body):
+            tools = [tool['toolSpec']['name'] for tool in body.get('toolConfig', {}).get('tools', [])]
+            step = count_tool_results(body)
+            if 'send_messages' in tools:
+                if step < len(plan):
+                    return [{'toolUse': {
+                        'toolUseId': f'tooluse_plan_{step}',
+                        'name': 'send_messages',
+                        'input': {'messages': [{'recipient': name, 'content': f"{TASK}: your part"}
+                                               for name in plan[step]]},
+                    }}]
+                return [{'text': 'TSLA research report ... TERMINATE'}]
+            if tools and step == 0:
+                spec = body['toolConfig']['tools'][0]['toolSpec']
+                argument = next(iter(spec['inputSchema']['json']['properties']))
+                return [{'toolUse': {'toolUseId': 'tooluse_data', 'name': spec['name'], 'input': {argument: 'TSLA'}}}]
+            return [{'text': 'analysis done, handing back to planner'}]
+        return responder
+
+    def build_planner(client, **options):
+        llm_config = dict(model_id=MODELID, client=client, streaming=False)
+        stock_tool = AgentTool(name='get_stock_data', func=lambda symbol: json.dumps({'price': 180.25}),
+                               description='Get stock market data',
+                               properties={'symbol': {'type': 'string', 'description': 'ticker'}})
+        news_tool = AgentTool(name='get_news', func=lambda query: json.dumps([{'title': 'Tesla news'}]),
+                              description='Get recent news',
+                              properties={'query': {'type': 'string', 'description': 'query'}})
+        return ParallelSupervisorAgent(ParallelSupervisorAgentOptions(
+            name="SupervisorAgent",
+            description="research supervisor",
+            lead_agent=BedrockLLMAgent(BedrockLLMAgentOptions(
+                name="planner-manager", description="a research planning coordinator.", **llm_config)),
+            team=[
+                BedrockLLMAgent(BedrockLLMAgentOptions(
+                    name="financial_analyst", description="For stock data analysis", **llm_config,
+                    tool_config={'tool': AgentTools([stock_tool]), 'toolMaxRecursions': 5})),
+                BedrockLLMAgent(BedrockLLMAgentOptions(
+                    name="news_analyst", description="a news analyst.", **llm_config,
+                    tool_config={'tool': AgentTools([news_tool]), 'toolMaxRecursions': 5})),
+                BedrockLLMAgent(BedrockLLMAgentOptions(
+                    name="writer", description="financial report writer.", **llm_config)),
+            ],
+            **options,
+        ))
+
+    single_handoffs = [['financial_analyst'], ['news_analyst'], ['writer']]
+    fan_out = [['financial_analyst', 'news_analyst'], ['writer']]
+    scenarios = [
+        ("one agent at a time (07 prompt)", single_handoffs, {'max_concurrency': 1}),
+        ("fan-out, max_concurrency=1", fan_out, {'max_concurrency': 1}),
+        ("fan-out, max_concurrency=3", fan_out, {'max_concurrency': 3}),
+    ]
+
+    print(f"TSLA research, stub model latency {MODEL_LATENCY * 1000:.0f}ms per call")
+    for name, plan, options in scenarios:
+        with StubBedrockServer(latency=MODEL_LATENCY, responder=make_responder(plan)) as server:
+            planner = build_planner(server.client(), **options)
+            t1 = time.perf_counter()
+            response = asyncio.run(planner.process_request(TASK, 'user1', 'session1', []))
+            elapsed = time.perf_counter() - t1
+            print(f"{name:<34} {elapsed:6.2f}s  model calls={server.request_count}  "
+                  f"-> {response.content[0]['text'][:40]}")
@@ -0,0 +1,334 @@
+"""
+CPU-only pre-classifier that answers obvious routing decisions locally.
+
+PreClassifier sits in front of an LLM classifier. It keeps a nearest-centroid
+TF-IDF model over hashed n-grams, trained on the agent descriptions plus past
+routing decisions, and only calls the wrapped classifier when it is not sure.
+Every decision the LLM makes is appended to the routing log and folded back
+into the model, so coverage grows as the log fills up. The model is refit in
+batches of `refit_every` new decisions and keeps the latest `max_examples` per
+agent, so a refit stays cheap on the event loop. The log is rotated at
+`max_log_bytes` and stores hashed n-gram features, not the user's text,
+unless `log_inputs` is set.
+
+    classifier = PreClassifier(PreClassifierOptions(
+        classifier=BedrockClassifier(BedrockClassifierOptions(model_id=MODELID)),
+        routing_log='routing_log.jsonl',
+    ))
+
+Offline evaluation on a replayed query log:
+
+    python pre_classifier.py --agents agents.json --log routing_log.jsonl
+"""
+import json
+import math
+import os
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from multi_agent_orchestrator.agents import Agent
+from multi_agent_orchestrator.classifiers import Classifier, ClassifierResult
+from multi_agent_orchestrator.types import ConversationMessage
+from multi_agent_orchestrator.utils import Logger
+
+from classifier_cache import served_from_cache
+from text_utils import SparseVector, cosine, hashed_counts, l2_normalize, strip_stopwords, tokenize
+
+
+class NgramRouter:
+    """Nearest-centroid router over hashed n-gram TF-IDF vectors.
+
+    New examples are folded in once `refit_every` of them are pending (a
+    description change refits at the next prediction); only the latest
+    `max_examples` per agent are kept.
+    """
+
+    def __init__(self, description_weight: float = 2.0, refit_every: int = 50, max_examples: int = 500):
+        self.description_weight = description_weight
+        self.refit_every = refit_every
+        self.examples: Dict[str, Deque[SparseVector]] = defaultdict(lambda: deque(maxlen=max_examples))
+        self.descriptions: Dict[str, str] = {}
+        self.idf: Dict[int, float] = {}
+        self.centroids: Dict[str, SparseVector] = {}
+        self._dirty = True
+        self._pending = 0
+
+    def set_descriptions(self, descriptions: Dict[str, str]) -> None:
+        self.descriptions = dict(descriptions)
+        self._dirty = True
+
+    def add_example(self, agent_id: str, text: str) -> None:
+        self.add_counts(agent_id, self.features(text))
+
+    def add_counts(self, agent_id: str, counts: SparseVector) -> None:
+        self.examples[agent_id].append(counts)
+        self._pending += 1
+
+    @staticmethod
+    def features(text: str) -> SparseVector:
+        return hashed_counts(strip_stopwords(text))
+
+    def _vectorize(self, counts: SparseVector) -> SparseVector:
+        return l2_normalize({k: (1.0 + math.log(v)) * self.idf.get(k, self._max_idf)
+                             for k, v in counts.items()})
+
+    def fit(self) -> None:
+        documents: List[Tuple[str, SparseVector, float]] = []
+        for agent_id, description in self.descriptions.items():
+            documents.append((agent_id, self.features(description), self.description_weight))
+            for counts in self.examples.get(agent_id, ()):
+                documents.append((agent_id, counts, 1.0))
+
+        document_frequency: Dict[int, int] = defaultdict(int)
+        for _, counts, _ in documents:
+            for index in counts:
+                document_frequency[index] += 1
+        total = len(documents) or 1
+        self.idf = {k: math.log((1 + total) / (1 + df)) + 1.0 for k, df in document_frequency.items()}
+        self._max_idf = math.log(1 + total) + 1.0
+
+        sums: Dict[str, SparseVector] = defaultdict(dict)
+        for agent_id, counts, weight in documents:
+            centroid = sums[agent_id]
+            for k, v in self._vectorize(counts).items():
+                centroid[k] = centroid.get(k, 0.0) + v * weight
+        self.centroids = {agent_id: l2_normalize(vector) for agent_id, vector in sums.items()}
+        self._dirty = False
+        self._pending = 0
+
+    def predict(self, text: str) -> Tuple[Optional[str], float, float]:
+        """Return (agent_id, similarity, confidence).
+
+        confidence is the relative margin between the best and the runner-up
+        centroid similarity: 1.0 when only one agent matches at all, 0.0 on a tie.
+        """
+        return self.predict_counts(self.features(text))
+
+    def predict_counts(self, counts: SparseVector) -> Tuple[Optional[str], float, float]:
+        if self._dirty or self._pending >= self.refit_every:
+            self.fit()
+        if not self.centroids:
+            return None, 0.0, 0.0
+        query = self._vectorize(counts)
+        scores = sorted(((cosine(query, centroid), agent_id) for agent_id, centroid in self.centroids.items()),
+                        reverse=True)
+        best_score, best_agent = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        if best_score <= 0:
+            return None, 0.0, 0.0
+        return best_agent, best_score, (best_score - runner_up) / best_score
+
+
+def read_routing_log(path: str) -> Iterable[dict]:
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def record_features(record: dict) -> SparseVector:
+    """Router features of a routing log record: the stored hashed features, or those of its input."""
+    if 'features' in record:
+        return {int(index): count for index, count in record['features'].items()}
+    return NgramRouter.features(record['input'])
+
+
+@dataclass
+class PreClassifierOptions:
+    classifier: Classifier  # LLM classifier used when the local model is unsure
+    threshold: float = 0.5  # min relative margin to answer locally
+    min_similarity: float = 0.15  # min similarity between the input and the winning agent
+    min_followup_tokens: int = 3  # shorter inputs with history are treated as follow-ups and go to the LLM
+    routing_log: Optional[str] = None  # JSONL of {"agent_id", "latency_ms", "features"} (+ "input")
+    max_log_bytes: int = 10 * 1024 * 1024  # rotate the routing log to <routing_log>.1 past this size
+    log_inputs: bool = False  # also store the raw input text in the routing log
+    learn: bool = True  # fold LLM decisions back into the local model
+    refit_every: int = 50  # refit the local model once this many new decisions are pending
+    max_examples: int = 500  # latest decisions kept per agent
+
+
+class PreClassifier(Classifier):
+    def __init__(self, options: PreClassifierOptions):
+        super().__init__()
+        self.classifier = options.classifier
+        self.threshold = options.threshold
+        self.min_similarity = options.min_similarity
+        self.min_followup_tokens = options.min_followup_tokens
+        self.routing_log = options.routing_log
+        self.max_log_bytes = options.max_log_bytes
+        self.log_inputs = options.log_inputs
+        self.learn = options.learn
+        self.router = NgramRouter(refit_every=options.refit_every, max_examples=options.max_examples)
+        self.local_hits = 0
+        self.fallbacks = 0
+
+        if self.routing_log:
+            for path in (f'{self.routing_log}.1', self.routing_log):
+                if os.path.exists(path):
+                    for record in read_routing_log(path):
+                        self.router.add_counts(record['agent_id'], record_features(record))
+
+    def set_agents(self, agents: Dict[str, Agent]) -> None:
+        super().set_agents(agents)
+        self.classifier.set_agents(agents)
+        self.router.set_descriptions({agent_id: agent.description for agent_id, agent in agents.items()})
+
+    def stats(self) -> Dict[str, float]:
+        total = self.local_hits + self.fallbacks
+        return {
+            'local_hits': self.local_hits,
+            'fallbacks': self.fallbacks,
+            'local_rate': self.local_hits / total if total else 0.0,
+        }
+
+    def predict(self, input_text: str, chat_history: List[ConversationMessage]) -> Optional[ClassifierResult]:
+        """Local decision, or None when the input should go to the LLM."""
+        if chat_history and len(tokenize(input_text)) < self.min_followup_tokens:
+            return None
+        agent_id, similarity, confidence = self.router.predict(input_text)
+        if agent_id not in self.agents or similarity < self.min_similarity or confidence < self.threshold:
+            return None
+        return ClassifierResult(selected_agent=self.agents[agent_id], confidence=confidence)
+
+    def _record(self, input_text: str, agent_id: str, latency_ms: float) -> None:
+        counts = self.router.features(input_text)
+        if self.learn:
+            self.router.add_counts(agent_id, counts)
+        if self.routing_log:
+            record = {'agent_id': agent_id, 'latency_ms': round(latency_ms, 1),
+                      'features': {str(index): count for index, count in counts.items()}}
+            if self.log_inputs:
+                record['input'] = input_text
+            if os.path.exists(self.routing_log) and os.path.getsize(self.routing_log) >= self.max_log_bytes:
+                os.replace(self.routing_log, f'{self.routing_log}.1')
+            with open(self.routing_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    async def classify(self,
+                       input_text: str,
+                       chat_history: List[ConversationMessage]) -> ClassifierResult:
+        result = self.predict(input_text, chat_history)
+        if result is not None:
+            self.local_hits += 1
+            return result
+
+        self.fallbacks += 1
+        start = time.perf_counter()
+        token = served_from_cache.set(False)
+        try:
+            result = await self.classifier.classify(input_text, chat_history)
+            cached = served_from_cache.get()
+        finally:
+            served_from_cache.reset(token)
+        # only LLM round-trips are training labels and latency samples, not a wrapped cache's hits
+        if result.selected_agent and not cached:
+            self._record(input_text, result.selected_agent.id, (time.perf_counter() - start) * 1000)
+        return result
+
+    async def process_request(self,
+                              input_text: str,
+                              chat_history: List[ConversationMessage]) -> ClassifierResult:
+        return await self.classify(input_text, chat_history)
+
+
+def evaluate(descriptions: Dict[str, str],
+             records: List[dict],
+             threshold: float = 0.5,
+             min_similarity: float = 0.15,
+             train_fraction: float = 0.5,
+             default_llm_latency_ms: float = 800.0) -> Dict[str, float]:
+    """Replay a routing log: train on the first part, score the local model on the rest.
+
+    Records may carry "features" instead of "input" (see PreClassifierOptions.log_inputs).
+    The logged agent_id (the LLM's decision) is the label. Inputs the local model
+    would defer are counted as LLM calls; latency saved is the logged LLM latency
+    of every input answered locally, minus the local prediction time.
+    """
+    split = int(len(records) * train_fraction)
+    router = NgramRouter()
+    router.set_descriptions(descriptions)
+    for record in records[:split]:
+        router.add_counts(record['agent_id'], record_features(record))
+    router.fit()
+
+    test = records[split:]
+    answered = correct = 0
+    local_ms = saved_ms = 0.0
+    for record in test:
+        start = time.perf_counter()
+        agent_id, similarity, confidence = router.predict_counts(record_features(record))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        local_ms += elapsed_ms
+        if agent_id is None or similarity < min_similarity or confidence < threshold:
+            continue
+        answered += 1
+        correct += agent_id == record['agent_id']
+        saved_ms += record.get('latency_ms', default_llm_latency_ms) - elapsed_ms
+
+    return {
+        'train': split,
+        'test': len(test),
+        'coverage': answered / len(test) if test else 0.0,
+        'local_accuracy': correct / answered if answered else 0.0,
+        'avg_local_ms': local_ms / len(test) if test else 0.0,
+        'latency_saved_ms': saved_ms,
+        'latency_saved_per_query_ms': saved_ms / len(test) if test else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Evaluate the local pre-classifier on a replayed routing log.')
+    parser.add_argument('--agents', help='JSON file of {agent_id: description}')
+    parser.add_argument('--log', help='routing log JSONL of {"agent_id", "latency_ms", "features" or "input"}')
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--min-similarity', type=float, default=0.15)
+    parser.add_argument('--train-fraction', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.agents and args.log:
+        with open(args.agents, encoding='utf-8') as f:
+            agent_descriptions = json.load(f)
+        log_records = list(read_routing_log(args.log))
+    else:
+        Logger.info("No --agents/--log given, replaying the built-in sample from 01/05")
+        agent_descriptions = {
+            'tech-agent': "Specializes in technology areas including software development, hardware, AI, "
+                          "cybersecurity, blockchain, cloud computing, emerging tech innovations, and "
+                          "pricing/costs related to technology products and services.",
+            'health-agent': "Focuses on health and medical topics such as general wellness, nutrition, diseases, "
+                            "treatments, mental health, fitness, healthcare systems, and medical terminology or concepts.",
+            'weather-agent': "Provide weather report",
+        }
+        sample = [
+            ("How do I deploy a Python app to the cloud?", 'tech-agent'),
+            ("What are the symptoms of the flu?", 'health-agent'),
+            ("Is it going to rain in Seattle tomorrow?", 'weather-agent'),
+            ("Which laptop is best for software development?", 'tech-agent'),
+            ("How much protein should I eat per day?", 'health-agent'),
+            ("What's the weather like in Beijing?", 'weather-agent'),
+            ("How does blockchain consensus work?", 'tech-agent'),
+            ("What is a healthy amount of sleep for adults?", 'health-agent'),
+            ("Give me the weather report for Tokyo in fahrenheit", 'weather-agent'),
+            ("How much does an AWS GPU instance cost?", 'tech-agent'),
+            ("What treatments exist for migraine?", 'health-agent'),
+            ("Will it be sunny in Shanghai this weekend?", 'weather-agent'),
+            ("What is the best way to secure my home network against hackers?", 'tech-agent'),
+            ("How can I improve my mental health at work?", 'health-agent'),
+            ("Weather forecast for London please", 'weather-agent'),
+            ("Explain how large language models are trained", 'tech-agent'),
+            ("What foods are good for nutrition and heart disease prevention?", 'health-agent'),
+            ("How hot will it be in Singapore today?", 'weather-agent'),
+        ]
+        log_records = [{'input': text, 'agent_id': agent_id, 'latency_ms': 800.0} for text, agent_id in sample]
+
+    report = evaluate(agent_descriptions, log_records,
+                      threshold=args.threshold,
+                      min_similarity=args.min_similarity,
+                      train_fraction=args.train_fraction)
+    for name, value in report.items():
+        print(f"{name:<28} {value:.3f}" if isinstance(value, float) else f"{name:<28} {value}")
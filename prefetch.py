@@ -0,0 +1,225 @@
+"""
+Knowledge base prefetch that overlaps retrieval with intent classification.
+
+A BedrockLLMAgent with a retriever only starts its knowledge base lookup inside
+process_request, i.e. after the orchestrator has finished classifying the
+request, so a KB answer pays classification + retrieval + generation one after
+another. PrefetchingOrchestrator starts the lookup of every agent whose
+retriever is a PrefetchingRetriever as soon as the request arrives, on a worker
+thread, while the classifier runs. When the classifier picks that agent, its
+retriever hands over the prefetched context (waiting only for whatever is left
+of the lookup); when it picks another agent, the prefetch is cancelled if it has
+not started yet and its result is discarded otherwise.
+
+    kb_retriever = PrefetchingRetriever(CachingRetriever(CachingRetrieverOptions(retriever=retriever)))
+    knowledge_agent = BedrockLLMAgent(BedrockLLMAgentOptions(..., retriever=kb_retriever))
+    orchestrator = PrefetchingOrchestrator(classifier=..., options=OrchestratorConfig(...))
+
+Run `python prefetch.py` to compare a knowledge base question with and without
+prefetch against the stub model and knowledge base.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from multi_agent_orchestrator.agents import AgentResponse
+from multi_agent_orchestrator.classifiers import ClassifierResult
+from multi_agent_orchestrator.orchestrator import MultiAgentOrchestrator
+from multi_agent_orchestrator.retrievers import Retriever
+
+from runner import run_in_thread
+
+# agent id -> retriever with a prefetch started for the request being routed
+_request_prefetches: contextvars.ContextVar = contextvars.ContextVar('request_prefetches', default=None)
+
+
+class _Prefetch:
+    __slots__ = ('future', 'users', 'used', 'duration_ms')
+
+    def __init__(self, future: Future):
+        self.future = future
+        self.users = 1
+        self.used = False
+        self.duration_ms = 0.0
+
+
+class PrefetchingRetriever(Retriever):
+    """Retriever whose retrieve_and_combine_results can be started ahead of the agent call.
+
+    Args:
+        retriever: The retriever doing the lookup (AmazonKnowledgeBasesRetriever, CachingRetriever, ...).
+        max_workers: Prefetches running at the same time; more are queued and can still be cancelled.
+    """
+
+    def __init__(self, retriever: Retriever, max_workers: int = 4):
+        super().__init__({'retriever': retriever})
+        self.retriever = retriever
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kb-prefetch')
+        self._pending: Dict[str, _Prefetch] = {}
+        self._lock = threading.Lock()
+        self.counts = {'started': 0, 'used': 0, 'cancelled': 0, 'discarded': 0, 'saved_ms': 0.0}
+
+    def prefetch(self, text: str) -> None:
+        """Start the lookup for text on a worker thread; requests with the same text share it."""
+        with self._lock:
+            prefetch = self._pending.get(text)
+            if prefetch is not None:
+                prefetch.users += 1
+                return
+            context = contextvars.copy_context()
+            prefetch = _Prefetch(self._executor.submit(context.run, self._lookup, text))
+            self._pending[text] = prefetch
+            self.counts['started'] += 1
+
+    def _lookup(self, text: str) -> str:
+        start = time.perf_counter()
+        try:
+            return asyncio.run(self.retriever.retrieve_and_combine_results(text))
+        finally:
+            with self._lock:
+                prefetch = self._pending.get(text)
+                if prefetch is not None:
+                    prefetch.duration_ms = (time.perf_counter() - start) * 1000
+
+    def release(self, text: str) -> None:
+        """The request that started the prefetch is done with it: drop it once nobody else needs it."""
+        with self._lock:
+            prefetch = self._pending.get(text)
+            if prefetch is None:
+                return
+            prefetch.users -= 1
+            if prefetch.users > 0:
+                return
+            del self._pending[text]
+            if prefetch.used:
+                return
+            if prefetch.future.cancel():
+                self.counts['cancelled'] += 1
+            else:
+                self.counts['discarded'] += 1
+
+    async def retrieve_and_combine_results(self, text: str, *args: Any, **kwargs: Any) -> str:
+        with self._lock:
+            prefetch = None if args or kwargs else self._pending.get(text)
+        if prefetch is not None and not prefetch.future.cancelled():
+            wait_start = time.perf_counter()
+            try:
+                result = await asyncio.wrap_future(prefetch.future)
+            except asyncio.CancelledError:
+                if not prefetch.future.cancelled():
+                    raise
+            else:
+                with self._lock:
+                    prefetch.used = True
+                    self.counts['used'] += 1
+                    self.counts['saved_ms'] += max(0.0, prefetch.duration_ms
+                                                   - (time.perf_counter() - wait_start) * 1000)
+                return result
+        return await run_in_thread(self.retriever.retrieve_and_combine_results(text, *args, **kwargs))
+
+    async def retrieve(self, text: str, *args: Any, **kwargs: Any) -> Any:
+        return await run_in_thread(self.retriever.retrieve(text, *args, **kwargs))
+
+    async def retrieve_and_generate(self, text: str, *args: Any, **kwargs: Any) -> Any:
+        return await run_in_thread(self.retriever.retrieve_and_generate(text, *args, **kwargs))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {**self.counts, 'saved_ms': round(self.counts['saved_ms'], 1), 'pending': len(self._pending)}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PrefetchingOrchestrator(MultiAgentOrchestrator):
+    """MultiAgentOrchestrator that starts knowledge base prefetches before classifying the request."""
+
+    def _prefetching_agents(self) -> Dict[str, PrefetchingRetriever]:
+        return {agent_id: agent.retriever for agent_id, agent in self.agents.items()
+                if isinstance(getattr(agent, 'retriever', None), PrefetchingRetriever)}
+
+    async def route_request(self,
+                            user_input: str,
+                            user_id: str,
+                            session_id: str,
+                            additional_params: Optional[Dict[str, str]] = None) -> AgentResponse:
+        started = self._prefetching_agents()
+        for retriever in started.values():
+            retriever.prefetch(user_input)
+        token = _request_prefetches.set(started)
+        try:
+            return await super().route_request(user_input, user_id, session_id,
+                                               additional_params if additional_params is not None else {})
+        finally:
+            _request_prefetches.reset(token)
+            for retriever in started.values():
+                retriever.release(user_input)
+
+    async def classify_request(self, user_input: str, user_id: str, session_id: str) -> ClassifierResult:
+        started = _request_prefetches.get()
+        try:
+            result = await super().classify_request(user_input, user_id, session_id)
+        except Exception:
+            self._release(started, user_input, keep=None)
+            raise
+        self._release(started, user_input, keep=result.selected_agent.id if result.selected_agent else None)
+        return result
+
+    @staticmethod
+    def _release(started: Optional[Dict[str, PrefetchingRetriever]], user_input: str, keep: Optional[str]) -> None:
+        """Give up the prefetches of every agent except the selected one as soon as routing is known."""
+        for agent_id in [agent_id for agent_id in (started or {}) if agent_id != keep]:
+            started.pop(agent_id).release(user_input)
+
+
+if __name__ == "__main__":
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
+    from multi_agent_orchestrator.orchestrator import OrchestratorConfig
+    from multi_agent_orchestrator.retrievers import AmazonKnowledgeBasesRetriever, AmazonKnowledgeBasesRetrieverOptions
+    from stub_bedrock import StubBedrockServer
+
+    MODELID = 'us.amazon.nova-pro-v1:0'
+    KB_ID = 'KBSTUB0001'
+    PASSAGES = [{'text': f"Amazon Bedrock note {i}: Bedrock offers foundation models through one API."}
+                for i in range(50)]
+    QUESTIONS = ["What foundation models does Amazon Bedrock offer?",
+                 "Is it sunny in Seattle today, weather report please?"]
+
+    def build(orchestrator_class, server, retriever):
+        client = server.client()
+        orchestrator = orchestrator_class(
+            classifier=BedrockClassifier(BedrockClassifierOptions(model_id=MODELID, client=client)),
+            options=OrchestratorConfig(LOG_EXECUTION_TIMES=False))
+        orchestrator.add_agent(BedrockLLMAgent(BedrockLLMAgentOptions(
+            name="Weather Agent", description="Provide weather report", model_id=MODELID, client=client)))
+        orchestrator.add_agent(BedrockLLMAgent(BedrockLLMAgentOptions(
+            name="Knowledge Agent", description="Knowledge of Amazon Generative AI services such as Bedrock",
+            model_id=MODELID, client=client, retriever=retriever)))
+        return orchestrator
+
+    async def ask(orchestrator, question, turns=5):
+        start = time.perf_counter()
+        for turn in range(turns):
+            response = await orchestrator.route_request(question, 'user1', f'session{turn}')
+        return (time.perf_counter() - start) / turns * 1000, response.metadata.agent_name
+
+    print("stub: 300ms per model call and per Retrieve call")
+    with StubBedrockServer(latency=0.3, knowledge_bases={KB_ID: PASSAGES}) as server:
+        kb = AmazonKnowledgeBasesRetriever(AmazonKnowledgeBasesRetrieverOptions(
+            knowledge_base_id=KB_ID, region='us-east-1',
+            retrievalConfiguration={'vectorSearchConfiguration': {'numberOfResults': 5}}))
+        kb.client = server.client('bedrock-agent-runtime')
+        prefetching = PrefetchingRetriever(kb)
+        for name, orchestrator in [('sequential', build(MultiAgentOrchestrator, server, kb)),
+                                   ('prefetch', build(PrefetchingOrchestrator, server, prefetching))]:
+            for question in QUESTIONS:
+                server.request_count = 0
+                ms, agent = asyncio.run(ask(orchestrator, question))
+                print(f"{name:<10} {agent:<16} {ms:7.1f}ms per request, {server.request_count / 5:.0f} stub calls")
+        time.sleep(0.5)
+        print(f"prefetch stats: {prefetching.stats()}")
+        prefetching.shutdown()
@@ -0,0 +1,200 @@
+"""
+Shared event loop and boto3 client pool for the interactive scripts.
+
+The REPL loops used to call asyncio.run() once per turn, which builds and tears
+down a fresh event loop (and its default executor) on every input. AsyncRunner
+keeps a single loop alive for the whole session, and get_client() hands out one
+pooled client per (service, region, settings) so the classifier and all agents
+share the same keep-alive connections.
+
+    runner = AsyncRunner()
+    client = get_client('bedrock-runtime', region_name='us-east-1')
+    ...
+    runner.run(handle_request(orchestrator, user_input, USER_ID, SESSION_ID))
+
+Run `python runner.py` for a 500-turn before/after benchmark against the local
+stub Bedrock endpoint.
+"""
+import asyncio
+import contextvars
+import threading
+import weakref
+from concurrent.futures import Executor
+from typing import Any, Coroutine, Dict, Optional, Tuple, TypeVar
+
+import boto3
+from botocore.config import Config
+
+T = TypeVar('T')
+
+DEFAULT_POOL_CONNECTIONS = 50
+
+_clients: Dict[Tuple, Any] = {}
+_clients_lock = threading.Lock()
+
+# loops that run one request at a time (run_in_thread workers, AsyncRunner's REPL loop)
+_dedicated_loops: 'weakref.WeakSet[asyncio.AbstractEventLoop]' = weakref.WeakSet()
+
+
+def _config_key(config: Optional[Config]) -> Tuple:
+    if config is None:
+        return ()
+    return tuple(sorted((k, repr(v)) for k, v in config._user_provided_options.items()))
+
+
+def get_client(service_name: str = 'bedrock-runtime',
+               region_name: Optional[str] = None,
+               config: Optional[Config] = None,
+               **client_kwargs: Any):
+    """Return a shared boto3 client, creating it on first use.
+
+    Clients are keyed by service, region, config and any extra boto3.client
+    kwargs (credentials, endpoint_url, ...). boto3 clients are thread-safe, so the
+    same instance can back the classifier, every agent and the supervisor's
+    worker threads.
+    """
+    key = (service_name, region_name, _config_key(config),
+           tuple(sorted((k, repr(v)) for k, v in client_kwargs.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            pooled_config = Config(max_pool_connections=DEFAULT_POOL_CONNECTIONS, tcp_keepalive=True)
+            if config is not None:
+                pooled_config = pooled_config.merge(config)
+            client = boto3.client(service_name,
+                                  region_name=region_name,
+                                  config=pooled_config,
+                                  **client_kwargs)
+            _clients[key] = client
+        return client
+
+
+def clear_clients() -> None:
+    """Close and forget every pooled client."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def may_block() -> bool:
+    """False when the calling thread runs an event loop that may be shared by several requests.
+
+    Waiting (a queue, a retry backoff) is fine on a plain thread or a loop that
+    serves one request; on any other loop it would stall every task on it.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return True
+    return loop in _dedicated_loops
+
+
+async def _dedicated(coro: Coroutine[Any, Any, T]) -> T:
+    _dedicated_loops.add(asyncio.get_running_loop())
+    return await coro
+
+
+async def run_in_thread(coro: Coroutine[Any, Any, T], executor: Optional[Executor] = None) -> T:
+    """Await a coroutine that makes blocking calls (boto3) on a worker thread with its own loop.
+
+    The agents call boto3 synchronously inside async methods, so awaiting several
+    of them with asyncio.gather on one loop still runs them one after another.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, context.run, asyncio.run, _dedicated(coro))
+
+
+class AsyncRunner:
+    """Runs coroutines on one long-lived event loop instead of one loop per call.
+
+    The loop runs one REPL turn at a time, so it counts as dedicated for may_block().
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        _dedicated_loops.add(self.loop)
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        if self.loop.is_closed():
+            raise RuntimeError('AsyncRunner is closed')
+        return self.loop.run_until_complete(coro)
+
+    def close(self) -> None:
+        if self.loop.is_closed():
+            return
+        pending = asyncio.all_tasks(self.loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def __enter__(self) -> 'AsyncRunner':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    import statistics
+    import time
+    from multi_agent_orchestrator.orchestrator import MultiAgentOrchestrator, OrchestratorConfig
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
+    from stub_bedrock import StubBedrockServer
+
+    TURNS = 500
+    MODELID = 'us.amazon.nova-pro-v1:0'
+    questions = ["What is the best GPU for training AI models?",
+                 "How much sleep does an adult need for good health?"]
+
+    def build_orchestrator(client_factory):
+        orchestrator = MultiAgentOrchestrator(
+            classifier=BedrockClassifier(BedrockClassifierOptions(model_id=MODELID, client=client_factory())),
+            options=OrchestratorConfig(USE_DEFAULT_AGENT_IF_NONE_IDENTIFIED=False,
+                                       MAX_MESSAGE_PAIRS_PER_AGENT=10))
+        orchestrator.add_agent(BedrockLLMAgent(BedrockLLMAgentOptions(
+            name="Tech Agent", streaming=True, model_id=MODELID, client=client_factory(),
+            description="Specializes in technology areas including software development, hardware, AI")))
+        orchestrator.add_agent(BedrockLLMAgent(BedrockLLMAgentOptions(
+            name="Health Agent", streaming=True, model_id=MODELID, client=client_factory(),
+            description="Focuses on health and medical topics such as wellness, nutrition, sleep")))
+        return orchestrator
+
+    def report(name, durations):
+        durations = sorted(durations)
+        print(f"{name:<32} mean={statistics.mean(durations) * 1000:7.2f}ms "
+              f"p50={durations[len(durations) // 2] * 1000:7.2f}ms "
+              f"p95={durations[int(len(durations) * 0.95)] * 1000:7.2f}ms")
+
+    with StubBedrockServer() as server:
+        # before: one client per component, a fresh event loop per turn
+        orchestrator = build_orchestrator(lambda: server.client('bedrock-runtime'))
+        before = []
+        for i in range(TURNS):
+            t1 = time.perf_counter()
+            asyncio.run(orchestrator.route_request(questions[i % 2], 'user123', 'session-before'))
+            before.append(time.perf_counter() - t1)
+
+        # after: one pooled client, one event loop for the whole session
+        orchestrator = build_orchestrator(
+            lambda: get_client('bedrock-runtime', region_name='us-east-1',
+                               endpoint_url=server.endpoint_url,
+                               aws_access_key_id='stub', aws_secret_access_key='stub'))
+        after = []
+        with AsyncRunner() as runner:
+            for i in range(TURNS):
+                t1 = time.perf_counter()
+                runner.run(orchestrator.route_request(questions[i % 2], 'user123', 'session-after'))
+                after.append(time.perf_counter() - t1)
+
+        print(f"{TURNS} turns against {server.endpoint_url} ({server.request_count} stub calls)")
+        report("asyncio.run per turn", before)
+        report("AsyncRunner + pooled client", after)
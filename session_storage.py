@@ -0,0 +1,342 @@
+"""
+Bounded in-memory ChatStorage for many concurrent sessions.
+
+The default InMemoryChatStorage keeps one ever-growing dict entry per
+user#session#agent, never forgets idle sessions, scans every key on
+fetch_all_chats, and hands the agents up to MAX_MESSAGE_PAIRS_PER_AGENT raw
+pairs on every request. SessionChatStorage instead:
+
+* keeps each (user, session) in one entry with a fixed-size ring buffer per agent,
+* evicts sessions that have been idle for `idle_ttl` seconds (and the least
+  recently used ones above `max_sessions`),
+* folds the oldest turns of long conversations into a single summary in a
+  background task, and replays it as one leading user/assistant pair on fetch.
+
+    orchestrator = MultiAgentOrchestrator(
+        storage=SessionChatStorage(SessionChatStorageOptions(max_messages=20, idle_ttl=1800)),
+        ...)
+
+The default summarizer is local and extractive; bedrock_summarizer() builds one
+that asks a model instead. Run `python session_storage.py` for the memory and
+prompt-token comparison under a 10k-session synthetic load.
+"""
+import asyncio
+import inspect
+import itertools
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from multi_agent_orchestrator.storage import ChatStorage
+from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole, TimestampedMessage
+from multi_agent_orchestrator.utils import Logger
+
+from runner import run_in_thread
+from text_utils import split_sentences
+
+# (sequence number, role, content, timestamp in ms)
+StoredMessage = Tuple[int, str, List[Dict[str, Any]], int]
+# summarizer(previous summary, messages to fold) -> new summary, sync or async
+Summarizer = Callable[[str, List[ConversationMessage]], Union[str, Awaitable[str]]]
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+SUMMARY_ACK = "Understood, I will keep this context in mind."
+
+
+def message_text(message: ConversationMessage) -> str:
+    return ' '.join(block['text'] for block in message.content or [] if 'text' in block)
+
+
+def extractive_summarizer(summary: str, messages: List[ConversationMessage], max_chars: int = 1200) -> str:
+    """Keep the first sentence of every folded turn, newest summaries last, capped at max_chars."""
+    lines = [summary] if summary else []
+    for message in messages:
+        text = ' '.join(message_text(message).split())
+        if text:
+            sentences = split_sentences(text)
+            lines.append(f"{message.role}: {sentences[0].strip()[:200] if sentences else text[:200]}")
+    joined = '\n'.join(lines)
+    return joined[-max_chars:] if len(joined) > max_chars else joined
+
+
+def bedrock_summarizer(client, model_id: str, max_tokens: int = 300) -> Summarizer:
+    """Summarizer backed by a Converse call, run on a worker thread."""
+    def summarize(summary: str, messages: List[ConversationMessage]) -> str:
+        transcript = '\n'.join(f"{message.role}: {message_text(message)}" for message in messages)
+        response = client.converse(
+            modelId=model_id,
+            system=[{'text': "Condense the conversation into a short summary that keeps names, numbers, "
+                             "decisions and open questions. Output only the summary."}],
+            messages=[{'role': 'user', 'content': [{'text': f"Previous summary:\n{summary or '(none)'}\n\n"
+                                                            f"New turns:\n{transcript}"}]}],
+            inferenceConfig={'maxTokens': max_tokens, 'temperature': 0.0},
+        )
+        return response['output']['message']['content'][0]['text']
+    return summarize
+
+
+@dataclass
+class SessionChatStorageOptions:
+    max_messages: int = 20  # ring buffer size per agent, kept even so pairs stay intact
+    idle_ttl: Optional[float] = 1800  # seconds without activity before a session is evicted
+    max_sessions: Optional[int] = None  # least recently used sessions above this are evicted
+    summarize_after: Optional[int] = 12  # fold old turns once an agent holds more messages than this
+    keep_recent: int = 6  # messages left verbatim after folding
+    summarizer: Optional[Summarizer] = None  # defaults to extractive_summarizer
+    clock: Callable[[], float] = time.monotonic
+
+
+class _Session:
+    __slots__ = ('agents', 'summaries', 'last_access')
+
+    def __init__(self, now: float):
+        self.agents: Dict[str, Deque[StoredMessage]] = {}
+        self.summaries: Dict[str, str] = {}
+        self.last_access = now
+
+
+class SessionChatStorage(ChatStorage):
+    def __init__(self, options: Optional[SessionChatStorageOptions] = None):
+        super().__init__()
+        options = options or SessionChatStorageOptions()
+        if options.summarize_after is not None and options.keep_recent >= options.summarize_after:
+            raise ValueError("keep_recent must be smaller than summarize_after")
+        self.max_messages = options.max_messages - options.max_messages % 2
+        self.idle_ttl = options.idle_ttl
+        self.max_sessions = options.max_sessions
+        self.summarize_after = options.summarize_after
+        self.keep_recent = options.keep_recent - options.keep_recent % 2
+        self.summarizer = options.summarizer or extractive_summarizer
+        self.clock = options.clock
+        self.sessions: 'OrderedDict[Tuple[str, str], _Session]' = OrderedDict()
+        self.evicted = 0
+        self.compactions = 0
+        self._sequence = itertools.count()
+        self._pending: Dict[Tuple[str, str, str], asyncio.Task] = {}
+
+    def _session(self, user_id: str, session_id: str, create: bool = True) -> Optional[_Session]:
+        now = self.clock()
+        self._evict(now)
+        key = (user_id, session_id)
+        session = self.sessions.get(key)
+        if session is None:
+            if not create:
+                return None
+            session = self.sessions[key] = _Session(now)
+        else:
+            self.sessions.move_to_end(key)
+            session.last_access = now
+        return session
+
+    def _evict(self, now: float) -> None:
+        """Drop idle sessions from the LRU end; O(number evicted)."""
+        while self.sessions:
+            key, oldest = next(iter(self.sessions.items()))
+            idle = self.idle_ttl is not None and now - oldest.last_access > self.idle_ttl
+            over = self.max_sessions is not None and len(self.sessions) > self.max_sessions
+            if not (idle or over):
+                break
+            del self.sessions[key]
+            self.evicted += 1
+
+    def _append(self, session: _Session, agent_id: str,
+                messages: List[Union[ConversationMessage, TimestampedMessage]],
+                max_history_size: Optional[int]) -> Deque[StoredMessage]:
+        size = self.max_messages
+        if max_history_size is not None:
+            size = min(size, max_history_size - max_history_size % 2)
+        buffer = session.agents.get(agent_id)
+        if buffer is None or buffer.maxlen != size:
+            buffer = session.agents[agent_id] = deque(buffer or (), maxlen=size)
+        for message in messages:
+            if buffer and buffer[-1][1] == message.role:
+                Logger.debug(f"> Consecutive {message.role} message detected for agent {agent_id}. Not saving.")
+                continue
+            timestamp = getattr(message, 'timestamp', None) or int(time.time() * 1000)
+            buffer.append((next(self._sequence), message.role, message.content, timestamp))
+        return buffer
+
+    def _schedule_compaction(self, user_id: str, session_id: str, agent_id: str, buffer: Deque) -> None:
+        # also fold when the ring is full, so nothing falls off unsummarized when the
+        # orchestrator's max_history_size is smaller than summarize_after
+        if self.summarize_after is None or (len(buffer) <= self.summarize_after and len(buffer) < buffer.maxlen):
+            return
+        key = (user_id, session_id, agent_id)
+        task = self._pending.get(key)
+        if task is not None and not task.done():
+            return
+        self._pending[key] = asyncio.get_running_loop().create_task(self._compact(user_id, session_id, agent_id))
+
+    async def _compact(self, user_id: str, session_id: str, agent_id: str) -> None:
+        try:
+            session = self.sessions.get((user_id, session_id))
+            buffer = session.agents.get(agent_id) if session else None
+            keep = min(self.keep_recent, buffer.maxlen - 2) if buffer else 0
+            if not buffer or len(buffer) <= keep:
+                return
+            count = len(buffer) - keep
+            count -= count % 2  # fold whole pairs so the history still starts with a user turn
+            if not count:
+                return
+            folded = list(buffer)[:count]
+            previous = session.summaries.get(agent_id, '')
+            messages = self._to_messages(folded)
+            if inspect.iscoroutinefunction(self.summarizer):
+                summary = await self.summarizer(previous, messages)
+            elif self.summarizer is extractive_summarizer:
+                summary = self.summarizer(previous, messages)
+            else:
+                summary = await run_in_thread(self._call_summarizer(previous, messages))
+            last_sequence = folded[-1][0]
+            # the ring buffer may have moved on while the summarizer ran
+            while buffer and buffer[0][0] <= last_sequence:
+                buffer.popleft()
+            session.summaries[agent_id] = summary
+            self.compactions += 1
+        except Exception as error:
+            Logger.error(f"Error summarizing {user_id}#{session_id}#{agent_id}: {str(error)}")
+        finally:
+            self._pending.pop((user_id, session_id, agent_id), None)
+
+    async def _call_summarizer(self, previous: str, messages: List[ConversationMessage]) -> str:
+        return self.summarizer(previous, messages)
+
+    async def flush(self) -> None:
+        """Wait for the background summaries that are still running."""
+        pending = [task for task in self._pending.values() if not task.done()]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    @staticmethod
+    def _to_messages(stored: List[StoredMessage]) -> List[ConversationMessage]:
+        return [ConversationMessage(role=role, content=content) for _, role, content, _ in stored]
+
+    def _with_summary(self, session: _Session, agent_id: str, buffer) -> List[ConversationMessage]:
+        messages = self._to_messages(list(buffer or ()))
+        summary = session.summaries.get(agent_id)
+        if summary:
+            messages = [ConversationMessage(role=ParticipantRole.USER.value,
+                                            content=[{'text': f"{SUMMARY_PREFIX}\n{summary}"}]),
+                        ConversationMessage(role=ParticipantRole.ASSISTANT.value,
+                                            content=[{'text': SUMMARY_ACK}])] + messages
+        return messages
+
+    async def save_chat_message(self,
+                                user_id: str,
+                                session_id: str,
+                                agent_id: str,
+                                new_message: Union[ConversationMessage, TimestampedMessage],
+                                max_history_size: Optional[int] = None) -> List[ConversationMessage]:
+        return await self.save_chat_messages(user_id, session_id, agent_id, [new_message], max_history_size)
+
+    async def save_chat_messages(self,
+                                 user_id: str,
+                                 session_id: str,
+                                 agent_id: str,
+                                 new_messages: Union[List[ConversationMessage], List[TimestampedMessage]],
+                                 max_history_size: Optional[int] = None) -> List[ConversationMessage]:
+        session = self._session(user_id, session_id)
+        buffer = self._append(session, agent_id, new_messages, max_history_size)
+        self._schedule_compaction(user_id, session_id, agent_id, buffer)
+        return self._with_summary(session, agent_id, buffer)
+
+    async def fetch_chat(self,
+                         user_id: str,
+                         session_id: str,
+                         agent_id: str,
+                         max_history_size: Optional[int] = None) -> List[ConversationMessage]:
+        session = self._session(user_id, session_id, create=False)
+        if session is None:
+            return []
+        messages = self._with_summary(session, agent_id, session.agents.get(agent_id))
+        return self.trim_conversation(messages, max_history_size)
+
+    async def fetch_all_chats(self, user_id: str, session_id: str) -> List[ConversationMessage]:
+        session = self._session(user_id, session_id, create=False)
+        if session is None:
+            return []
+        stored = []
+        for agent_id, buffer in session.agents.items():
+            for _, role, content, timestamp in buffer:
+                if content and role == ParticipantRole.ASSISTANT.value and 'text' in content[0]:
+                    content = [{'text': f"[{agent_id}] {content[0]['text']}"}]
+                stored.append((timestamp, role, content))
+        stored.sort(key=lambda item: item[0])
+        return [ConversationMessage(role=role, content=content) for _, role, content in stored]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'sessions': len(self.sessions),
+            'messages': sum(len(buffer) for session in self.sessions.values() for buffer in session.agents.values()),
+            'summaries': sum(len(session.summaries) for session in self.sessions.values()),
+            'evicted': self.evicted,
+            'compactions': self.compactions,
+        }
+
+
+if __name__ == "__main__":
+    import random
+    import tracemalloc
+    from multi_agent_orchestrator.storage import InMemoryChatStorage
+
+    SESSIONS = 10_000
+    TURNS = 12
+    AGENTS = ['tech-agent', 'health-agent']
+    random.seed(7)
+    words = ("cloud gpu price training model sleep protein health memory latency network budget "
+             "question answer detail example forecast plan").split()
+
+    def sentence(n):
+        return ' '.join(random.choice(words) for _ in range(n)).capitalize() + '.'
+
+    # each session is active for a while and then goes idle; simulated time advances 1s per turn batch
+    now = [0.0]
+    workload = []
+    for turn in range(TURNS):
+        for s in range(SESSIONS):
+            workload.append((f"user{s % 500}", f"session{s}", AGENTS[s % 2],
+                             ' '.join(sentence(12) for _ in range(3)), ' '.join(sentence(15) for _ in range(6))))
+
+    def tokens(messages):
+        return sum(len(message_text(message)) for message in messages) // 4
+
+    async def replay(storage, active_sessions):
+        prompt_tokens = 0
+        for i, (user_id, session_id, agent_id, question, answer) in enumerate(workload):
+            turn, s = divmod(i, SESSIONS)
+            now[0] = turn * 60.0
+            if s >= active_sessions(turn):
+                continue
+            history = await storage.fetch_chat(user_id, session_id, agent_id)
+            prompt_tokens += tokens(history)
+            await storage.save_chat_messages(user_id, session_id, agent_id, [
+                ConversationMessage(role=ParticipantRole.USER.value, content=[{'text': question}]),
+                ConversationMessage(role=ParticipantRole.ASSISTANT.value, content=[{'text': answer}]),
+            ], 20)
+            if isinstance(storage, SessionChatStorage) and i % 1000 == 0:
+                await asyncio.sleep(0)  # let the background summaries run
+        if isinstance(storage, SessionChatStorage):
+            await storage.flush()
+        return prompt_tokens
+
+    def measure(name, storage):
+        tracemalloc.start()
+        t1 = time.perf_counter()
+        # all sessions start together; half of them go idle after 6 turns
+        prompt_tokens = asyncio.run(replay(storage, lambda turn: SESSIONS if turn < 6 else SESSIONS // 2))
+        elapsed = time.perf_counter() - t1
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<22} memory={current / 2**20:7.1f}MB  prompt tokens={prompt_tokens:>11,}  "
+              f"time={elapsed:5.1f}s")
+        return current, prompt_tokens
+
+    print(f"{SESSIONS} sessions x {TURNS} turns, half of the sessions idle after turn 6")
+    base_memory, base_tokens = measure("InMemoryChatStorage", InMemoryChatStorage())
+    storage = SessionChatStorage(SessionChatStorageOptions(max_messages=20, idle_ttl=300,
+                                                           summarize_after=12, keep_recent=6,
+                                                           clock=lambda: now[0]))
+    memory, prompt_tokens = measure("SessionChatStorage", storage)
+    print(f"memory saved {1 - memory / base_memory:.0%}, prompt tokens saved {1 - prompt_tokens / base_tokens:.0%}, "
+          f"{storage.stats()}")
@@ -0,0 +1,331 @@
+"""
+Durable ChatStorage on a local SQLite file in WAL mode.
+
+Writes never touch the event loop: save_chat_message(s) hands the rows to a
+single writer thread, which groups everything queued within `flush_interval`
+(up to `batch_size` rows) into one transaction. The awaiting coroutines are
+resumed once their batch is committed, so concurrent sessions share commits
+instead of paying one fsync each. Reads run on a small thread pool with one
+connection per thread; WAL lets them proceed while the writer commits.
+
+Messages are indexed by (user_id, session_id, agent_id, id), so fetching the
+last N messages of one agent is a short index range scan regardless of how big
+the table gets.
+
+    orchestrator = MultiAgentOrchestrator(
+        storage=SqliteChatStorage(SqliteChatStorageOptions(path='chat_history.db')),
+        ...)
+
+Run `python sqlite_chat_storage.py` for append/fetch throughput at 1M messages.
+"""
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+from multi_agent_orchestrator.storage import ChatStorage
+from multi_agent_orchestrator.types import ConversationMessage, ParticipantRole, TimestampedMessage
+from multi_agent_orchestrator.utils import Logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (user_id, session_id, agent_id, id);
+"""
+
+INSERT = ('INSERT INTO messages (user_id, session_id, agent_id, role, content, timestamp) '
+          'VALUES (?, ?, ?, ?, ?, ?)')
+
+# (user_id, session_id, agent_id, role, content json, timestamp, skip if the last stored role is the same)
+Row = Tuple[str, str, str, str, str, int, bool]
+
+
+@dataclass
+class SqliteChatStorageOptions:
+    path: str = 'chat_history.db'
+    batch_size: int = 512  # max rows per write transaction
+    flush_interval: float = 0.005  # seconds the writer waits for more rows before committing
+    wait_for_commit: bool = True  # False: saves return as soon as the rows are queued
+    default_max_messages: Optional[int] = 20  # fetch_chat limit when neither the caller nor a save gave one
+    max_remembered_limits: int = 10000  # conversations whose save-time history limit is kept (LRU)
+    read_threads: int = 4
+    synchronous: str = 'NORMAL'  # PRAGMA synchronous; NORMAL is durable across crashes of the process in WAL mode
+
+
+class SqliteChatStorage(ChatStorage):
+    def __init__(self, options: Optional[SqliteChatStorageOptions] = None):
+        super().__init__()
+        options = options or SqliteChatStorageOptions()
+        self.path = options.path
+        self.batch_size = options.batch_size
+        self.flush_interval = options.flush_interval
+        self.wait_for_commit = options.wait_for_commit
+        self.default_max_messages = options.default_max_messages
+        self.synchronous = options.synchronous
+        # history limit the orchestrator passes on save, reused when it fetches without one;
+        # least recently used conversations fall back to default_max_messages
+        self._limits: 'OrderedDict[Tuple[str, str, str], int]' = OrderedDict()  # (user, session, agent) -> size
+        self._limits_lock = threading.Lock()
+        self.max_remembered_limits = options.max_remembered_limits
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._readers = ThreadPoolExecutor(max_workers=options.read_threads, thread_name_prefix='sqlite-read')
+
+        writer = self._connect()
+        writer.executescript(SCHEMA)
+        writer.commit()
+        self._queue: 'queue.Queue[Optional[Tuple[List[Row], Optional[asyncio.Future]]]]' = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, args=(writer,), name='sqlite-writer', daemon=True)
+        self._writer.start()
+        self.batches = 0
+        self.rows_written = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(f'PRAGMA synchronous={self.synchronous}')
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # writer thread
+
+    def _write_loop(self, connection: sqlite3.Connection) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            rows = len(item[0])
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while rows < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                rows += len(item[0])
+            self._commit(connection, batch)
+            if stop:
+                return
+
+    def _commit(self, connection: sqlite3.Connection,
+                batch: List[Tuple[List[Row], Optional[asyncio.Future]]]) -> None:
+        error: Optional[BaseException] = None
+        try:
+            with connection:
+                for rows, _ in batch:
+                    rows = [row[:6] for row in rows
+                            if not (row[6] and self._last_role(connection, *row[:3]) == row[3])]
+                    connection.executemany(INSERT, rows)
+                    self.rows_written += len(rows)
+            self.batches += 1
+        except Exception as e:
+            Logger.error(f"Error writing chat messages to {self.path}: {str(e)}")
+            error = e
+        for _, future in batch:
+            if future is None or future.get_loop().is_closed():
+                continue  # nobody is left to wait for it
+            try:
+                future.get_loop().call_soon_threadsafe(self._resolve, future, error)
+            except RuntimeError:
+                pass  # the loop closed after the check; keep the writer thread alive
+
+    @staticmethod
+    def _last_role(connection: sqlite3.Connection, user_id: str, session_id: str, agent_id: str) -> Optional[str]:
+        row = connection.execute(
+            'SELECT role FROM messages WHERE user_id = ? AND session_id = ? AND agent_id = ? '
+            'ORDER BY id DESC LIMIT 1', (user_id, session_id, agent_id)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, error: Optional[BaseException]) -> None:
+        if future.done():
+            return
+        if error is None:
+            future.set_result(True)
+        else:
+            future.set_exception(error)
+
+    # ChatStorage
+
+    async def _enqueue(self, rows: List[Row]) -> bool:
+        if not self.wait_for_commit:
+            self._queue.put((rows, None))
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put((rows, future))
+        return await future
+
+    @staticmethod
+    def _rows(user_id: str, session_id: str, agent_id: str,
+              messages: List[Union[ConversationMessage, TimestampedMessage]], check_role: bool) -> List[Row]:
+        return [(user_id, session_id, agent_id, message.role, json.dumps(message.content, ensure_ascii=False),
+                 getattr(message, 'timestamp', None) or int(time.time() * 1000), check_role)
+                for message in messages]
+
+    def _remember_limit(self, key: Tuple[str, str, str], max_history_size: Optional[int]) -> None:
+        if max_history_size is None:
+            return
+        with self._limits_lock:
+            self._limits[key] = max_history_size
+            self._limits.move_to_end(key)
+            while len(self._limits) > self.max_remembered_limits:
+                self._limits.popitem(last=False)
+
+    def _remembered_limit(self, key: Tuple[str, str, str]) -> Optional[int]:
+        with self._limits_lock:
+            limit = self._limits.get(key)
+            if limit is not None:
+                self._limits.move_to_end(key)
+            return limit
+
+    async def save_chat_message(self,
+                                user_id: str,
+                                session_id: str,
+                                agent_id: str,
+                                new_message: Union[ConversationMessage, TimestampedMessage],
+                                max_history_size: Optional[int] = None) -> bool:
+        self._remember_limit((user_id, session_id, agent_id), max_history_size)
+        return await self._enqueue(self._rows(user_id, session_id, agent_id, [new_message], True))
+
+    async def save_chat_messages(self,
+                                 user_id: str,
+                                 session_id: str,
+                                 agent_id: str,
+                                 new_messages: Union[List[ConversationMessage], List[TimestampedMessage]],
+                                 max_history_size: Optional[int] = None) -> bool:
+        self._remember_limit((user_id, session_id, agent_id), max_history_size)
+        if not new_messages:
+            return True
+        return await self._enqueue(self._rows(user_id, session_id, agent_id, new_messages, False))
+
+    async def _read(self, sql: str, params: tuple) -> List[tuple]:
+        def query():
+            return self._reader().execute(sql, params).fetchall()
+        return await asyncio.get_running_loop().run_in_executor(self._readers, query)
+
+    async def fetch_chat(self,
+                         user_id: str,
+                         session_id: str,
+                         agent_id: str,
+                         max_history_size: Optional[int] = None) -> List[ConversationMessage]:
+        limit = (max_history_size or self._remembered_limit((user_id, session_id, agent_id))
+                 or self.default_max_messages)
+        limit = limit - limit % 2 if limit else -1  # keep complete pairs, -1 = no LIMIT
+        rows = await self._read(
+            'SELECT role, content FROM messages WHERE user_id = ? AND session_id = ? AND agent_id = ? '
+            'ORDER BY id DESC LIMIT ?', (user_id, session_id, agent_id, limit))
+        return [ConversationMessage(role=role, content=json.loads(content)) for role, content in reversed(rows)]
+
+    async def fetch_all_chats(self, user_id: str, session_id: str) -> List[ConversationMessage]:
+        rows = await self._read(
+            'SELECT agent_id, role, content FROM messages WHERE user_id = ? AND session_id = ? '
+            'ORDER BY timestamp, id', (user_id, session_id))
+        messages = []
+        for agent_id, role, content in rows:
+            content = json.loads(content)
+            if content and role == ParticipantRole.ASSISTANT.value and 'text' in content[0]:
+                content = [{'text': f"[{agent_id}] {content[0]['text']}"}]
+            messages.append(ConversationMessage(role=role, content=content))
+        return messages
+
+    async def flush(self) -> None:
+        """Wait until everything queued so far is committed."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put(([], future))
+        await future
+
+    def close(self) -> None:
+        """Commit what is queued, stop the writer and close all connections."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+
+    TOTAL_MESSAGES = 1_000_000
+    SESSIONS = 20_000
+    AGENTS = ['tech-agent', 'health-agent', 'weather-agent']
+    CONCURRENCY = 256
+    FETCHES = 20_000
+
+    def pair(i):
+        return [ConversationMessage(role=ParticipantRole.USER.value, content=[{'text': f"question {i} " * 8}]),
+                ConversationMessage(role=ParticipantRole.ASSISTANT.value, content=[{'text': f"answer {i} " * 30}])]
+
+    async def append(storage, pairs, concurrency):
+        async def worker(offset):
+            for i in range(offset, pairs, concurrency):
+                await storage.save_chat_messages(f"user{i % 1000}", f"session{i % SESSIONS}",
+                                                 AGENTS[i % len(AGENTS)], pair(i))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        await storage.flush()
+        return pairs * 2 / (time.perf_counter() - start)
+
+    async def fetch(storage, count, concurrency):
+        latencies = []
+
+        async def worker(offset):
+            for i in range(offset, count, concurrency):
+                s = random.randrange(SESSIONS)
+                t1 = time.perf_counter()
+                await storage.fetch_chat(f"user{s % 1000}", f"session{s}", AGENTS[s % len(AGENTS)], 20)
+                latencies.append(time.perf_counter() - t1)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return count / elapsed, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+    directory = tempfile.mkdtemp()
+
+    # write batching on/off on a small run, with an fsync per commit
+    for name, batch_size in (("one commit per save", 1), ("batched commits", 512)):
+        storage = SqliteChatStorage(SqliteChatStorageOptions(path=os.path.join(directory, f'batch{batch_size}.db'),
+                                                             batch_size=batch_size, synchronous='FULL'))
+        rate = asyncio.run(append(storage, 10_000, 64))
+        print(f"{name:<22} synchronous=FULL append {rate:>10,.0f} msg/s ({storage.batches} transactions)")
+        storage.close()
+
+    storage = SqliteChatStorage(SqliteChatStorageOptions(path=os.path.join(directory, 'chat_history.db')))
+    rate = asyncio.run(append(storage, TOTAL_MESSAGES // 2, CONCURRENCY))
+    size = os.path.getsize(storage.path) / 2**20
+    print(f"{TOTAL_MESSAGES:,} messages appended at {rate:,.0f} msg/s ({storage.batches} transactions, {size:.0f}MB)")
+    rate, p50, p99 = asyncio.run(fetch(storage, FETCHES, 32))
+    print(f"fetch last 20 at 1M rows: {rate:,.0f} fetch/s, p50 {p50:.2f}ms, p99 {p99:.2f}ms")
+    storage.close()
@@ -0,0 +1,570 @@
+"""
+Buffered token streaming for agent callbacks.
+
+The scripts stream with `print(token, end='', flush=True)` in
+on_llm_new_token, i.e. one write syscall per token, on whatever thread the
+agent happens to run (the event loop or a run_in_thread worker). With several
+streaming sessions that is thousands of tiny writes per second.
+
+BufferedTokenStream is an AgentCallbacks that only appends the token to a
+buffer. A delivery loop on its own thread takes the buffer as one chunk every
+`flush_interval` seconds, or as soon as it holds `flush_bytes`, and fans the
+chunk out to any number of consumers through one bounded asyncio queue per
+consumer:
+
+- stdout_consumer(): one write + flush per chunk instead of per token;
+- log_consumer(): the chunks as log records;
+- QueueConsumer: an async iterator to feed an SSE / websocket handler from its
+  own event loop.
+
+A slow consumer fills its queue, which stalls the delivery loop, which lets the
+buffer grow; once it holds `max_buffer_bytes` the producing thread blocks in
+on_llm_new_token until the consumer catches up (backpressure). That includes
+agents on a run_in_thread worker, whose loop serves only their request
+(runner.may_block()). A producer on an event loop shared by several requests
+cannot wait there without stalling the others, so once the buffer is full its
+tokens are dropped instead and counted in stats() as dropped_tokens /
+dropped_bytes. Either way the buffer stays bounded. Delivery runs on its own
+loop so output keeps flowing while boto3 blocks the agent's loop.
+
+    token_stream = BufferedTokenStream([stdout_consumer()])
+    agent = BedrockLLMAgent(BedrockLLMAgentOptions(..., streaming=True, callbacks=token_stream))
+    ...
+    token_stream.flush()  # before printing anything else
+    token_stream.close()
+
+Concurrent sessions sharing one print-style callback interleave character by
+character. StreamMultiplexer gives every agent a ContextCallbacks that tags
+tokens with (user_id, session_id, request_id, agent_name) and gives every
+request its own async iterator of chunks, so one event loop can push many streams to clients
+(see its docstring; 07 uses it for its parallel test).
+
+Run `python streaming.py` to compare write calls and producer time against
+per-token print with several concurrent streams, and for a multiplexed run of
+concurrent sessions against the stub Bedrock endpoint.
+"""
+import asyncio
+import contextvars
+import itertools
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from multi_agent_orchestrator.agents import AgentCallbacks
+from multi_agent_orchestrator.utils import Logger
+
+from runner import may_block
+
+# consumer(chunk) is awaited on the delivery loop; an optional `close` coroutine is awaited at shutdown
+Consumer = Callable[[str], Awaitable[None]]
+
+
+def stdout_consumer(stream: Optional[TextIO] = None) -> Consumer:
+    async def write(chunk: str) -> None:
+        out = stream or sys.stdout
+        out.write(chunk)
+        out.flush()
+    return write
+
+
+def log_consumer(prefix: str = '') -> Consumer:
+    async def log(chunk: str) -> None:
+        Logger.info(f"{prefix}{chunk}")
+    return log
+
+
+class QueueConsumer:
+    """Chunks as an async iterator on another event loop (an SSE or websocket handler).
+
+    Create it inside that loop (or pass `loop`); `async for chunk in consumer` ends when the stream closes.
+    """
+
+    def __init__(self, maxsize: int = 64, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    async def _put(self, item: Optional[str]) -> None:
+        if asyncio.get_running_loop() is self.loop:
+            await self.queue.put(item)
+        else:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop))
+
+    async def __call__(self, chunk: str) -> None:
+        await self._put(chunk)
+
+    async def close(self) -> None:
+        await self._put(None)
+
+    def __aiter__(self) -> 'QueueConsumer':
+        return self
+
+    async def __anext__(self) -> str:
+        chunk = await self.queue.get()
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+
+@dataclass
+class StreamOptions:
+    flush_interval: float = 0.02  # longest a token waits in the buffer, seconds
+    flush_bytes: int = 256  # flush as soon as the buffer holds this much
+    queue_size: int = 64  # chunks queued per consumer
+    max_buffer_bytes: int = 64 * 1024  # producers block above this, those on a shared event loop drop tokens
+
+
+class BufferedTokenStream(AgentCallbacks):
+    def __init__(self, consumers: List[Consumer], options: Optional[StreamOptions] = None):
+        self.consumers = list(consumers)
+        self.options = options or StreamOptions()
+        self._buffer: List[str] = []
+        self._buffered = 0
+        self._first_at = 0.0
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._closing = False
+        self._in_flight = False
+        self._overflowing = False
+        self.counts = {'tokens': 0, 'chunks': 0, 'bytes': 0, 'blocked_ms': 0.0, 'consumer_errors': 0,
+                       'dropped_tokens': 0, 'dropped_bytes': 0}
+
+        self._loop = asyncio.new_event_loop()
+        self._ready = asyncio.Event()  # buffer became non-empty (or closing)
+        self._due = asyncio.Event()  # buffer reached flush_bytes (or flush requested)
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='token-stream', daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._queues = [asyncio.Queue(maxsize=self.options.queue_size) for _ in self.consumers]
+        self._workers = [self._loop.create_task(self._deliver(consumer, queue))
+                         for consumer, queue in zip(self.consumers, self._queues)]
+        self._dispatcher = self._loop.create_task(self._dispatch())
+        self._started.set()
+        try:
+            self._loop.run_until_complete(self._dispatcher)
+        finally:
+            self._loop.close()
+
+    def on_llm_new_token(self, token: str) -> None:
+        if not token:
+            return
+        with self._lock:
+            if self._closing:
+                return
+            if self._buffered >= self.options.max_buffer_bytes:
+                if not may_block():
+                    # waiting here would stall every other request on the producer's loop
+                    if not self._overflowing:
+                        self._overflowing = True
+                        Logger.warn(f"[streaming] buffer full ({self._buffered} bytes), dropping tokens "
+                                    f"produced on a shared event loop until the consumers catch up")
+                    self.counts['dropped_tokens'] += 1
+                    self.counts['dropped_bytes'] += len(token)
+                    return
+                start = time.perf_counter()
+                while self._buffered >= self.options.max_buffer_bytes and not self._closing:
+                    self._space.wait()
+                self.counts['blocked_ms'] += (time.perf_counter() - start) * 1000
+            was_empty = not self._buffer
+            crossed = self._buffered < self.options.flush_bytes <= self._buffered + len(token)
+            self._buffer.append(token)
+            self._buffered += len(token)
+            self.counts['tokens'] += 1
+            if was_empty:
+                self._first_at = time.monotonic()
+                self._loop.call_soon_threadsafe(self._ready.set)
+            if crossed:
+                self._loop.call_soon_threadsafe(self._due.set)
+
+    def _take(self) -> str:
+        with self._lock:
+            chunk = ''.join(self._buffer)
+            self._buffer.clear()
+            self._buffered = 0
+            self._overflowing = False
+            self._ready.clear()
+            self._due.clear()
+            self._space.notify_all()
+            return chunk
+
+    async def _dispatch(self) -> None:
+        while True:
+            await self._ready.wait()
+            remaining = self._first_at + self.options.flush_interval - time.monotonic()
+            if not self._closing and remaining > 0:
+                try:
+                    await asyncio.wait_for(self._due.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            chunk = self._take()
+            if chunk:
+                self._in_flight = True
+                self.counts['chunks'] += 1
+                self.counts['bytes'] += len(chunk)
+                for queue in self._queues:
+                    await queue.put(chunk)
+                self._in_flight = False
+            if self._closing and not self._buffer:
+                break
+        for queue in self._queues:
+            await queue.put(None)
+        await asyncio.gather(*self._workers)
+
+    async def _deliver(self, consumer: Consumer, queue: asyncio.Queue) -> None:
+        while True:
+            chunk = await queue.get()
+            try:
+                if chunk is None:
+                    close = getattr(consumer, 'close', None)
+                    if close is not None:
+                        await close()
+                    return
+                await consumer(chunk)
+            except Exception as error:
+                self.counts['consumer_errors'] += 1
+                Logger.error(f"[streaming] consumer failed: {error}")
+            finally:
+                queue.task_done()
+
+    async def _drain(self) -> None:
+        while self._buffer or self._in_flight:
+            self._due.set()
+            self._ready.set()
+            await asyncio.sleep(0.001)
+        for queue in self._queues:
+            await queue.join()
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until every token written so far has been handed to all consumers."""
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Deliver what is buffered, close the consumers and stop the delivery thread."""
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._space.notify_all()
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._ready.set)
+        self._thread.join(timeout)
+
+    async def aclose(self) -> None:
+        """close() for callers on an event loop, which a QueueConsumer may need to keep running."""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {**self.counts, 'blocked_ms': round(self.counts['blocked_ms'], 1), 'buffered': self._buffered}
+        stats['tokens_per_chunk'] = round(stats['tokens'] / stats['chunks'], 1) if stats['chunks'] else 0.0
+        return stats
+
+    def __enter__(self) -> 'BufferedTokenStream':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# (user_id, session_id, request_id) of the request being processed, set by StreamMultiplexer.session()
+_stream_session: contextvars.ContextVar = contextvars.ContextVar('stream_session', default=None)
+
+
+@dataclass(frozen=True)
+class StreamContext:
+    user_id: str
+    session_id: str
+    agent_name: str
+    request_id: str = ''
+
+
+@dataclass
+class StreamChunk:
+    context: StreamContext
+    text: str
+
+
+class ContextCallbacks(AgentCallbacks):
+    """Callbacks of one agent: each token is passed on with the user, session, request and agent it belongs to."""
+
+    def __init__(self, multiplexer: 'StreamMultiplexer', agent_name: str):
+        self.multiplexer = multiplexer
+        self.agent_name = agent_name
+
+    def on_llm_new_token(self, token: str) -> None:
+        session = _stream_session.get()
+        if session is None:
+            self.multiplexer.counts['unrouted_tokens'] += 1
+            return
+        self.multiplexer.write(StreamContext(session[0], session[1], self.agent_name, session[2]), token)
+
+
+class SessionStream:
+    """Async iterator over the StreamChunks of one request of a (user, session); ends when it is closed."""
+
+    def __init__(self, multiplexer: 'StreamMultiplexer', user_id: str, session_id: str, request_id: str,
+                 loop: asyncio.AbstractEventLoop):
+        self.multiplexer = multiplexer
+        self.user_id = user_id
+        self.session_id = session_id
+        self.request_id = request_id
+        self.loop = loop  # the loop consuming this stream
+        # producer side, guarded by the multiplexer's lock
+        self.buffer: List[Tuple[str, str]] = []  # (agent_name, token)
+        self.buffered = 0
+        self.first_at = 0.0
+        # loop side
+        self.chunks: Deque[StreamChunk] = deque()
+        self.available = asyncio.Event()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.ended = False
+
+    def __aiter__(self) -> 'SessionStream':
+        return self
+
+    async def __anext__(self) -> StreamChunk:
+        while not self.chunks:
+            if self.ended and not self.buffered:
+                raise StopAsyncIteration
+            self.available.clear()
+            await self.available.wait()
+        chunk = self.chunks.popleft()
+        if self.buffered:
+            # the reader caught up: hand over whatever coalesced while the queue was full
+            self.multiplexer._flush(self)
+        return chunk
+
+
+class StreamMultiplexer:
+    """Per-request token streams for many concurrent requests, each consumed on the loop that opened it.
+
+    Every open() starts a stream with its own request id, so two requests of the
+    same session (two browser tabs, a retry) do not end each other's stream.
+    Tokens are tagged by ContextCallbacks, buffered per stream on the producing
+    thread and handed to its SessionStream on the stream's loop every
+    `flush_interval` / `flush_bytes`, one StreamChunk per run of tokens from the
+    same agent. When a reader lags `queue_size` chunks behind, new tokens keep
+    coalescing in its buffer; producer threads block once it holds
+    `max_buffer_bytes` (a producer on the stream's own loop cannot block, its
+    tokens are dropped and counted instead). Agents should run off the loop
+    (run_in_thread) so the loop is free to deliver while they stream.
+
+        multiplexer = StreamMultiplexer()
+        agent = BedrockLLMAgent(BedrockLLMAgentOptions(..., callbacks=multiplexer.callbacks('writer')))
+
+        stream = multiplexer.open(user_id, session_id)
+        with multiplexer.session(user_id, session_id, stream.request_id):
+            task = asyncio.ensure_future(run_in_thread(agent.process_request(...)))
+        task.add_done_callback(lambda _: multiplexer.close(user_id, session_id, stream.request_id))
+        async for chunk in stream:
+            ...  # push chunk.text to the client, labelled with chunk.context.agent_name
+    """
+
+    def __init__(self, options: Optional[StreamOptions] = None):
+        self.options = options or StreamOptions()
+        self._streams: Dict[Tuple[str, str, str], SessionStream] = {}
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self.counts = {'tokens': 0, 'chunks': 0, 'bytes': 0, 'blocked_ms': 0.0, 'unrouted_tokens': 0,
+                       'dropped_tokens': 0}
+
+    def callbacks(self, agent_name: str) -> ContextCallbacks:
+        return ContextCallbacks(self, agent_name)
+
+    @contextmanager
+    def session(self, user_id: str, session_id: str, request_id: str) -> Iterator[None]:
+        """Route the tokens of agents called inside the block (and their worker threads) to this request's stream."""
+        token = _stream_session.set((user_id, session_id, request_id))
+        try:
+            yield
+        finally:
+            _stream_session.reset(token)
+
+    def open(self, user_id: str, session_id: str, request_id: Optional[str] = None) -> SessionStream:
+        """The stream of one request (a new request id unless given); call on the loop that consumes it."""
+        request_id = request_id or uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            stream = self._streams.get((user_id, session_id, request_id))
+            if stream is None:
+                stream = self._streams[(user_id, session_id, request_id)] = \
+                    SessionStream(self, user_id, session_id, request_id, loop)
+            return stream
+
+    def write(self, context: StreamContext, token: str) -> None:
+        if not token:
+            return
+        with self._lock:
+            stream = self._streams.get((context.user_id, context.session_id, context.request_id))
+            if stream is None or stream.ended:
+                self.counts['unrouted_tokens'] += 1
+                return
+            if stream.buffered >= self.options.max_buffer_bytes:
+                if self._on_loop_thread(stream):
+                    self.counts['dropped_tokens'] += 1  # waiting would stall the loop that drains the buffer
+                    return
+                start = time.perf_counter()
+                while stream.buffered >= self.options.max_buffer_bytes and not stream.ended:
+                    self._space.wait()
+                self.counts['blocked_ms'] += (time.perf_counter() - start) * 1000
+            was_empty = not stream.buffer
+            crossed = stream.buffered < self.options.flush_bytes <= stream.buffered + len(token)
+            stream.buffer.append((context.agent_name, token))
+            stream.buffered += len(token)
+            self.counts['tokens'] += 1
+            if was_empty:
+                stream.first_at = time.monotonic()
+                stream.loop.call_soon_threadsafe(self._arm, stream)
+            if crossed:
+                stream.loop.call_soon_threadsafe(self._flush, stream)
+
+    @staticmethod
+    def _on_loop_thread(stream: SessionStream) -> bool:
+        try:
+            return asyncio.get_running_loop() is stream.loop
+        except RuntimeError:
+            return False
+
+    def _arm(self, stream: SessionStream) -> None:
+        if stream.timer is None:
+            delay = max(0.0, stream.first_at + self.options.flush_interval - time.monotonic())
+            stream.timer = stream.loop.call_later(delay, self._flush, stream)
+
+    def _flush(self, stream: SessionStream) -> None:
+        if stream.timer is not None:
+            stream.timer.cancel()
+            stream.timer = None
+        if len(stream.chunks) >= self.options.queue_size:
+            return  # backpressure: keep coalescing until the reader takes a chunk
+        with self._lock:
+            tokens, stream.buffer, stream.buffered = stream.buffer, [], 0
+            self._space.notify_all()
+        for agent_name, group in itertools.groupby(tokens, key=lambda item: item[0]):
+            text = ''.join(token for _, token in group)
+            stream.chunks.append(StreamChunk(StreamContext(stream.user_id, stream.session_id, agent_name,
+                                                           stream.request_id), text))
+            self.counts['chunks'] += 1
+            self.counts['bytes'] += len(text)
+        stream.available.set()
+
+    def close(self, user_id: str, session_id: str, request_id: str) -> None:
+        """End the request's stream after what is buffered; call on the consuming loop."""
+        with self._lock:
+            stream = self._streams.pop((user_id, session_id, request_id), None)
+            if stream is None:
+                return
+            stream.ended = True
+            self._space.notify_all()
+        self._flush(stream)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counts, 'blocked_ms': round(self.counts['blocked_ms'], 1), 'sessions': len(self._streams)}
+
+
+if __name__ == "__main__":
+    import io
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    SESSIONS, TOKENS = 4, 3000
+
+    class CountingStream(io.TextIOBase):
+        """A /dev/null stdout that counts the flushes reaching the file descriptor."""
+
+        def __init__(self):
+            self.target = open(os.devnull, 'w')
+            self.flushes = 0
+
+        def write(self, text):
+            return self.target.write(text)
+
+        def flush(self):
+            self.flushes += 1
+            self.target.flush()
+
+    def generate(on_token, session):
+        # an agent streaming a response token by token (~0.2ms apart)
+        for i in range(TOKENS):
+            on_token(f" s{session}t{i}")
+            if i % 10 == 0:
+                time.sleep(0.002)
+
+    def run(on_token):
+        t1 = time.perf_counter()
+        with ThreadPoolExecutor(SESSIONS) as pool:
+            list(pool.map(lambda session: generate(on_token, session), range(SESSIONS)))
+        return (time.perf_counter() - t1) * 1000
+
+    out = CountingStream()
+    ms = run(lambda token: print(token, end='', file=out, flush=True))
+    print(f"{SESSIONS} sessions x {TOKENS} tokens")
+    print(f"print(flush=True)      {ms:7.1f}ms  {out.flushes:6d} flushes")
+
+    out = CountingStream()
+    with BufferedTokenStream([stdout_consumer(out)]) as stream:
+        ms = run(stream.on_llm_new_token)
+        stream.flush()
+    print(f"BufferedTokenStream    {ms:7.1f}ms  {out.flushes:6d} flushes  {stream.stats()}")
+
+    async def slow_reader():
+        # an SSE client reading 50 chunks per second behind a small buffer
+        consumer = QueueConsumer(maxsize=4)
+        stream = BufferedTokenStream([consumer], StreamOptions(queue_size=4, max_buffer_bytes=4096))
+        received = 0
+
+        async def read():
+            nonlocal received
+            async for chunk in consumer:
+                received += len(chunk)
+                await asyncio.sleep(0.02)
+
+        reader = asyncio.ensure_future(read())
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [stream.on_llm_new_token('x' * 40) for _ in range(5000)])
+        await stream.aclose()
+        await reader
+        print(f"slow consumer          producer blocked {stream.stats()['blocked_ms']:.0f}ms, "
+              f"received {received} bytes, {stream.stats()}")
+
+    asyncio.run(slow_reader())
+
+    async def multiplexed():
+        from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+        from runner import run_in_thread
+        from stub_bedrock import StubBedrockServer
+
+        multiplexer = StreamMultiplexer()
+        with StubBedrockServer(latency=0.05) as server:
+            agent = BedrockLLMAgent(BedrockLLMAgentOptions(
+                name='writer', description='writes', model_id='us.amazon.nova-pro-v1:0', streaming=True,
+                client=server.client(), callbacks=multiplexer.callbacks('writer')))
+
+            async def serve(user_id):
+                # what a server handler does: start the request, push the session's chunks as they come
+                stream = multiplexer.open(user_id, 'session1')
+                with multiplexer.session(user_id, 'session1', stream.request_id):
+                    request = asyncio.ensure_future(run_in_thread(agent.process_request(
+                        f"write a long story for {user_id} " * 20, user_id, 'session1', [])))
+                received = []
+                request.add_done_callback(lambda _: multiplexer.close(user_id, 'session1', stream.request_id))
+                async for chunk in stream:
+                    assert chunk.context.user_id == user_id
+                    received.append(chunk.text)
+                response = await request
+                return ''.join(received) == response.content[0]['text'], len(received)
+
+            results = await asyncio.gather(*[serve(f'user{i}') for i in range(8)])
+        print(f"multiplexed: {len(results)} concurrent sessions, streams intact: {all(ok for ok, _ in results)}, "
+              f"chunks per session: {[n for _, n in results]}, {multiplexer.stats()}")
+
+    asyncio.run(multiplexed())
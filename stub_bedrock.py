@@ -0,0 +1,538 @@
+"""
+Local stand-in for the Bedrock endpoints used by the test scripts.
+
+Runs a small HTTP server that speaks enough of the bedrock-runtime REST API
+(Converse / ConverseStream, including prompt-cache accounting for cachePoint
+blocks) and of bedrock-agent-runtime (Retrieve against in-memory knowledge bases,
+InvokeAgent, InvokeInlineAgent) for boto3 clients to talk to it, so the
+orchestrator flows can be exercised and benchmarked without AWS access.
+
+Latency can be a fixed number of seconds or a distribution (uniform_latency,
+lognormal_latency); `tokens_per_second` paces generated tokens, `throttle_rate`
+and `max_concurrency` produce ThrottlingExceptions. Each call draws its latency
+and its throttle_rate decision from its own generator, seeded by `seed`, the
+request (path and body) and how many identical requests came before it, so the
+draws do not depend on how concurrent calls interleave. What depends on timing
+(max_concurrency throttling, and so the retries and traffic that follow) can
+still differ between runs. scripted_responder() turns a list of ScriptRules into
+tool-use conversations
+scripted_responder() turns a list of ScriptRules into tool-use conversations
+(classifier picks, supervisor hand-offs, tool calls, final answers).
+
+    server = StubBedrockServer(latency=lognormal_latency(0.3), tokens_per_second=80, seed=1).start()
+    client = server.client('bedrock-runtime')
+    ...
+    server.stop()
+
+Existing scripts can be pointed at it without code changes through boto3's
+AWS_ENDPOINT_URL_BEDROCK_RUNTIME / AWS_ENDPOINT_URL_BEDROCK_AGENT_RUNTIME
+environment variables (see load_test.py).
+"""
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import unquote
+
+import boto3
+from botocore.config import Config
+
+# responder(model_id, request_body) -> Converse content blocks
+Responder = Callable[[str, Dict[str, Any]], List[Dict[str, Any]]]
+# knowledge base id -> passages: {'text': ..., 'uri': optional, 'metadata': optional}
+KnowledgeBases = Dict[str, List[Dict[str, Any]]]
+# seconds, or a distribution drawing seconds from the call's seeded random generator
+Latency = Union[float, Callable[[random.Random], float]]
+
+
+def uniform_latency(low: float, high: float) -> Callable[[random.Random], float]:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal_latency(median: float, sigma: float = 0.5, cap: Optional[float] = None) -> Callable[[random.Random], float]:
+    """Right-skewed latency with the given median; sigma 0.5 puts p99 at about 3.2x the median."""
+    def draw(rng: random.Random) -> float:
+        value = rng.lognormvariate(math.log(median), sigma)
+        return min(value, cap) if cap is not None else value
+    return draw
+
+
+def _last_user_text(body: Dict[str, Any]) -> str:
+    for message in reversed(body.get('messages', [])):
+        if message.get('role') == 'user':
+            for block in message.get('content', []):
+                if 'text' in block:
+                    return block['text']
+    return ''
+
+
+def _system_text(body: Dict[str, Any]) -> str:
+    return '\n'.join(block.get('text', '') for block in body.get('system', []))
+
+
+def _tool_names(body: Dict[str, Any]) -> List[str]:
+    tools = (body.get('toolConfig') or {}).get('tools', [])
+    return [tool['toolSpec']['name'] for tool in tools if 'toolSpec' in tool]
+
+
+def pick_agent(system_prompt: str, user_input: str) -> str:
+    """Pick the agent from a classifier prompt whose description shares the most words with the input."""
+    agents_block = re.search(r'<agents>(.*?)</agents>', system_prompt, re.S)
+    if not agents_block:
+        return 'unknown'
+    words = set(re.findall(r'\w+', user_input.lower()))
+    best, best_score = 'unknown', -1
+    for line in agents_block.group(1).strip().split('\n\n'):
+        agent_id, _, description = line.partition(':')
+        score = len(words & set(re.findall(r'\w+', description.lower())))
+        if score > best_score:
+            best, best_score = agent_id.strip(), score
+    return best
+
+
+def default_responder(model_id: str, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Answer classifier calls with a tool use and everything else with a canned reply."""
+    user_text = _last_user_text(body)
+    if 'analyzePrompt' in _tool_names(body):
+        return [{'toolUse': {
+            'toolUseId': 'tooluse_stub_classifier',
+            'name': 'analyzePrompt',
+            'input': {
+                'userinput': user_text,
+                'selected_agent': pick_agent(_system_text(body), user_text),
+                'confidence': 0.9,
+            },
+        }}]
+    return [{'text': f"This is a stub reply from {model_id} to: {user_text[:200]}"}]
+
+
+def tool_use(name: str, tool_input: Dict[str, Any], tool_use_id: Optional[str] = None) -> Dict[str, Any]:
+    return {'toolUse': {'toolUseId': tool_use_id or f'tooluse_{name}', 'name': name, 'input': tool_input}}
+
+
+def turn_tool_results(body: Dict[str, Any]) -> int:
+    """toolResult blocks sent since the last user text message, i.e. tool rounds in the current turn."""
+    count = 0
+    for message in reversed(body.get('messages', [])):
+        blocks = message.get('content', [])
+        if message.get('role') == 'user' and any('text' in block for block in blocks) \
+                and not any('toolResult' in block for block in blocks):
+            break
+        count += sum(1 for block in blocks if 'toolResult' in block)
+    return count
+
+
+@dataclass
+class ScriptRule:
+    """Reply with `reply` (content blocks, or responder(model_id, body)) when every given condition holds."""
+    reply: Union[List[Dict[str, Any]], Responder]
+    tool: Optional[str] = None  # the request offers this tool ('*' = any tool but the classifier's)
+    step: Optional[int] = None  # tool rounds already done in this turn, see turn_tool_results()
+    contains: Optional[str] = None  # regex searched in the last user text
+    model: Optional[str] = None  # substring of the model id
+
+    def matches(self, model_id: str, body: Dict[str, Any]) -> bool:
+        tools = _tool_names(body)
+        if self.tool == '*' and not [name for name in tools if name != 'analyzePrompt']:
+            return False
+        if self.tool not in (None, '*') and self.tool not in tools:
+            return False
+        if self.step is not None and turn_tool_results(body) != self.step:
+            return False
+        if self.contains is not None and not re.search(self.contains, _last_user_text(body), re.I):
+            return False
+        return self.model is None or self.model in model_id
+
+
+def scripted_responder(rules: List[ScriptRule], fallback: Optional[Responder] = None) -> Responder:
+    """A responder answering with the first matching rule, else with fallback (default_responder)."""
+    fallback = fallback or default_responder
+
+    def respond(model_id: str, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        for rule in rules:
+            if rule.matches(model_id, body):
+                return rule.reply(model_id, body) if callable(rule.reply) else rule.reply
+        return fallback(model_id, body)
+    return respond
+
+
+def delegate_to_team(model_id: str, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """A supervisor lead's send_messages to every agent listed in its prompt's <agents> block."""
+    agents_block = re.search(r'<agents>(.*?)</agents>', _system_text(body), re.S)
+    names = [line.partition(':')[0].strip() for line in (agents_block.group(1) if agents_block else '').split('\n')
+             if ':' in line]
+    task = _last_user_text(body)[:200]
+    return [tool_use('send_messages', {'messages': [{'recipient': name, 'content': task} for name in names]})]
+
+
+def call_first_tool(model_id: str, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """A toolUse of the first offered tool, with a placeholder for each required (or the first) argument."""
+    spec = next(tool['toolSpec'] for tool in body['toolConfig']['tools']
+                if 'toolSpec' in tool and tool['toolSpec']['name'] != 'analyzePrompt')
+    schema = spec.get('inputSchema', {}).get('json', {})
+    properties = schema.get('properties', {})
+    names = schema.get('required') or list(properties)[:1]
+    arguments = {}
+    for name in names:
+        prop = properties.get(name, {})
+        arguments[name] = prop['enum'][0] if prop.get('enum') else \
+            [] if prop.get('type') == 'array' else 'TSLA'
+    return [tool_use(spec['name'], arguments, f"tooluse_{spec['name']}_{turn_tool_results(body)}")]
+
+
+def encode_event(event_type: str, payload: Dict[str, Any]) -> bytes:
+    """Encode one message in the AWS event stream wire format."""
+    headers = b''
+    for name, value in ((':event-type', event_type),
+                        (':content-type', 'application/json'),
+                        (':message-type', 'event')):
+        name_bytes, value_bytes = name.encode(), value.encode()
+        headers += struct.pack('!B', len(name_bytes)) + name_bytes
+        headers += struct.pack('!BH', 7, len(value_bytes)) + value_bytes
+    body = json.dumps(payload).encode()
+    prelude = struct.pack('!II', 12 + len(headers) + len(body) + 4, len(headers))
+    prelude += struct.pack('!I', zlib.crc32(prelude) & 0xffffffff)
+    message = prelude + headers + body
+    return message + struct.pack('!I', zlib.crc32(message) & 0xffffffff)
+
+
+def _split_tokens(text: str) -> List[str]:
+    return re.findall(r'\S+\s*|\s+', text) or ['']
+
+
+def _usage(body: Dict[str, Any], content: List[Dict[str, Any]]) -> Dict[str, int]:
+    input_tokens = len(json.dumps(body.get('messages', []))) // 4 + len(_system_text(body)) // 4
+    output_tokens = sum(len(block.get('text', json.dumps(block.get('toolUse', {})))) // 4
+                        for block in content)
+    return {'inputTokens': input_tokens,
+            'outputTokens': output_tokens,
+            'totalTokens': input_tokens + output_tokens}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: 'StubBedrockServer'
+    _gone = False  # the client closed the connection mid-response
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length)
+        body = json.loads(raw_body or b'{}')
+        path = unquote(self.path.split('?')[0])
+        self.rng = self.server.request_random(path, raw_body)
+        self.server.request_count += 1
+        self.server.request_bytes += length
+
+        kb_match = re.fullmatch(r'/knowledgebases/([^/]+)/retrieve', path)
+        if kb_match:
+            self._retrieve(kb_match.group(1), body)
+            return
+
+        agent_match = re.fullmatch(r'/agents/([^/]+)/agentAliases/([^/]+)/sessions/([^/]+)/text', path)
+        if agent_match:
+            agent_id, _, session_id = agent_match.groups()
+            self._invoke_agent(session_id, f"Agent {agent_id} reply to: {body.get('inputText', '')[:200]}")
+            return
+
+        inline_agent_match = re.fullmatch(r'/agents/([^/]+)', path)
+        if inline_agent_match:
+            self._invoke_agent(inline_agent_match.group(1),
+                               f"Inline agent reply to: {body.get('inputText', '')[:200]}")
+            return
+
+        match = re.fullmatch(r'/model/(.+)/(converse|converse-stream)', path)
+        if not match:
+            self._send_json(404, {'message': f'No stub route for {path}'})
+            return
+
+        if not self.server.enter(self.rng):
+            self._send_throttle()
+            return
+        try:
+            model_id, operation = match.groups()
+            content = self.server.responder(model_id, body)
+            latency = self.server.sample_latency(self.rng)
+            if operation == 'converse':
+                # the whole answer is generated before anything is returned
+                time.sleep(latency + self.server.generation_time(content))
+                self._converse(body, content, latency)
+            else:
+                time.sleep(latency)
+                self._converse_stream(body, content, latency)
+        finally:
+            self.server.leave()
+
+    def _retrieve(self, knowledge_base_id: str, body: Dict[str, Any]):
+        if knowledge_base_id not in self.server.knowledge_bases:
+            self._send_json(404, {'message': f'Knowledge base {knowledge_base_id} not found'})
+            return
+        if not self.server.enter(self.rng):
+            self._send_throttle()
+            return
+        try:
+            config = (body.get('retrievalConfiguration') or {}).get('vectorSearchConfiguration') or {}
+            results = self.server.search_knowledge_base(
+                knowledge_base_id, body.get('retrievalQuery', {}).get('text', ''), config.get('numberOfResults', 5))
+            time.sleep(self.server.sample_latency(self.rng))
+            self._send_json(200, {'retrievalResults': results})
+        finally:
+            self.server.leave()
+
+    def _invoke_agent(self, session_id: str, text: str):
+        """InvokeAgent / InvokeInlineAgent: text streamed back as `chunk` events."""
+        if not self.server.enter(self.rng):
+            self._send_throttle()
+            return
+        try:
+            with self.server._lock:
+                self.server.agent_sessions[session_id] = self.server.agent_sessions.get(session_id, 0) + 1
+            time.sleep(self.server.sample_latency(self.rng))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+            self.send_header('x-amz-bedrock-agent-session-id', session_id)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for token in _split_tokens(text):
+                if self.server.token_interval:
+                    time.sleep(self.server.token_interval)
+                if not self._write_chunk(encode_event('chunk', {'bytes': base64.b64encode(token.encode()).decode()})):
+                    return
+            self._write_chunk(b'')  # last chunk
+        finally:
+            self.server.leave()
+
+    def _send_throttle(self):
+        data = json.dumps({'message': 'Too many requests, please wait before trying again.'}).encode()
+        self.send_response(429)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('x-amzn-ErrorType', 'ThrottlingException')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _converse(self, body: Dict[str, Any], content: List[Dict[str, Any]], latency: float):
+        self._send_json(200, {
+            'output': {'message': {'role': 'assistant', 'content': content}},
+            'stopReason': 'tool_use' if any('toolUse' in block for block in content) else 'end_turn',
+            'usage': {**_usage(body, content), **self.server.prompt_cache_usage(body)},
+            'metrics': {'latencyMs': int((latency + self.server.generation_time(content)) * 1000)},
+        })
+
+    def _write_chunk(self, data: bytes) -> bool:
+        """Write one chunk; False once the client has hung up (e.g. a hedge loser closed its stream)."""
+        if self._gone:
+            return False
+        try:
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self._gone = True
+            self.close_connection = True
+            return False
+        return True
+
+    def _converse_stream(self, body: Dict[str, Any], content: List[Dict[str, Any]], latency: float):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        self._write_chunk(encode_event('messageStart', {'role': 'assistant'}))
+        for index, block in enumerate(content):
+            if 'toolUse' in block:
+                tool_use = block['toolUse']
+                self._write_chunk(encode_event('contentBlockStart', {
+                    'contentBlockIndex': index,
+                    'start': {'toolUse': {'toolUseId': tool_use['toolUseId'], 'name': tool_use['name']}},
+                }))
+                self._write_chunk(encode_event('contentBlockDelta', {
+                    'contentBlockIndex': index,
+                    'delta': {'toolUse': {'input': json.dumps(tool_use.get('input', {}))}},
+                }))
+            else:
+                for token in _split_tokens(block.get('text', '')):
+                    if self.server.token_interval:
+                        time.sleep(self.server.token_interval)
+                    if not self._write_chunk(encode_event('contentBlockDelta', {
+                        'contentBlockIndex': index,
+                        'delta': {'text': token},
+                    })):
+                        return
+            self._write_chunk(encode_event('contentBlockStop', {'contentBlockIndex': index}))
+
+        stop_reason = 'tool_use' if any('toolUse' in block for block in content) else 'end_turn'
+        self._write_chunk(encode_event('messageStop', {'stopReason': stop_reason}))
+        self._write_chunk(encode_event('metadata', {
+            'usage': {**_usage(body, content), **self.server.prompt_cache_usage(body)},
+            'metrics': {'latencyMs': int((latency + self.server.generation_time(content)) * 1000)},
+        }))
+        self._write_chunk(b'')  # last chunk
+
+
+class StubBedrockServer(ThreadingHTTPServer):
+    """In-process HTTP stub for bedrock-runtime and bedrock-agent-runtime.
+
+    Args:
+        latency: Seconds before the first byte of each call, or a distribution (uniform_latency, lognormal_latency).
+        token_delay: Seconds between streamed tokens.
+        responder: Callable producing the Converse content blocks for a request.
+        max_concurrency: Calls in flight above this limit get a ThrottlingException (429).
+        knowledge_bases: Passages served by Retrieve, ranked by word overlap with the query.
+        tokens_per_second: Generation speed; paces streamed tokens (instead of token_delay) and delays Converse.
+        throttle_rate: Share of calls rejected with a ThrottlingException regardless of load.
+        seed: Seed of the per-call generators behind latency distributions and throttle_rate.
+        port: Port to listen on, 0 picks a free one.
+    """
+    daemon_threads = True
+
+    def __init__(self,
+                 latency: Latency = 0.0,
+                 token_delay: float = 0.0,
+                 responder: Optional[Responder] = None,
+                 max_concurrency: Optional[int] = None,
+                 knowledge_bases: Optional[KnowledgeBases] = None,
+                 tokens_per_second: Optional[float] = None,
+                 throttle_rate: float = 0.0,
+                 seed: int = 0,
+                 host: str = '127.0.0.1',
+                 port: int = 0):
+        super().__init__((host, port), _StubHandler)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.responder: Responder = responder or default_responder
+        self.max_concurrency = max_concurrency
+        self.tokens_per_second = tokens_per_second
+        self.throttle_rate = throttle_rate
+        self.seed = seed
+        self._request_counts: Dict[str, int] = {}  # request digest -> calls seen
+        self.knowledge_bases: KnowledgeBases = knowledge_bases or {}
+        self._kb_terms = {kb_id: [set(re.findall(r'\w+', passage['text'].lower())) for passage in passages]
+                          for kb_id, passages in self.knowledge_bases.items()}
+        self.request_count = 0
+        self.request_bytes = 0
+        self.agent_sessions: Dict[str, int] = {}  # InvokeAgent / InvokeInlineAgent calls per sessionId
+        self._prompt_cache: set = set()
+        self.throttled_count = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def token_interval(self) -> float:
+        if self.tokens_per_second:
+            return 1.0 / self.tokens_per_second
+        return self.token_delay
+
+    def request_random(self, path: str, body: bytes) -> random.Random:
+        """Generator for one call, seeded by (seed, path + body, number of identical calls before it)."""
+        digest = hashlib.sha1(path.encode() + b'\0' + body).hexdigest()
+        with self._lock:
+            index = self._request_counts.get(digest, 0)
+            self._request_counts[digest] = index + 1
+        seed = hashlib.sha1(f'{self.seed}:{digest}:{index}'.encode()).digest()
+        return random.Random(int.from_bytes(seed[:8], 'big'))
+
+    def sample_latency(self, rng: random.Random) -> float:
+        if not callable(self.latency):
+            return self.latency
+        return max(0.0, self.latency(rng))
+
+    def generation_time(self, content: List[Dict[str, Any]]) -> float:
+        """Time to generate the text of content at tokens_per_second (0 when unset)."""
+        if not self.tokens_per_second:
+            return 0.0
+        tokens = sum(len(_split_tokens(block['text'])) for block in content if 'text' in block)
+        return tokens / self.tokens_per_second
+
+    def enter(self, rng: random.Random) -> bool:
+        """Admit a call, or count it as throttled (max_concurrency calls already running, or throttle_rate)."""
+        throttled = bool(self.throttle_rate) and rng.random() < self.throttle_rate
+        with self._lock:
+            if throttled or (self.max_concurrency is not None and self.in_flight >= self.max_concurrency):
+                self.throttled_count += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def prompt_cache_usage(self, body: Dict[str, Any]) -> Dict[str, int]:
+        """cacheRead/cacheWrite token counts for the system prompt prefix before a cachePoint block."""
+        system = body.get('system', [])
+        cut = next((i for i, block in enumerate(system) if 'cachePoint' in block), None)
+        if cut is None:
+            return {}
+        prefix = json.dumps(system[:cut], sort_keys=True)
+        key = hashlib.sha1(prefix.encode()).hexdigest()
+        with self._lock:
+            hit = key in self._prompt_cache
+            self._prompt_cache.add(key)
+        return {'cacheReadInputTokens' if hit else 'cacheWriteInputTokens': len(prefix) // 4}
+
+    def search_knowledge_base(self, knowledge_base_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+        """Retrieve results for the passages sharing the most words with the query."""
+        words = set(re.findall(r'\w+', query.lower()))
+        scores = [(len(words & terms) / (len(words) or 1), i)
+                  for i, terms in enumerate(self._kb_terms[knowledge_base_id])]
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        passages = self.knowledge_bases[knowledge_base_id]
+        return [{
+            'content': {'text': passages[i]['text'], 'type': 'TEXT'},
+            'location': {'type': 'S3', 's3Location': {
+                'uri': passages[i].get('uri', f's3://{knowledge_base_id.lower()}/doc-{i}.txt')}},
+            'metadata': passages[i].get('metadata', {}),
+            'score': round(score, 4),
+        } for score, i in scores[:limit]]
+
+    def start(self) -> 'StubBedrockServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def client(self, service_name: str = 'bedrock-runtime', region_name: str = 'us-east-1', **kwargs):
+        """Create a boto3 client pointed at this stub with dummy credentials."""
+        kwargs.setdefault('config', Config(retries={'total_max_attempts': 1}))
+        return boto3.client(service_name,
+                            region_name=region_name,
+                            endpoint_url=self.endpoint_url,
+                            aws_access_key_id='stub',
+                            aws_secret_access_key='stub',
+                            **kwargs)
+
+    def __enter__(self) -> 'StubBedrockServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,111 @@
+"""
+Small text helpers shared by the local caches and classifiers.
+
+Everything here is pure Python and CPU-only: text normalization and a hashed
+character/word n-gram embedding that works for both English and Chinese input
+without a tokenizer or a remote embedding model.
+"""
+import math
+import re
+import unicodedata
+import zlib
+from typing import Dict, Iterable, Tuple
+
+SparseVector = Dict[int, float]
+
+DEFAULT_DIM = 1 << 18
+
+# common English function words, dropped by strip_stopwords() before routing features
+STOPWORDS = frozenset("""
+a about an and are as at be been but by can could do does for from how i in is it its me my of on or
+please should so some than that the their them then there these this to tell was we what when where
+which who why will with would you your
+""".split())
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_PUNCT_RE = re.compile(r'[^\w\s]', re.UNICODE)
+# a sentence ends at . ! ? followed by whitespace, at a CJK terminator, or at a newline
+_SENTENCE_RE = re.compile(r'.+?(?:[.!?]+[\'"”’)\]]*(?=\s|$)|[。！？]+[」”’]*|\n|$)\s*', re.S)
+
+
+def normalize_text(text: str) -> str:
+    """Case-fold, NFKC-normalize, drop punctuation and collapse whitespace."""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = _PUNCT_RE.sub(' ', text)
+    return ' '.join(text.split())
+
+
+def tokenize(text: str) -> list[str]:
+    return _WORD_RE.findall(normalize_text(text))
+
+
+def strip_stopwords(text: str) -> str:
+    return ' '.join(word for word in tokenize(text) if word not in STOPWORDS)
+
+
+def split_sentences(text: str, min_chars: int = 0) -> list[str]:
+    """Split text into sentence chunks of at least min_chars (the last one may be shorter).
+
+    Trailing whitespace stays on each chunk, so ''.join(chunks) == text.
+    """
+    chunks: list[str] = []
+    current = ''
+    for match in _SENTENCE_RE.finditer(text or ''):
+        current += match.group()
+        if len(current.strip()) >= min_chars:
+            chunks.append(current)
+            current = ''
+    if current.strip() or (current and not chunks):
+        chunks.append(current)
+    elif current:
+        chunks[-1] += current
+    return chunks
+
+
+def ngram_features(text: str, ngram_range: Tuple[int, int] = (2, 4)) -> Iterable[str]:
+    """Yield word unigrams plus character n-grams of the normalized text."""
+    normalized = normalize_text(text)
+    for word in normalized.split():
+        yield f'w:{word}'
+    padded = f' {normalized} '
+    low, high = ngram_range
+    for n in range(low, high + 1):
+        for i in range(len(padded) - n + 1):
+            yield f'c:{padded[i:i + n]}'
+
+
+def _bucket(feature: str, dim: int) -> int:
+    return zlib.crc32(feature.encode('utf-8')) % dim
+
+
+def hashed_counts(text: str, dim: int = DEFAULT_DIM, ngram_range: Tuple[int, int] = (2, 4)) -> SparseVector:
+    counts: SparseVector = {}
+    for feature in ngram_features(text, ngram_range):
+        index = _bucket(feature, dim)
+        counts[index] = counts.get(index, 0.0) + 1.0
+    return counts
+
+
+def l2_normalize(vector: SparseVector) -> SparseVector:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if not norm:
+        return vector
+    return {k: v / norm for k, v in vector.items()}
+
+
+def hashed_ngram_vector(text: str, dim: int = DEFAULT_DIM, ngram_range: Tuple[int, int] = (2, 4)) -> SparseVector:
+    """L2-normalized sparse embedding from hashed n-gram counts (sublinear tf)."""
+    counts = hashed_counts(text, dim, ngram_range)
+    return l2_normalize({k: 1.0 + math.log(v) for k, v in counts.items()})
+
+
+def cosine(a: SparseVector, b: SparseVector) -> float:
+    """Dot product of two sparse vectors (cosine if both are L2-normalized)."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt-token count (about 4 characters per token) for savings reports."""
+    return (len(text or '') + 3) // 4
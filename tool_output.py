@@ -0,0 +1,248 @@
+"""
+Chunked retrieval for oversized tool outputs.
+
+A tool that returns a whole web page or a long report pushes all of it into the
+conversation, and it stays there for every following model call of the turn.
+ChunkedAgentTool post-processes the result of any AgentTool: when it is longer
+than `max_chars` it is split into sentence-aligned chunks, the `top_k` chunks
+most relevant to the call's query (local BM25, or a hashed n-gram embedding for
+text without word boundaries such as Chinese) are returned in page order, and
+the whole output is kept in a ToolOutputStore behind a short handle. The agent
+reads more of it on demand with the store's `read_tool_output` tool, by chunk
+numbers or by a new query.
+
+    outputs = ToolOutputStore()
+    news_tool = ChunkedAgentTool(AgentTool(name="get_news", func=get_news), outputs,
+                                 ToolOutputOptions(max_chars=4000, top_k=3))
+    tools = AsyncAgentTools([news_tool, outputs.tool()])
+
+    with outputs.session(user_id, session_id):
+        response = await orchestrator.route_request(user_input, user_id, session_id, {})
+
+Handles are random and belong to the (user, session) they were created in, so
+one session cannot page in another session's outputs by guessing a handle.
+
+WebSearch (web_search.py) can also put the full text of every page it returns
+into a store, so its compact snippets come with a handle to the rest of the page.
+
+Run `python tool_output.py` to see how much of a long output reaches the model.
+"""
+import contextvars
+import json
+import math
+import secrets
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from multi_agent_orchestrator.utils import AgentTool
+
+from text_utils import cosine, estimate_tokens, hashed_ngram_vector, split_sentences, tokenize
+from tool_utils import ToolResultCache, call_tool, report_tool_metric
+
+
+def chunk_text(text: str, chunk_chars: int = 800) -> List[str]:
+    """Sentence-aligned chunks of about chunk_chars; sentences longer than that are cut."""
+    chunks: List[str] = []
+    for chunk in split_sentences(text, chunk_chars):
+        while len(chunk) > 2 * chunk_chars:
+            chunks.append(chunk[:chunk_chars])
+            chunk = chunk[chunk_chars:]
+        chunks.append(chunk)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+class BM25:
+    """Okapi BM25 over a small, fixed set of documents."""
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(terms.values()) for terms in self.terms]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        frequencies = Counter(term for terms in self.terms for term in terms)
+        total = len(documents)
+        self.idf = {term: math.log(1 + (total - n + 0.5) / (n + 0.5)) for term, n in frequencies.items()}
+
+    def scores(self, query: str) -> List[float]:
+        query_terms = set(tokenize(query))
+        scores = []
+        for terms, length in zip(self.terms, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.average_length) if self.average_length else self.k1
+            scores.append(sum(self.idf[term] * terms[term] * (self.k1 + 1) / (terms[term] + norm)
+                              for term in query_terms if term in terms))
+        return scores
+
+
+def rank_chunks(chunks: List[str], query: str, scorer: str = 'bm25') -> List[int]:
+    """Chunk indexes, most relevant to the query first (ties keep page order)."""
+    if not query.strip():
+        return list(range(len(chunks)))
+    if scorer == 'bm25':
+        scores = BM25(chunks).scores(query)
+    elif scorer == 'hashed':
+        query_vector = hashed_ngram_vector(query)
+        scores = [cosine(query_vector, hashed_ngram_vector(chunk)) for chunk in chunks]
+    else:
+        raise ValueError(f"Unknown scorer '{scorer}', expected 'bm25' or 'hashed'")
+    return sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+
+
+def render_chunks(handle: str, chunks: List[str], indexes: List[int]) -> str:
+    return '\n\n'.join(f"[{handle} chunk {i + 1}/{len(chunks)}]\n{chunks[i]}" for i in sorted(indexes))
+
+
+class ToolOutputStore:
+    """Chunked tool outputs kept behind short random handles ('out-3f9a2c1b'), LRU with a TTL.
+
+    Outputs stored inside session() can only be read inside a session() for the
+    same user and session; outputs stored outside one only outside one.
+
+    Args:
+        ttl: Seconds a stored output can still be paged in.
+        max_entries: Outputs kept at most.
+        top_k: Chunks returned by a query-based page-in.
+        scorer: 'bm25' or 'hashed', used for query-based page-ins.
+    """
+
+    def __init__(self, ttl: Optional[float] = 3600, max_entries: int = 256, top_k: int = 3, scorer: str = 'bm25'):
+        self.outputs = ToolResultCache(ttl, max_entries)
+        self.top_k = top_k
+        self.scorer = scorer
+        # (user_id, session_id) the tools of the current request store and read under
+        self._session: contextvars.ContextVar = contextvars.ContextVar('tool_output_session', default=())
+
+    @contextmanager
+    def session(self, user_id: str, session_id: str) -> Iterator[None]:
+        """Store and read outputs of the enclosed request under this user's session."""
+        token = self._session.set((user_id, session_id))
+        try:
+            yield
+        finally:
+            self._session.reset(token)
+
+    def _key(self, handle: str) -> str:
+        return json.dumps([*self._session.get(), handle.strip()])
+
+    def put(self, chunks: List[str], source: str = '') -> str:
+        handle = f'out-{secrets.token_hex(4)}'
+        self.outputs.put(self._key(handle), (source, chunks))
+        return handle
+
+    def get(self, handle: str) -> Optional[Tuple[str, List[str]]]:
+        found, entry = self.outputs.get(self._key(handle))
+        return entry if found else None
+
+    def page_in(self, handle: str, chunks: str = '', query: str = '') -> str:
+        entry = self.get(handle)
+        if entry is None:
+            return f"No stored output with handle '{handle}' (it may have expired); run the tool again."
+        source, stored = entry
+        if chunks.strip():
+            try:
+                indexes = {int(part) - 1 for part in chunks.replace(',', ' ').split()}
+            except ValueError:
+                return f"chunks must be chunk numbers such as '2, 5', got '{chunks}'"
+            indexes = [i for i in indexes if 0 <= i < len(stored)]
+            if not indexes:
+                return f"{handle} has chunks 1 to {len(stored)}."
+        else:
+            indexes = rank_chunks(stored, query, self.scorer)[:self.top_k]
+        header = f"From {source}:\n" if source else ''
+        return header + render_chunks(handle, stored, indexes)
+
+    def tool(self, name: str = 'read_tool_output') -> AgentTool:
+        """AgentTool the agent uses to page in more of a stored output."""
+        def read_tool_output(handle: str, chunks: str = '', query: str = '') -> str:
+            """Read more of a long tool output that was returned only in part, using the handle shown with it.
+
+            :param handle: the handle shown with the partial output, e.g. out-3f9a2c1b
+            :param chunks: comma separated chunk numbers to read, e.g. 4, 5
+            :param query: when no chunk numbers are given, the chunks most relevant to this query are returned
+            """
+            return self.page_in(handle, chunks, query)
+        return AgentTool(name=name, func=read_tool_output, required=['handle'])
+
+
+@dataclass
+class ToolOutputOptions:
+    max_chars: int = 4000  # outputs up to this size are returned unchanged
+    chunk_chars: int = 800
+    top_k: int = 3  # chunks returned with the first response
+    scorer: str = 'bm25'  # 'bm25' or 'hashed' (character n-grams, for CJK text)
+    query_fn: Optional[Callable[[Dict[str, Any]], str]] = None  # relevance query from the call arguments
+
+
+class ChunkedAgentTool(AgentTool):
+    """AgentTool that returns only the most relevant chunks of an oversized result.
+
+    Args:
+        tool: The tool to wrap; its name, description and schema are reused.
+        store: Where the full output is kept for read_tool_output.
+        options: Size threshold, chunking and ranking.
+    """
+
+    def __init__(self, tool: AgentTool, store: ToolOutputStore, options: Optional[ToolOutputOptions] = None):
+        self.tool = tool
+        self.store = store
+        self.options = options or ToolOutputOptions()
+        super().__init__(name=tool.name,
+                         description=tool.func_description,
+                         properties=tool.properties,
+                         required=tool.required,
+                         func=self._call)
+
+    def _query(self, arguments: Dict[str, Any]) -> str:
+        if self.options.query_fn is not None:
+            return self.options.query_fn(arguments)
+        return ' '.join(str(value) for value in arguments.values() if isinstance(value, str))
+
+    async def _call(self, **kwargs: Any) -> Any:
+        result = await call_tool(self.tool, kwargs)
+        text = result if isinstance(result, str) else str(result)
+        if len(text) <= self.options.max_chars:
+            return result
+        chunks = chunk_text(text, self.options.chunk_chars)
+        ranked = rank_chunks(chunks, self._query(kwargs), self.options.scorer)
+        handle = self.store.put(chunks, source=f"{self.name}({self._query(kwargs)})")
+        output = render_chunks(handle, chunks, ranked[:self.options.top_k])
+        hidden = len(chunks) - min(self.options.top_k, len(chunks))
+        if hidden:
+            output += (f"\n\n[{hidden} more chunks of this output are stored under handle {handle}; "
+                       f"call read_tool_output with the handle and chunk numbers or a query to read them]")
+        report_tool_metric(self.name, 'chunked')
+        report_tool_metric(self.name, 'tokens_saved', max(0, estimate_tokens(text) - estimate_tokens(output)))
+        return output
+
+
+if __name__ == "__main__":
+    import asyncio
+    import random
+
+    random.seed(3)
+    TOPICS = ['pricing', 'latency', 'memory', 'routing', 'streaming', 'tool use', 'deployment', 'licensing']
+
+    def fetch_report(query: str) -> str:
+        """A long 'page' with one paragraph per topic."""
+        paragraphs = []
+        for topic in TOPICS * 5:
+            words = ' '.join(random.choices('the agent framework team model request user session'.split(), k=12))
+            paragraphs.append(' '.join(f"The {topic} section says {words} about {topic}." for _ in range(12)))
+        return '\n\n'.join(paragraphs)
+
+    store = ToolOutputStore()
+    tool = ChunkedAgentTool(AgentTool(name='fetch_report', func=fetch_report), store,
+                            ToolOutputOptions(max_chars=4000, top_k=3))
+    raw = fetch_report('')
+    output = asyncio.run(tool.func(query='streaming latency'))
+    print(f"raw output: {len(raw)} chars (~{estimate_tokens(raw)} tokens)")
+    print(f"returned:   {len(output)} chars (~{estimate_tokens(output)} tokens)")
+    print(output[:300] + ' ...')
+    print(output[-200:])
+    handle = output.split()[0].lstrip('[')
+    page = store.page_in(handle, query='licensing')
+    print(f"\npage-in by query 'licensing': {len(page)} chars")
+    print(page[:200] + ' ...')
+    print(f"\npage-in chunks 1,2: {store.page_in(handle, chunks='1, 2')[:120]} ...")
@@ -0,0 +1,423 @@
+"""
+Helpers around multi_agent_orchestrator's AgentTool / AgentTools.
+
+AsyncAgentTools is a drop-in AgentTools that keeps blocking tools off the event
+loop. The stock AgentTool wrapper calls a sync function (an HTTP search, a DB
+query) directly inside the coroutine, so one slow tool call stalls every other
+session on that loop. AsyncAgentTools runs sync functions on a bounded thread
+pool, awaits async ones directly, and applies per-tool concurrency limits and
+timeouts. When the model asks for several tools in one turn, the calls run
+concurrently and the toolResult blocks are returned in the original order, so
+the turn takes as long as the slowest tool rather than the sum of all of them:
+
+    tools = AsyncAgentTools([web_search_tool], max_workers=8,
+                            limits={'web_search': ToolLimits(max_concurrency=4, timeout=30)})
+
+MemoizedAgentTool is an opt-in cache in front of one tool. Calls are keyed on
+the tool name plus the normalized arguments (sorted keys, whitespace-trimmed
+strings). Only the arguments the tool declares case-insensitive are also
+case-folded, so 'TSLA' and ' tsla ' hit the same entry for a ticker while a
+file name or an id keeps its case. Entries expire after the tool's TTL and the
+least recently used one is dropped once the cache is full. Concurrent calls
+with the same key run the tool once; the others wait for that result.
+
+    get_stock_data_tool = MemoizedAgentTool(AgentTool(name="get_stock_data", func=get_stock_data),
+                                            ttl=300, case_insensitive=['symbol'])
+
+Per-request metrics (cache hits/misses, calls, seconds, timeouts per tool) are
+added to the response metadata when the request runs inside record_tool_metrics():
+
+    params = {}
+    with record_tool_metrics(params):
+        response = await orchestrator.route_request(user_input, user_id, session_id, params)
+    response.metadata.additional_params['tool_metrics']  # {'get_stock_data': {'hits': 2, 'misses': 1}}
+"""
+import asyncio
+import contextvars
+import inspect
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from multi_agent_orchestrator.types import AgentProviderType, ConversationMessage, ParticipantRole
+from multi_agent_orchestrator.utils import AgentTool, AgentTools, Logger
+from multi_agent_orchestrator.utils.tool import AgentToolResult
+
+# dict the tools of the current request report into, see record_tool_metrics()
+_tool_metrics: contextvars.ContextVar = contextvars.ContextVar('tool_metrics', default=None)
+# executor sync tools run on inside AsyncAgentTools, also used by wrapped tools such as MemoizedAgentTool
+_tool_executor: contextvars.ContextVar = contextvars.ContextVar('tool_executor', default=None)
+# parallel tool calls of one request report from several worker threads
+_tool_metrics_lock = threading.Lock()
+
+
+def _normalize(value: Any, casefold: bool = False) -> Any:
+    if isinstance(value, str):
+        value = ' '.join(value.split())
+        return value.casefold() if casefold else value
+    if isinstance(value, dict):
+        return {str(k): _normalize(v, casefold) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v, casefold) for v in value]
+    return value
+
+
+def normalized_key(arguments: Dict[str, Any], case_insensitive: Iterable[str] = ()) -> str:
+    """Cache key for tool arguments: order-independent and whitespace insensitive.
+
+    Strings in the top-level arguments named in case_insensitive are case-folded as well.
+    """
+    case_insensitive = set(case_insensitive)
+    normalized = {str(k): _normalize(v, k in case_insensitive) for k, v in arguments.items()}
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+
+
+@contextmanager
+def record_tool_metrics(additional_params: Optional[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Collect tool metrics of the enclosed request into additional_params['tool_metrics']."""
+    metrics = additional_params.setdefault('tool_metrics', {}) if additional_params is not None else {}
+    token = _tool_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _tool_metrics.reset(token)
+
+
+def report_tool_metric(tool_name: str, metric: str, amount: float = 1) -> None:
+    """Add to a metric of the current request, if one is being recorded."""
+    metrics = _tool_metrics.get()
+    if metrics is not None:
+        with _tool_metrics_lock:
+            tool_metrics = metrics.setdefault(tool_name, {})
+            tool_metrics[metric] = tool_metrics.get(metric, 0) + amount
+
+
+def is_async_tool(tool: AgentTool) -> bool:
+    """True when the function behind the AgentTool wrapper is a coroutine function."""
+    return inspect.iscoroutinefunction(inspect.unwrap(tool.func))
+
+
+async def call_tool(tool: AgentTool, arguments: Dict[str, Any], executor: Optional[Executor] = None) -> Any:
+    """Call a tool without blocking the loop: async tools are awaited, sync ones run on executor."""
+    if is_async_tool(tool):
+        return await tool.func(**arguments)
+    func = inspect.unwrap(tool.func)
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor or _tool_executor.get(), partial(context.run, func, **arguments))
+
+
+class ToolResultCache:
+    """Thread-safe LRU with a TTL; tools are called from the agents' worker threads."""
+
+    def __init__(self, ttl: Optional[float] = 300, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class MemoizedAgentTool(AgentTool):
+    """AgentTool that answers repeated calls with the same (normalized) arguments from a cache.
+
+    Args:
+        tool: The tool to wrap; its name, description and schema are reused.
+        ttl: Seconds a result stays valid, None keeps it until evicted.
+        max_entries: LRU size.
+        case_insensitive: Argument names whose values are case-folded in the key.
+        key_fn: Builds the cache key from the call arguments, defaults to normalized_key.
+
+    Identical calls that arrive while the first one is still running (from any
+    thread or event loop) wait for its result instead of calling the tool again.
+    Errors are not cached; they are passed to the waiting calls as well.
+    """
+
+    def __init__(self,
+                 tool: AgentTool,
+                 ttl: Optional[float] = 300,
+                 max_entries: int = 256,
+                 case_insensitive: Iterable[str] = (),
+                 key_fn: Optional[Callable[[Dict[str, Any]], str]] = None):
+        self.tool = tool
+        self.cache = ToolResultCache(ttl, max_entries)
+        self.key_fn = key_fn or partial(normalized_key, case_insensitive=tuple(case_insensitive))
+        self.shared = 0  # calls answered by waiting for an identical call in flight
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        super().__init__(name=tool.name,
+                         description=tool.func_description,
+                         properties=tool.properties,
+                         required=tool.required,
+                         func=self._call)
+
+    async def _call(self, **kwargs: Any) -> Any:
+        key = self.key_fn(kwargs)
+        while True:
+            found, result = self.cache.get(key)
+            if found:
+                report_tool_metric(self.name, 'hits')
+                return result
+            with self._lock:
+                pending = self._in_flight.get(key)
+                leader = pending is None
+                if leader:
+                    pending = self._in_flight[key] = Future()
+            if leader:
+                break
+            try:
+                # shield: a waiter that times out must not cancel the call the others wait for
+                result = await asyncio.shield(asyncio.wrap_future(pending))
+            except asyncio.CancelledError:
+                if pending.cancelled():
+                    continue  # the call we waited for was cancelled, not us: try again
+                raise
+            self.shared += 1
+            report_tool_metric(self.name, 'shared')
+            return result
+
+        report_tool_metric(self.name, 'misses')
+        try:
+            result = await call_tool(self.tool, kwargs)
+        except Exception as error:
+            self._finish(key)
+            pending.set_exception(error)
+            raise
+        except BaseException:
+            self._finish(key)
+            pending.cancel()
+            raise
+        self.cache.put(key, result)
+        self._finish(key)
+        pending.set_result(result)
+        return result
+
+    def _finish(self, key: str) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+
+@dataclass
+class ToolLimits:
+    max_concurrency: Optional[int] = None  # calls of this tool running at the same time
+    timeout: Optional[float] = None  # seconds before the model gets a timeout message instead of a result
+
+
+class AsyncAgentTools(AgentTools):
+    """AgentTools that runs sync tools on a bounded thread pool and awaits async tools directly.
+
+    Args:
+        tools: The tools, as for AgentTools.
+        max_workers: Size of the shared pool for sync tools without their own concurrency limit.
+        limits: Per-tool ToolLimits by tool name.
+        default_limits: Limits for tools not listed in limits.
+        parallel: Run the toolUse blocks of one model turn concurrently.
+
+    A sync tool with max_concurrency gets its own pool of that size, so the limit
+    holds across every event loop and thread that uses these tools. Async tools
+    are limited with one semaphore per event loop. A timed-out sync call keeps
+    running on its thread (threads cannot be interrupted); only the wait ends.
+    """
+
+    def __init__(self,
+                 tools: List[AgentTool],
+                 max_workers: int = 8,
+                 limits: Optional[Dict[str, ToolLimits]] = None,
+                 default_limits: Optional[ToolLimits] = None,
+                 parallel: bool = True):
+        super().__init__(tools)
+        self.parallel = parallel
+        self.limits = limits or {}
+        self.default_limits = default_limits or ToolLimits()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tool')
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._semaphores: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]' = \
+            weakref.WeakKeyDictionary()
+        for tool in tools:
+            inner = tool
+            while isinstance(inner, MemoizedAgentTool):
+                inner = inner.tool
+            limit = self._limits(tool.name).max_concurrency
+            if limit is not None and not is_async_tool(inner):
+                self._executors[tool.name] = ThreadPoolExecutor(max_workers=limit,
+                                                                thread_name_prefix=f'tool-{tool.name}')
+
+    def _limits(self, tool_name: str) -> ToolLimits:
+        return self.limits.get(tool_name, self.default_limits)
+
+    def _semaphore(self, tool_name: str) -> Optional[asyncio.Semaphore]:
+        limit = self._limits(tool_name).max_concurrency
+        if limit is None:
+            return None
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        if tool_name not in semaphores:
+            semaphores[tool_name] = asyncio.Semaphore(limit)
+        return semaphores[tool_name]
+
+    async def _run(self, tool: AgentTool, input_data: Dict[str, Any]) -> Any:
+        executor = self._executors.get(tool.name, self.executor)
+        token = _tool_executor.set(executor)
+        try:
+            if is_async_tool(tool) and self._semaphore(tool.name) is not None:
+                async with self._semaphore(tool.name):
+                    return await call_tool(tool, input_data, executor)
+            return await call_tool(tool, input_data, executor)
+        finally:
+            _tool_executor.reset(token)
+
+    async def _process_tool(self, tool_name: str, input_data: Dict[str, Any]) -> Any:
+        tool = next((tool for tool in self.tools if tool.name == tool_name), None)
+        if tool is None:
+            return f"Tool '{tool_name}' not found"
+        timeout = self._limits(tool_name).timeout
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self._run(tool, input_data), timeout)
+        except asyncio.TimeoutError:
+            Logger.warn(f"Tool {tool_name} timed out after {timeout}s")
+            report_tool_metric(tool_name, 'timeouts')
+            return f"Tool '{tool_name}' timed out after {timeout} seconds"
+        finally:
+            report_tool_metric(tool_name, 'calls')
+            report_tool_metric(tool_name, 'seconds', round(time.perf_counter() - start, 3))
+
+    async def tool_handler(self, provider_type, response: Any, _conversation: List[Dict[str, Any]]) -> Any:
+        if not response.content:
+            raise ValueError("No content blocks in response")
+        bedrock = provider_type == AgentProviderType.BEDROCK.value
+        calls = []
+        for block in response.content:
+            tool_use_block = self._get_tool_use_block(provider_type, block)
+            if not tool_use_block:
+                continue
+            if bedrock:
+                calls.append((tool_use_block.get("toolUseId"), tool_use_block.get("name"),
+                              tool_use_block.get("input", {})))
+            else:
+                calls.append((tool_use_block.id, tool_use_block.name, tool_use_block.input))
+
+        if self.parallel:
+            # gather keeps the order of the toolUse blocks
+            results = await asyncio.gather(*(self._process_tool(name, input_data) for _, name, input_data in calls))
+        else:
+            results = [await self._process_tool(name, input_data) for _, name, input_data in calls]
+
+        tool_results = []
+        for (tool_id, _, _), result in zip(calls, results):
+            tool_result = AgentToolResult(tool_id, result)
+            tool_results.append(tool_result.to_bedrock_format() if bedrock else tool_result.to_anthropic_format())
+
+        if bedrock:
+            return ConversationMessage(role=ParticipantRole.USER.value, content=tool_results)
+        return {'role': ParticipantRole.USER.value, 'content': tool_results}
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from stub_bedrock import StubBedrockServer
+
+    TOOL_SECONDS = 1.0
+
+    def slow_search(query: str) -> str:
+        """Search the web (blocking HTTP call)
+        :param query: what to search for
+        """
+        time.sleep(TOOL_SECONDS)
+        return json.dumps([{'title': f'result for {query}'}])
+
+    def responder(model_id, body):
+        # call the tool once, then answer
+        if any('toolResult' in block for message in body['messages'] for block in message['content']):
+            return [{'text': 'done'}]
+        return [{'toolUse': {'toolUseId': 'tooluse_1', 'name': 'slow_search', 'input': {'query': 'agents'}}}]
+
+    async def two_sessions(agent):
+        start = time.perf_counter()
+        await asyncio.gather(*(agent.process_request("research agents", f'user{i}', f'session{i}', [])
+                               for i in range(2)))
+        return time.perf_counter() - start
+
+    print(f"two concurrent sessions, one {TOOL_SECONDS:.0f}s blocking tool call each")
+    with StubBedrockServer(responder=responder) as server:
+        for name, tools in (("AgentTools", AgentTools([AgentTool(name='slow_search', func=slow_search)])),
+                            ("AsyncAgentTools", AsyncAgentTools([AgentTool(name='slow_search', func=slow_search)],
+                                                                limits={'slow_search': ToolLimits(timeout=5)}))):
+            agent = BedrockLLMAgent(BedrockLLMAgentOptions(
+                name='Research Agent', description='research', model_id='us.amazon.nova-pro-v1:0',
+                client=server.client(), streaming=False, tool_config={'tool': tools, 'toolMaxRecursions': 3}))
+            print(f"{name:<16} {asyncio.run(two_sessions(agent)):5.2f}s")
+
+    def get_stock_data(symbol: str) -> str:
+        """Get stock market data for a given symbol
+        :param symbol: ticker
+        """
+        time.sleep(0.6)
+        return json.dumps({'symbol': symbol, 'price': 180.25})
+
+    def get_news(query: str) -> str:
+        """Get recent news articles about a company
+        :param query: company
+        """
+        time.sleep(0.9)
+        return json.dumps([{'title': f'{query} expands production'}])
+
+    print("one model turn asking for get_stock_data (0.6s) and get_news (0.9s)")
+    # the model asks for both tools in the same turn
+    turn = ConversationMessage(role=ParticipantRole.ASSISTANT.value, content=[
+        {'toolUse': {'toolUseId': 'tooluse_stock', 'name': 'get_stock_data', 'input': {'symbol': 'TSLA'}}},
+        {'toolUse': {'toolUseId': 'tooluse_news', 'name': 'get_news', 'input': {'query': 'Tesla'}}}])
+    for name, parallel in (("one after another", False), ("concurrently", True)):
+        tools = AsyncAgentTools([AgentTool(name='get_stock_data', func=get_stock_data),
+                                 AgentTool(name='get_news', func=get_news)], parallel=parallel)
+        start = time.perf_counter()
+        result = asyncio.run(tools.tool_handler(AgentProviderType.BEDROCK.value, turn, []))
+        order = [block['toolResult']['toolUseId'] for block in result.content]
+        print(f"{name:<18} {time.perf_counter() - start:5.2f}s  results in order {order}")
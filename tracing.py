@@ -0,0 +1,525 @@
+"""
+Span-based latency tracing for orchestrators, classifiers, agents, tools and model calls.
+
+LOG_EXECUTION_TIMES only logs the classifier and agent durations as text, and
+the scripts time whole requests by hand, so in a nested supervisor tree there
+is no way to tell which hop was slow. Tracer records spans instead:
+
+- route_request of an orchestrator, classify of its classifier;
+- process_request of every agent, including the lead and team of a
+  (Parallel)SupervisorAgent, recursively, and the nodes of a GraphAgent;
+- every tool call of an AgentTools (send_messages of a supervisor is a tool
+  call too, so team calls nest under it);
+- every boto3 call of the clients those objects use (Converse, ConverseStream,
+  Retrieve, InvokeInlineAgent, ...): total time, time to first event of a
+  streamed response (ttft_ms) and input / output / cache tokens.
+
+Spans nest through a contextvar, which run_in_thread and the supervisors'
+worker threads carry over, so a team member's model call ends up under its
+agent span, under the supervisor's send_messages tool span, under the request.
+Finished spans go to exporters: JsonlExporter writes one JSON object per line,
+OtlpHttpExporter posts batches in the OTLP/HTTP JSON format to an
+OpenTelemetry collector (e.g. http://localhost:4318/v1/traces).
+
+    tracer = Tracer([JsonlExporter('traces.jsonl')])
+    tracer.instrument(orchestrator)  # or an agent, a classifier, an AgentTools, a boto3 client
+    with tracer.span('request', user_id=user_id):
+        await orchestrator.route_request(...)
+
+`python tracing.py traces.jsonl` prints the recorded traces as trees, with the
+slowest branch marked down to the slow hop; `python tracing.py` runs a nested supervisor against the
+stub Bedrock endpoint and prints its trace.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+from multi_agent_orchestrator.agents import Agent
+from multi_agent_orchestrator.classifiers import Classifier
+from multi_agent_orchestrator.orchestrator import MultiAgentOrchestrator
+from multi_agent_orchestrator.utils import AgentTools, Logger
+
+from model_router import ModelRouter
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+# parts of a boto3 response that are event streams (ConverseStream, InvokeInlineAgent, InvokeAgent)
+_STREAM_KEYS = ('stream', 'completion')
+
+
+class Span:
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'error')
+
+    def __init__(self, tracer: 'Tracer', name: str, kind: str, parent: Optional['Span'],
+                 attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = 'ok'
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def fail(self, error: Any) -> None:
+        self.status = 'error'
+        self.error = str(error)[:500]
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer._export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id,
+                'name': self.name, 'kind': self.kind, 'start_ns': self.start_ns, 'end_ns': self.end_ns,
+                'duration_ms': round(self.duration_ms, 3), 'status': self.status, 'error': self.error,
+                'attributes': self.attributes}
+
+
+class JsonlExporter:
+    """Appends each finished span to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def export(self, spans: List[Span]) -> None:
+        lines = ''.join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n' for span in spans)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': value if isinstance(value, str) else json.dumps(value, default=str)}
+
+
+class OtlpHttpExporter:
+    """Posts spans to an OpenTelemetry collector as OTLP/HTTP JSON, in batches from a background thread."""
+
+    _KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+    def __init__(self, endpoint: str = 'http://localhost:4318/v1/traces', service_name: str = 'multi-agent-orchestrator',
+                 batch_size: int = 256, interval: float = 2.0, timeout: float = 5.0,
+                 headers: Optional[Dict[str, str]] = None):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+        self._pending: List[Span] = []
+        self._lock = threading.Condition()
+        self._stopped = False
+        self.counts = {'exported': 0, 'failed': 0}
+        self._thread = threading.Thread(target=self._run, name='otlp-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, spans: List[Span]) -> None:
+        with self._lock:
+            self._pending.extend(spans)
+            if len(self._pending) >= self.batch_size:
+                self._lock.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._lock.wait(self.interval)
+                batch, self._pending = self._pending, []
+                stopped = self._stopped
+            if batch:
+                self._post(batch)
+            if stopped:
+                return
+
+    def _post(self, spans: List[Span]) -> None:
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': [{
+                'traceId': span.trace_id,
+                'spanId': span.span_id,
+                **({'parentSpanId': span.parent_id} if span.parent_id else {}),
+                'name': span.name,
+                'kind': self._KINDS.get(span.kind, 1),
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in span.attributes.items()],
+                'status': {'code': 2, 'message': span.error or ''} if span.status == 'error' else {'code': 1},
+            } for span in spans]}],
+        }]}
+        request = urllib.request.Request(self.endpoint, data=json.dumps(payload).encode('utf-8'),
+                                         headers=self.headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            self.counts['exported'] += len(spans)
+        except Exception as error:
+            self.counts['failed'] += len(spans)
+            Logger.warn(f"[tracing] could not export {len(spans)} spans to {self.endpoint}: {error}")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        self._thread.join(self.timeout + 1)
+
+
+class _TracedEventStream:
+    """Wraps a boto3 event stream: records time to first event and token usage, ends the span when consumed."""
+
+    def __init__(self, stream: Any, span: Span):
+        self._stream = stream
+        self._span = span
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        first = True
+        try:
+            for event in self._stream:
+                if first:
+                    self._span.set('ttft_ms', round(self._span.duration_ms, 3))
+                    first = False
+                if 'metadata' in event:
+                    _record_usage(self._span, event['metadata'].get('usage', {}))
+                yield event
+        except Exception as error:
+            self._span.fail(error)
+            raise
+        finally:
+            self._span.end()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def _record_usage(span: Span, usage: Dict[str, Any]) -> None:
+    span.set('input_tokens', usage.get('inputTokens'))
+    span.set('output_tokens', usage.get('outputTokens'))
+    span.set('cache_read_tokens', usage.get('cacheReadInputTokens'))
+    span.set('cache_write_tokens', usage.get('cacheWriteInputTokens'))
+
+
+class Tracer:
+    def __init__(self, exporters: Optional[List[Any]] = None):
+        self.exporters = list(exporters or [])
+        self._instrumented: set = set()
+
+    def start_span(self, name: str, kind: str = 'internal', **attributes: Any) -> Span:
+        """A span under the current one, not made current; end() it yourself."""
+        return Span(self, name, kind, _current_span.get(), attributes)
+
+    @contextmanager
+    def span(self, name: str, kind: str = 'internal', **attributes: Any) -> Iterator[Span]:
+        span = self.start_span(name, kind, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.fail(error)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def _export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export([span])
+            except Exception as error:
+                Logger.warn(f"[tracing] exporter {type(exporter).__name__} failed: {error}")
+
+    def shutdown(self) -> None:
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+    def _wrap(self, owner: Any, method_name: str, span_name: Union[str, Callable[..., str]],
+              attributes: Callable[..., Dict[str, Any]],
+              on_result: Optional[Callable[[Span, Any], None]] = None) -> None:
+        """Replace owner.method_name (on the instance) with a version running inside a span."""
+        method = getattr(owner, method_name)
+        tracer = self
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def traced(*args, **kwargs):
+                name = span_name(*args, **kwargs) if callable(span_name) else span_name
+                with tracer.span(name, **attributes(*args, **kwargs)) as span:
+                    result = await method(*args, **kwargs)
+                    if on_result is not None:
+                        on_result(span, result)
+                    return result
+        else:
+            @functools.wraps(method)
+            def traced(*args, **kwargs):
+                name = span_name(*args, **kwargs) if callable(span_name) else span_name
+                span = tracer.start_span(name, **attributes(*args, **kwargs))
+                token = _current_span.set(span)
+                try:
+                    result = method(*args, **kwargs)
+                except BaseException as error:
+                    span.fail(error)
+                    span.end()
+                    raise
+                finally:
+                    _current_span.reset(token)
+                if inspect.isawaitable(result):
+                    # e.g. AgentTools._process_tool of an async tool: the work happens when it is awaited
+                    return tracer._await_in_span(span, result, on_result)
+                if on_result is not None:
+                    on_result(span, result)
+                span.end()
+                return result
+        setattr(owner, method_name, traced)
+
+    @staticmethod
+    async def _await_in_span(span: Span, awaitable: Any, on_result: Optional[Callable[[Span, Any], None]]) -> Any:
+        token = _current_span.set(span)
+        try:
+            result = await awaitable
+            if on_result is not None:
+                on_result(span, result)
+            return result
+        except BaseException as error:
+            span.fail(error)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def instrument(self, target: Any) -> Any:
+        """Trace an orchestrator, classifier, agent, AgentTools, ModelRouter or boto3 client and everything it contains."""
+        if target is None or id(target) in self._instrumented:
+            return target
+        self._instrumented.add(id(target))
+
+        if isinstance(target, MultiAgentOrchestrator):
+            self._wrap(target, 'route_request', 'route_request',
+                       lambda user_input, user_id, session_id, *a, **k: {'user_id': user_id, 'session_id': session_id},
+                       lambda span, response: span.set('agent', getattr(response.metadata, 'agent_name', None)))
+            self.instrument(target.classifier)
+            for agent in target.agents.values():
+                self.instrument(agent)
+        elif isinstance(target, Classifier):
+            self._wrap(target, 'classify', 'classify', lambda *a, **k: {'classifier': type(target).__name__},
+                       lambda span, result: span.set('selected_agent', getattr(result.selected_agent, 'name', None)))
+            self._instrument_clients(target)
+        elif isinstance(target, Agent):
+            self._wrap(target, 'process_request', f'agent {target.name}',
+                       lambda input_text, user_id, session_id, *a, **k: {
+                           'agent': target.name, 'agent_type': type(target).__name__,
+                           'user_id': user_id, 'session_id': session_id})
+            self._instrument_clients(target)
+            tool_config = getattr(target, 'tool_config', None) or {}
+            if isinstance(tool_config.get('tool'), AgentTools):
+                self.instrument(tool_config['tool'])
+            for child in _child_agents(target):
+                self.instrument(child)
+        elif isinstance(target, AgentTools):
+            self._wrap(target, '_process_tool', lambda tool_name, *a, **k: f'tool {tool_name}',
+                       lambda tool_name, *a, **k: {'tool': tool_name})
+        elif isinstance(target, ModelRouter):
+            for model_target in target.targets:
+                self.instrument(model_target.client)
+        elif hasattr(getattr(target, 'meta', None), 'events'):
+            events = target.meta.events
+            events.register('before-call', self._before_call)
+            events.register('after-call', self._after_call)
+            events.register('after-call-error', self._after_call_error)
+        return target
+
+    def _instrument_clients(self, owner: Any) -> None:
+        for name in ('client', 'bedrock_agent_client'):
+            self.instrument(getattr(owner, name, None))
+        retriever = getattr(owner, 'retriever', None)
+        while retriever is not None and id(retriever) not in self._instrumented:
+            self._instrumented.add(id(retriever))
+            self.instrument(getattr(retriever, 'client', None))
+            retriever = getattr(retriever, 'retriever', None)
+
+    def _before_call(self, model: Any, params: Dict[str, Any], context: Dict[str, Any], **kwargs: Any) -> None:
+        context['trace_span'] = self.start_span(
+            f'{model.service_model.service_name} {model.name}', kind='client',
+            service=model.service_model.service_name, operation=model.name, model_id=params.get('modelId'))
+
+    def _after_call(self, http_response: Any, parsed: Dict[str, Any], model: Any, context: Dict[str, Any],
+                    **kwargs: Any) -> None:
+        span = context.pop('trace_span', None)
+        if span is None:
+            return
+        span.set('http_status', getattr(http_response, 'status_code', None))
+        if 'Error' in parsed:
+            span.fail(parsed['Error'].get('Code') or parsed['Error'].get('Message'))
+        _record_usage(span, parsed.get('usage') or {})
+        stream_key = next((key for key in _STREAM_KEYS if hasattr(parsed.get(key), '__iter__')
+                           and not isinstance(parsed.get(key), (str, bytes, dict, list))), None)
+        if stream_key is not None and span.status == 'ok':
+            # the span ends once the caller has read the whole stream
+            parsed[stream_key] = _TracedEventStream(parsed[stream_key], span)
+        else:
+            span.end()
+
+    def _after_call_error(self, exception: Exception, context: Dict[str, Any], **kwargs: Any) -> None:
+        span = context.pop('trace_span', None)
+        if span is not None:
+            span.fail(exception)
+            span.end()
+
+
+def _child_agents(agent: Agent) -> List[Agent]:
+    children = []
+    if isinstance(getattr(agent, 'lead_agent', None), Agent):
+        children.append(agent.lead_agent)
+    children.extend(member for member in getattr(agent, 'team', None) or [] if isinstance(member, Agent))
+    nodes = getattr(agent, 'nodes', None)
+    if isinstance(nodes, dict):
+        children.extend(node.agent for node in nodes.values() if isinstance(getattr(node, 'agent', None), Agent))
+    return children
+
+
+def read_spans(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def format_trace(spans: List[Dict[str, Any]]) -> str:
+    """One trace as an indented tree: offset, duration, name, attributes; '*' follows the slowest child down."""
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {span['span_id'] for span in spans}
+    for span in sorted(spans, key=lambda s: s['start_ns']):
+        children.setdefault(span['parent_id'] if span['parent_id'] in ids else None, []).append(span)
+    start = min(span['start_ns'] for span in spans)
+    lines = []
+
+    def walk(span: Dict[str, Any], depth: int, critical: bool) -> None:
+        attributes = {key: value for key, value in span['attributes'].items()
+                      if key in ('agent_type', 'ttft_ms', 'input_tokens', 'output_tokens', 'selected_agent')}
+        status = '' if span['status'] == 'ok' else f"  ERROR {span['error']}"
+        lines.append(f"{'*' if critical else ' '} {(span['start_ns'] - start) / 1e6:8.1f}ms "
+                     f"{span['duration_ms']:8.1f}ms  {'  ' * depth}{span['name']}"
+                     f"{'  ' + json.dumps(attributes) if attributes else ''}{status}")
+        kids = children.get(span['span_id'], [])
+        slowest = max(kids, key=lambda s: s['duration_ms']) if kids else None
+        for kid in kids:
+            walk(kid, depth + 1, critical and kid is slowest)
+
+    for root in children.get(None, []):
+        walk(root, 0, True)
+    return '\n'.join(lines)
+
+
+def print_traces(spans: List[Dict[str, Any]]) -> None:
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    for span in spans:
+        traces.setdefault(span['trace_id'], []).append(span)
+    for trace_id, trace in traces.items():
+        print(f"trace {trace_id}  {len(trace)} spans")
+        print("    offset  duration  span")
+        print(format_trace(trace))
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1:
+        print_traces(read_spans(sys.argv[1]))
+        sys.exit()
+
+    from multi_agent_orchestrator.agents import BedrockLLMAgent, BedrockLLMAgentOptions
+    from multi_agent_orchestrator.classifiers import BedrockClassifier, BedrockClassifierOptions
+    from multi_agent_orchestrator.orchestrator import OrchestratorConfig
+    from multi_agent_orchestrator.utils import AgentTool
+    from parallel_supervisor import ParallelSupervisorAgent, ParallelSupervisorAgentOptions
+    from stub_bedrock import StubBedrockServer, default_responder
+
+    MODELID = 'us.amazon.nova-pro-v1:0'
+
+    def responder(model_id, body):
+        """Supervisor hands off to both analysts; analysts call their tool once, then answer."""
+        tools = [tool['toolSpec']['name'] for tool in body.get('toolConfig', {}).get('tools', [])]
+        step = sum(1 for message in body['messages'] for block in message['content'] if 'toolResult' in block)
+        if 'send_messages' in tools:
+            if step == 0:
+                return [{'toolUse': {'toolUseId': 'tooluse_plan', 'name': 'send_messages', 'input': {'messages': [
+                    {'recipient': 'financial_analyst', 'content': 'analyse TSLA'},
+                    {'recipient': 'news_analyst', 'content': 'TSLA news'}]}}}]
+            return [{'text': 'TSLA research report. TERMINATE'}]
+        if tools and 'analyzePrompt' not in tools and step == 0:
+            spec = body['toolConfig']['tools'][0]['toolSpec']
+            argument = next(iter(spec['inputSchema']['json']['properties']))
+            return [{'toolUse': {'toolUseId': 'tooluse_data', 'name': spec['name'], 'input': {argument: 'TSLA'}}}]
+        return default_responder(model_id, body)
+
+    def get_news(query: str) -> str:
+        time.sleep(0.8)  # the slow hop
+        return json.dumps([{'title': 'Tesla news'}])
+
+    path = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+    with StubBedrockServer(latency=0.1, token_delay=0.002, responder=responder) as server:
+        client = server.client()
+        llm_config = dict(model_id=MODELID, client=client)
+        orchestrator = MultiAgentOrchestrator(
+            classifier=BedrockClassifier(BedrockClassifierOptions(model_id=MODELID, client=client)),
+            options=OrchestratorConfig(USE_DEFAULT_AGENT_IF_NONE_IDENTIFIED=False))
+        orchestrator.add_agent(ParallelSupervisorAgent(ParallelSupervisorAgentOptions(
+            name="Stock research supervisor", description="market research of stocks such as TSLA",
+            lead_agent=BedrockLLMAgent(BedrockLLMAgentOptions(
+                name="planner-manager", description="a research planning coordinator.", streaming=True,
+                **llm_config)),
+            team=[
+                BedrockLLMAgent(BedrockLLMAgentOptions(
+                    name="financial_analyst", description="For stock data analysis", **llm_config,
+                    tool_config={'tool': AgentTools([AgentTool(
+                        name='get_stock_data', func=lambda symbol: json.dumps({'price': 180.25}),
+                        description='Get stock market data',
+                        properties={'symbol': {'type': 'string', 'description': 'ticker'}})]),
+                        'toolMaxRecursions': 5})),
+                BedrockLLMAgent(BedrockLLMAgentOptions(
+                    name="news_analyst", description="a news analyst.", **llm_config,
+                    tool_config={'tool': AgentTools([AgentTool(
+                        name='get_news', func=get_news, description='Get recent news',
+                        properties={'query': {'type': 'string', 'description': 'query'}})]),
+                        'toolMaxRecursions': 5})),
+            ],
+        )))
+
+        tracer = Tracer([JsonlExporter(path)])
+        tracer.instrument(orchestrator)
+        asyncio.run(orchestrator.route_request("Conduct market research for TSLA stock", 'user1', 'session1'))
+        tracer.shutdown()
+
+    print(f"spans written to {path}")
+    print_traces(read_spans(path))
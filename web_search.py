@@ -0,0 +1,294 @@
+"""
+Search layer for the deep research agents (08).
+
+The analysts used to get `str(result)` of an Exa search: the repr of every hit
+with up to 10,000 characters of page text each, so one search could cost more
+than 10k prompt tokens, and the same pages came back again and again when the
+planner, the information analyst and the critic searched for similar things.
+
+WebSearch sits between the tool and the search API:
+
+- results are cached on local disk, keyed by the normalized query, so repeated
+  searches (in this run or the next one) do not hit the API again;
+- inside `with searcher.session():` (one research request) pages are deduplicated
+  by URL and by a hash of their normalized text (mirrors, syndicated copies); a
+  page that was already returned to the same reader comes back as a one-line
+  reference instead of its text again. The seen pages belong to the request
+  (a contextvar, so concurrent sessions do not see each other's) and are
+  forgotten when it ends;
+- each new page is reduced to a compact JSON record (title, url, date and the
+  sentences that best match the query, up to `snippet_chars`);
+- stats() reports how many prompt tokens that saved compared to the raw text.
+
+With an `output_store` (tool_output.ToolOutputStore) the full text of every
+returned page is kept in chunks behind a handle shown next to its snippet, and
+the agent pages in more of it with the store's read_tool_output tool.
+
+    searcher = WebSearch(exa_search_fn(exa_client), WebSearchOptions(cache_dir='.search_cache'))
+
+    def web_search(query: str):
+        return searcher.search(query, reader='information_analyst')
+
+    with searcher.session():
+        response = await orchestrator.route_request(user_input, user_id, session_id, {})
+
+Run `python web_search.py` for a simulated research session with overlapping
+queries and duplicated pages.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from multi_agent_orchestrator.utils import Logger
+
+from text_utils import estimate_tokens, normalize_text, split_sentences, tokenize, STOPWORDS
+from tool_output import ToolOutputStore, chunk_text
+from tool_utils import report_tool_metric
+
+# one page of a search response: url, title, text and optionally published_date / author
+SearchResult = Dict[str, Any]
+SearchFn = Callable[[str], List[SearchResult]]
+
+_RESULT_FIELDS = ('url', 'title', 'published_date', 'author', 'text')
+
+
+def exa_search_fn(exa_client, max_characters: int = 10000, num_results: int = 10) -> SearchFn:
+    """Adapt exa_py's search_and_contents to a function returning plain result dicts."""
+    def search(query: str) -> List[SearchResult]:
+        response = exa_client.search_and_contents(query, num_results=num_results,
+                                                  text={"max_characters": max_characters})
+        return [{name: getattr(result, name, None) for name in _RESULT_FIELDS}
+                for result in response.results]
+    return search
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def compact_snippet(text: str, query: str, max_chars: int = 600) -> str:
+    """The sentences of text that share the most terms with the query, in page order, up to max_chars."""
+    sentences = [s.strip() for s in split_sentences(' '.join((text or '').split()))]
+    sentences = [s for s in sentences if s]
+    if not sentences:
+        return ''
+    terms = {word for word in tokenize(query) if word not in STOPWORDS}
+    scored = sorted(range(len(sentences)),
+                    key=lambda i: (-len(terms.intersection(tokenize(sentences[i]))), i))
+    chosen, used = [], 0
+    for i in scored:
+        if used and used + len(sentences[i]) > max_chars:
+            continue
+        chosen.append(i)
+        used += len(sentences[i]) + 1
+        if used >= max_chars:
+            break
+    snippet = ' '.join(sentences[i] for i in sorted(chosen))
+    return snippet if len(snippet) <= max_chars else snippet[:max_chars - 1].rstrip() + '…'
+
+
+@dataclass
+class WebSearchOptions:
+    cache_dir: Optional[str] = '.search_cache'  # None disables the disk cache
+    ttl: Optional[float] = 24 * 3600  # seconds before a cached query is searched again, None = never
+    snippet_chars: int = 600  # text kept per page
+    max_results: int = 5  # new pages returned per search
+    tool_name: str = 'web_search'  # name used for report_tool_metric()
+    output_store: Optional[ToolOutputStore] = None  # keeps full pages for read_tool_output
+    chunk_chars: int = 800  # chunk size of pages in output_store
+
+
+class _SeenPages:
+    __slots__ = ('urls', 'hashes')
+
+    def __init__(self):
+        self.urls: Dict[str, str] = {}  # url -> query that first returned it
+        self.hashes: Dict[str, str] = {}  # content hash -> url it was returned under
+
+
+class WebSearch:
+    def __init__(self, search_fn: SearchFn, options: Optional[WebSearchOptions] = None):
+        self.search_fn = search_fn
+        self.options = options or WebSearchOptions()
+        if self.options.cache_dir:
+            os.makedirs(self.options.cache_dir, exist_ok=True)
+        # tools run on a thread pool, possibly several searches at once
+        self._lock = threading.Lock()
+        # reader -> pages already returned to it, for the request being processed (see session())
+        self._session: contextvars.ContextVar = contextvars.ContextVar('web_search_session', default=None)
+        self.reset()
+
+    @contextmanager
+    def session(self) -> Iterator[None]:
+        """Deduplicate the pages returned inside the block; they are forgotten when it exits.
+
+        Tool calls made for the enclosed request see the same seen pages (the
+        contextvar is copied to the tool threads); other requests, even for the
+        same user and session, start empty. Outside a session nothing is deduplicated.
+        """
+        token = self._session.set({})
+        try:
+            yield
+        finally:
+            self._session.reset(token)
+
+    def _seen(self, reader: str) -> Optional[_SeenPages]:
+        readers = self._session.get()
+        if readers is None:
+            return None
+        with self._lock:
+            return readers.setdefault(reader, _SeenPages())
+
+    def reset(self) -> None:
+        """Zero the stats."""
+        with self._lock:
+            self._stats = {'searches': 0, 'cache_hits': 0, 'pages': 0, 'duplicate_urls': 0,
+                           'duplicate_content': 0, 'raw_tokens': 0, 'returned_tokens': 0}
+
+    def _cache_path(self, query: str) -> str:
+        key = hashlib.sha1(normalize_text(query).encode('utf-8')).hexdigest()
+        return os.path.join(self.options.cache_dir, f'{key}.json')
+
+    def _load(self, query: str) -> Optional[List[SearchResult]]:
+        if not self.options.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(query), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if self.options.ttl is not None and time.time() - entry['fetched_at'] > self.options.ttl:
+            return None
+        return entry['results']
+
+    def _store(self, query: str, results: List[SearchResult]) -> None:
+        if not self.options.cache_dir:
+            return
+        path = self._cache_path(query)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'query': query, 'fetched_at': time.time(), 'results': results}, f,
+                          ensure_ascii=False, default=str)
+            os.replace(temp_path, path)
+        except OSError as error:
+            Logger.warn(f"[web_search] could not cache results for {query!r}: {error}")
+
+    def fetch(self, query: str) -> List[SearchResult]:
+        """Raw results for a query, from the disk cache when possible."""
+        results = self._load(query)
+        if results is not None:
+            with self._lock:
+                self._stats['cache_hits'] += 1
+            report_tool_metric(self.options.tool_name, 'disk_hits')
+            return results
+        results = self.search_fn(query)
+        self._store(query, results)
+        return results
+
+    def search(self, query: str, reader: str = '') -> str:
+        """Search and return compact JSON: new pages as snippets, already returned pages as references.
+
+        Pages are deduplicated per reader (e.g. the agent name) inside session(),
+        so one agent is not handed back a page only another agent has read.
+        """
+        results = self.fetch(query)
+        seen = self._seen(reader) or _SeenPages()
+        pages, duplicates = [], []
+        with self._lock:
+            self._stats['searches'] += 1
+            for result in results:
+                url, text = result.get('url') or '', result.get('text') or ''
+                digest = content_hash(text) if text.strip() else None
+                if url in seen.urls:
+                    self._stats['duplicate_urls'] += 1
+                    duplicates.append({'title': result.get('title'), 'url': url,
+                                       'returned_for': seen.urls[url]})
+                elif digest and digest in seen.hashes:
+                    self._stats['duplicate_content'] += 1
+                    duplicates.append({'title': result.get('title'), 'url': url,
+                                       'same_content_as': seen.hashes[digest]})
+                elif len(pages) < self.options.max_results:
+                    seen.urls[url] = query
+                    if digest:
+                        seen.hashes[digest] = url
+                    record = {'title': result.get('title'), 'url': url,
+                              'published': result.get('published_date'),
+                              'snippet': compact_snippet(text, query, self.options.snippet_chars)}
+                    if self.options.output_store is not None and len(text) > len(record['snippet']):
+                        chunks = chunk_text(text, self.options.chunk_chars)
+                        record['full_text'] = {'handle': self.options.output_store.put(chunks, source=url),
+                                               'chunks': len(chunks)}
+                    pages.append(record)
+            self._stats['pages'] += len(pages)
+
+        output = json.dumps({'query': query, 'results': pages, 'already_returned': duplicates},
+                            ensure_ascii=False, default=str)
+        # what the old tool sent: every hit with its full text
+        raw_tokens = estimate_tokens(json.dumps(results, ensure_ascii=False, default=str))
+        returned_tokens = estimate_tokens(output)
+        with self._lock:
+            self._stats['raw_tokens'] += raw_tokens
+            self._stats['returned_tokens'] += returned_tokens
+        report_tool_metric(self.options.tool_name, 'tokens_saved', max(0, raw_tokens - returned_tokens))
+        return output
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['saved_tokens'] = max(0, stats['raw_tokens'] - stats['returned_tokens'])
+        stats['saved_pct'] = round(100 * stats['saved_tokens'] / stats['raw_tokens'], 1) if stats['raw_tokens'] else 0.0
+        return stats
+
+
+if __name__ == "__main__":
+    import random
+    import shutil
+    import tempfile
+
+    random.seed(7)
+    TOPICS = ['autogen', 'langgraph', 'multi agent orchestrator', 'crewai']
+    WORDS = ('agents tools memory routing planner workflow graph state streaming latency '
+             'python typescript bedrock model prompt team supervisor classifier').split()
+
+    def page(topic, n):
+        body = ' '.join(f"{topic.title()} {' '.join(random.choices(WORDS, k=12))}." for _ in range(120))
+        return {'url': f'https://example.com/{topic.replace(" ", "-")}/{n}', 'title': f'{topic} article {n}',
+                'published_date': '2025-01-01', 'text': body[:10000]}
+
+    CORPUS = {topic: [page(topic, n) for n in range(8)] for topic in TOPICS}
+    # a syndicated copy of a langgraph article under another domain
+    CORPUS['langgraph'].append(dict(CORPUS['langgraph'][0], url='https://mirror.example.org/langgraph-0'))
+    api_calls = 0
+
+    def fake_search(query):
+        """Stands in for the search API: pages of every topic the query mentions."""
+        global api_calls
+        api_calls += 1
+        time.sleep(0.2)
+        hits = [p for topic in TOPICS if topic in query.lower() for p in CORPUS[topic]]
+        return hits[:10]
+
+    QUERIES = ['AutoGen features', 'LangGraph features', 'autogen vs langgraph', 'langgraph  Features',
+               'Multi Agent Orchestrator routing', 'autogen features', 'crewai vs multi agent orchestrator',
+               'LangGraph state and memory', 'langgraph features']
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for run in (1, 2):
+            searcher = WebSearch(fake_search, WebSearchOptions(cache_dir=cache_dir))
+            api_calls = 0
+            t1 = time.perf_counter()
+            with searcher.session():
+                for query in QUERIES:
+                    searcher.search(query)
+            elapsed = time.perf_counter() - t1
+            print(f"research session {run}: {len(QUERIES)} searches, {api_calls} API calls, {elapsed:.2f}s")
+            print(f"  {searcher.stats()}")
+    finally:
+        shutil.rmtree(cache_dir)